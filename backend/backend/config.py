@@ -1,6 +1,8 @@
 import os
 import logging  # Import logging module
-from typing import Any
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, List, Optional, Sequence
 
 from dotenv import load_dotenv
 from sqlalchemy.ext.asyncio import (
@@ -12,50 +14,156 @@ from sqlalchemy.ext.asyncio import (
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.types import JSON
 from sqlalchemy import text
+from sqlalchemy.engine import make_url
 
 # Configure logging
 logging.basicConfig()
-logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
 
 load_dotenv(verbose=True)
 
+# After load_dotenv, the metrics settings are read from the environment too
+from .metrics import DB_METRICS, TimedQueuePool, instrument  # noqa: E402
+
 DB_CONFIG: str = os.environ["DB_CONFIG"]
 if not DB_CONFIG:
     raise EnvironmentError("The environment variable 'DB_CONFIG' is not set.")
 
+# Connection pool settings, only applied to server databases (postgres)
+DB_POOL_SIZE: int = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW: int = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT: float = float(os.environ.get("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE: int = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING: bool = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# Log every statement through SQLAlchemy's echo, for debugging only
+DB_ECHO: bool = os.environ.get("DB_ECHO", "false").lower() in ("1", "true", "yes")
+# asyncpg prepared statement cache per connection, 0 disables it (needed behind pgbouncer)
+DB_STATEMENT_CACHE_SIZE: int = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", "500"))
+# Read replicas of DB_CONFIG, comma separated urls. The repository reads go
+# to them, writes and everything else to the primary
+DB_REPLICAS: List[str] = [
+    url.strip() for url in os.environ.get("DB_REPLICAS", "").split(",") if url.strip()
+]
+# How a read picks its replica: round_robin or least_connections
+DB_REPLICA_POLICY: str = os.environ.get("DB_REPLICA_POLICY", "round_robin")
+
+# The session bound to the current task / request. Each asyncio task has its own
+# copy of the context, so concurrent requests never see each other's session.
+_current_session: ContextVar[Optional[AsyncSession]] = ContextVar(
+    "current_session", default=None
+)
+# Set by a write, the reads of the rest of the task / request then go to the
+# primary so they see it (read your writes) whatever the replication lag
+_wrote: ContextVar[bool] = ContextVar("wrote", default=False)
+
+
+def engine_options(url: str) -> dict[str, Any]:
+    if not url.startswith("postgresql"):
+        return {}
+
+    options: dict[str, Any] = {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DB_METRICS:
+        options["poolclass"] = TimedQueuePool
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE
+        }
+    return options
 
 
 class Base(DeclarativeBase):
     type_annotation_map = {dict[str, Any]: JSON}
 
 
+def make_engine(url: str) -> AsyncEngine:
+    engine = create_async_engine(url, echo=DB_ECHO, **engine_options(url))
+    if DB_METRICS:
+        instrument(engine.sync_engine)
+    return engine
+
+
 class DatabaseSession:
 
-    def __init__(self, url: str = DB_CONFIG):
+    def __init__(
+        self,
+        url: str = DB_CONFIG,
+        replicas: Sequence[str] = (),
+        replica_policy: str = DB_REPLICA_POLICY,
+    ):
+        if replica_policy not in ("round_robin", "least_connections"):
+            raise ValueError(f"Invalid replica policy {replica_policy!r}")
         self.db_url = url
-        self.engine: AsyncEngine = create_async_engine(url, echo=True)  # Enable echo
-        self.SessionLocal = async_sessionmaker(
-            bind=self.engine, class_=AsyncSession, expire_on_commit=False
-        )   
-    async def create_db_if_not_exists(self):
-        # Extract the database name from the URL
-        
-        db_name = self.db_url.rsplit('/', 1)[-1]
-        default_db_url = self.db_url.rsplit('/', 1)[0] + '/postgres'
-
-        # Connect to the default 'postgres' database
-        default_engine = create_async_engine(default_db_url, echo=True)
-        async with default_engine.connect() as conn:
-            result = await conn.execute(
-                text(f"SELECT 1 FROM pg_database WHERE datname = '{db_name}'")
+        self.replica_urls = list(replicas)
+        self.replica_policy = replica_policy
+        # Engines are created on first use: importing the config opens no pool
+        self._engine: Optional[AsyncEngine] = None
+        self._sessions: Optional[async_sessionmaker] = None
+        self._replicas: Optional[List[AsyncEngine]] = None
+        self._replica_sessions: List[async_sessionmaker] = []
+        # Read sessions open per replica, and the round robin position
+        self.replica_reads = [0] * len(self.replica_urls)
+        self._next_replica = 0
+        self._scopes: ContextVar[tuple] = ContextVar(f"db_scopes_{id(self)}", default=())
+
+    @property
+    def engine(self) -> AsyncEngine:
+        if self._engine is None:
+            self._engine = make_engine(self.db_url)
+        return self._engine
+
+    @property
+    def SessionLocal(self) -> async_sessionmaker:
+        if self._sessions is None:
+            self._sessions = async_sessionmaker(
+                bind=self.engine, class_=AsyncSession, expire_on_commit=False
             )
-            exists = result.scalar() is not None
+        return self._sessions
 
-            if not exists:
-                await conn.execute(text(f"COMMIT"))  # Ensure no transaction is active
-                await conn.execute(text(f"CREATE DATABASE {db_name}"))
+    def _create_replicas(self) -> None:
+        self._replicas = [make_engine(url) for url in self.replica_urls]
+        self._replica_sessions = [
+            async_sessionmaker(bind=replica, class_=AsyncSession, expire_on_commit=False)
+            for replica in self._replicas
+        ]
 
-        await default_engine.dispose()
+    @property
+    def replicas(self) -> List[AsyncEngine]:
+        if self._replicas is None:
+            self._create_replicas()
+        return self._replicas
+
+    @property
+    def ReplicaSessions(self) -> List[async_sessionmaker]:
+        if self._replicas is None:
+            self._create_replicas()
+        return self._replica_sessions
+
+    async def create_db_if_not_exists(self):
+        url = make_url(self.db_url)
+        if url.get_backend_name() != "postgresql":
+            return
+
+        # Connect to the default 'postgres' database, CREATE DATABASE cannot
+        # run in a transaction
+        default_engine = create_async_engine(
+            url.set(database="postgres"), echo=DB_ECHO, isolation_level="AUTOCOMMIT"
+        )
+        try:
+            async with default_engine.connect() as conn:
+                result = await conn.execute(
+                    text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                    {"name": url.database},
+                )
+                if result.scalar() is None:
+                    quote = conn.dialect.identifier_preparer.quote
+                    await conn.execute(text(f"CREATE DATABASE {quote(url.database)}"))
+        finally:
+            await default_engine.dispose()
 
     async def create_all(self):
         await self.create_db_if_not_exists()
@@ -66,24 +174,102 @@ class DatabaseSession:
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.drop_all)
 
-    # Closing the database connection
+    # Closing the database connection, the engines are created again on next use
     async def close(self):
-        await self.engine.dispose()
+        if self._engine is not None:
+            await self._engine.dispose()
+        for replica in self._replicas or ():
+            await replica.dispose()
+        self._engine, self._sessions, self._replicas = None, None, None
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[AsyncSession]:
+        # Reuse the session of an enclosing scope (eg: the request dependency),
+        # otherwise open one for this task and close it on exit
+        current = _current_session.get()
+        if current is not None:
+            yield current
+            return
+
+        async with self.SessionLocal() as session:
+            token = _current_session.set(session)
+            try:
+                yield session
+            finally:
+                _current_session.reset(token)
+
+    def pick_replica(self) -> int:
+        start = self._next_replica
+        count = len(self.replica_urls)
+        self._next_replica = (start + 1) % count
+        if self.replica_policy == "round_robin":
+            return start
+        # Fewest open reads, ties broken round robin
+        order = [(start + i) % count for i in range(count)]
+        return min(order, key=self.replica_reads.__getitem__)
+
+    @asynccontextmanager
+    async def read_session(self) -> AsyncIterator[AsyncSession]:
+        """Session for read only queries, on a replica when there are any.
+
+        Stays on the primary (the session of the enclosing scope, if any)
+        after a write of the current task / request, or while the enclosing
+        session is in a transaction that may hold uncommitted writes.
+        """
+        current = _current_session.get()
+        if (
+            not self.replica_urls
+            or _wrote.get()
+            or (current is not None and current.in_transaction())
+        ):
+            async with self.session() as session:
+                yield session
+            return
+
+        index = self.pick_replica()
+        self.replica_reads[index] += 1
+        try:
+            async with self.ReplicaSessions[index]() as session:
+                yield session
+        finally:
+            self.replica_reads[index] -= 1
+
+    def mark_written(self) -> None:
+        """Route the reads of the rest of the current task / request to the primary."""
+        if self.replica_urls:
+            _wrote.set(True)
+
+    @property
+    def current_session(self) -> Optional[AsyncSession]:
+        return _current_session.get()
 
     # Prepare context for the async operations
     async def __aenter__(self) -> AsyncSession:
-        self.session = self.SessionLocal()
-        return self.session
+        scope = self.session()
+        session = await scope.__aenter__()
+        self._scopes.set(self._scopes.get() + (scope,))
+        return session
 
     # it is used to clean up resource , etc.
     async def __aexit__(self, exc_type, exc_value, traceback):
-        await self.session.close_all()
+        scopes = self._scopes.get()
+        self._scopes.set(scopes[:-1])
+        await scopes[-1].__aexit__(exc_type, exc_value, traceback)
 
     async def commit_rollback(self):
+        session = _current_session.get()
+        if session is None:
+            raise RuntimeError("No database session is active in this context")
         try:
-            await self.session.commit()
+            await session.commit()
         except Exception as e:
-            await self.session.rollback()
+            await session.rollback()
             raise e
 
-db: DatabaseSession = DatabaseSession()
+db: DatabaseSession = DatabaseSession(DB_CONFIG, DB_REPLICAS)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency, one session per request shared by all repositories."""
+    async with db.session() as session:
+        yield session
@@ -1,16 +1,53 @@
-from fastapi import FastAPI
-from backend.config import DatabaseSession
+from typing import Optional
+
+import pyarrow as pa
+
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from backend.config import db
+from backend.metrics import metrics
+from backend.migrations import check_schema
+from backend.service.changes import CHANGE_FEED_ENABLED, change_feed
+from backend.service.datasource import source_pools
+from backend.service.lineage import LineageService
+from backend.service.manifest import ManifestCompiler, json_property
+from backend.service.profiler import ColumnProfiler
+from backend.service.purge import PURGE_ENABLED, TombstonePurger
+from backend.service.scheduler import REFRESH_ENABLED, RefreshScheduler
+from backend.service.search import MAX_SEARCH_LIMIT, SEARCH_LIMIT, CatalogSearch
+from backend.service.snapshot import CatalogSnapshots
+from backend.service.transfer import MEDIA_TYPE, CatalogExporter, CatalogImporter
+from backend.repository.project import Project, ProjectRepository
 from contextlib import asynccontextmanager
+from tempfile import SpooledTemporaryFile
 
 def init_app() -> FastAPI:
-    db = DatabaseSession()
+    search = CatalogSearch()
+    lineage = LineageService()
+    manifests = ManifestCompiler()
+    snapshots = CatalogSnapshots()
+    projects = ProjectRepository(Project)
 
     @asynccontextmanager
     async def lifespan(app: FastAPI):
-        await db.create_all()
+        # Provisioning is the bootstrap command's job (python -m backend.migrations)
+        await check_schema()
+        scheduler = RefreshScheduler()
+        if REFRESH_ENABLED:
+            await scheduler.start()
+        purger = TombstonePurger()
+        if PURGE_ENABLED:
+            await purger.start()
+        await source_pools.start()
+        if CHANGE_FEED_ENABLED:
+            await change_feed.start()
         try:
             yield
         finally:
+            await change_feed.stop()
+            await source_pools.stop()
+            await purger.stop()
+            await scheduler.stop()
             await db.close()
 
     app = FastAPI(
@@ -24,6 +61,97 @@ def init_app() -> FastAPI:
     def read_root():
         return "Welocome to Db Catalog Backend Server"
 
+    @app.get("/metrics")
+    def read_metrics():
+        return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/projects/{project_id}/search")
+    async def search_catalog(
+        project_id: str,
+        q: str,
+        limit: int = Query(SEARCH_LIMIT, ge=0, le=MAX_SEARCH_LIMIT),
+        offset: int = Query(0, ge=0),
+    ):
+        return await search.search(project_id, q, {"limit": limit, "offset": offset})
+
+    @app.get("/projects/{project_id}/lineage/{kind}/{id}")
+    async def lineage_of(
+        project_id: str,
+        kind: str,
+        id: str,
+        direction: str = "impact",
+        depth: Optional[int] = None,
+        order: str = "bfs",
+    ):
+        try:
+            return await lineage.traverse(
+                project_id, kind, id, {"direction": direction, "depth": depth, "order": order}
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    @app.get("/projects/{project_id}/manifest")
+    async def manifest_of(project_id: str, if_none_match: Optional[str] = Header(None)):
+        manifest = await manifests.get(project_id)
+        if manifest is None:
+            raise HTTPException(status_code=404, detail=f"Project {project_id} not found")
+        headers = {"ETag": manifest.etag, "X-Manifest-Version": str(manifest.version)}
+        if if_none_match == manifest.etag:
+            return Response(status_code=304, headers=headers)
+        return Response(manifest.content, media_type="application/json", headers=headers)
+
+    @app.get("/projects/{project_id}/models")
+    async def models_of(project_id: str, response: Response):
+        snapshot = await snapshots.get(project_id)
+        if snapshot is None:
+            raise HTTPException(status_code=404, detail=f"Project {project_id} not found")
+        response.headers["X-Snapshot-Version"] = str(snapshot.version)
+        return [
+            model._asdict() | {"columns": snapshot.offsets[i + 1] - snapshot.offsets[i]}
+            for i, model in enumerate(snapshot.models)
+        ]
+
+    @app.get("/projects/{project_id}/models/{reference_name}")
+    async def model_of(project_id: str, reference_name: str, response: Response):
+        snapshot = await snapshots.get(project_id)
+        model = snapshot and snapshot.model_by_name(reference_name)
+        if model is None:
+            raise HTTPException(status_code=404, detail=f"Model {reference_name} not found")
+        response.headers["X-Snapshot-Version"] = str(snapshot.version)
+        return model._asdict() | {
+            "columns": [
+                column._asdict() | {"properties": json_property(column.properties)}
+                for column in snapshot.columns_of(model.id)
+            ]
+        }
+
+    @app.post("/projects/{project_id}/profile")
+    async def profile_project(project_id: str):
+        project = await projects.get_one_by_id(project_id)
+        if project is None:
+            raise HTTPException(status_code=404, detail=f"Project {project_id} not found")
+        progress = await ColumnProfiler(project).run()
+        return {"tables": progress.tables, "columns": progress.columns, "failed": progress.failed}
+
+    @app.get("/projects/{project_id}/export")
+    async def export_project(project_id: str):
+        if await projects.get_one_by_id(project_id) is None:
+            raise HTTPException(status_code=404, detail=f"Project {project_id} not found")
+        return StreamingResponse(CatalogExporter().stream(project_id), media_type=MEDIA_TYPE)
+
+    @app.post("/projects/import")
+    async def import_project(request: Request, name: Optional[str] = None):
+        # Spooled to disk past 8MB, the arrow reader needs a file
+        with SpooledTemporaryFile(max_size=8 << 20) as file:
+            async for chunk in request.stream():
+                file.write(chunk)
+            file.seek(0)
+            try:
+                project_id = await CatalogImporter().run(file, {"name": name} if name else {})
+            except (ValueError, pa.ArrowInvalid) as e:
+                raise HTTPException(status_code=400, detail=str(e))
+        return {"id": project_id}
+
 
     return app
 
@@ -0,0 +1,194 @@
+import functools
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: statement / repository / pool timings for the /metrics endpoint
+DB_METRICS: bool = os.environ.get("DB_METRICS", "false").lower() in ("1", "true", "yes")
+# Statements slower than this are logged with their SQL, 0 disables the log
+DB_SLOW_QUERY_MS: float = float(os.environ.get("DB_SLOW_QUERY_MS", "500"))
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROWS_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Leading keyword and first table of a statement, the label of its histograms
+_STATEMENT = re.compile(
+    r"^\s*(?:(select)\b.*?\bfrom\s+([\w.\"]+)|(insert)\s+into\s+([\w.\"]+)"
+    r"|(update)\s+([\w.\"]+)|(delete)\s+from\s+([\w.\"]+)|(\w+))",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label, prometheus style."""
+
+    def __init__(self, name: str, help: str, label: str, buckets: Iterable[float]):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        # label value -> [count per bucket ..., +Inf count], sum
+        self.series: dict[str, tuple[List[int], List[float]]] = {}
+
+    def observe(self, label: str, value: float) -> None:
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def count(self, label: str) -> int:
+        series = self.series.get(label)
+        return sum(series[0]) if series else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label, (counts, total) in sorted(self.series.items()):
+            value = label.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {total[0]}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {cumulative}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.slow_query_seconds = DB_SLOW_QUERY_MS / 1000
+        self.statement_seconds = Histogram(
+            "db_statement_seconds", "Statement latency", "statement", SECONDS_BUCKETS
+        )
+        self.statement_rows = Histogram(
+            "db_statement_rows", "Rows affected by DML statements", "statement", ROWS_BUCKETS
+        )
+        self.repository_seconds = Histogram(
+            "db_repository_seconds", "Repository method latency", "method", SECONDS_BUCKETS
+        )
+        self.repository_rows = Histogram(
+            "db_repository_rows", "Rows returned / written by repository methods", "method", ROWS_BUCKETS
+        )
+        self.pool_wait_seconds = Histogram(
+            "db_pool_checkout_seconds", "Wait for a pooled connection", "pool", SECONDS_BUCKETS
+        )
+        self.slow_queries = 0
+
+    @property
+    def histograms(self) -> tuple[Histogram, ...]:
+        return (
+            self.statement_seconds,
+            self.statement_rows,
+            self.repository_seconds,
+            self.repository_rows,
+            self.pool_wait_seconds,
+        )
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for histogram in self.histograms:
+            lines.extend(histogram.render())
+        lines.append("# HELP db_slow_queries_total Statements slower than the slow query threshold")
+        lines.append("# TYPE db_slow_queries_total counter")
+        lines.append(f"db_slow_queries_total {self.slow_queries}")
+        return "\n".join(lines) + "\n"
+
+
+metrics: Metrics = Metrics()
+
+
+def statement_label(statement: str) -> str:
+    """eg: "select model", "insert model_column", the histogram label of a statement."""
+    match = _STATEMENT.match(statement)
+    if match is None:
+        return "other"
+    words = [group for group in match.groups() if group]
+    return " ".join(word.lower().strip('"') for word in words)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    label = statement_label(statement)
+    metrics.statement_seconds.observe(label, elapsed)
+    rowcount = getattr(cursor, "rowcount", -1)
+    if rowcount is not None and rowcount >= 0 and not label.startswith("select"):
+        metrics.statement_rows.observe(label, rowcount)
+    if metrics.slow_query_seconds and elapsed >= metrics.slow_query_seconds:
+        metrics.slow_queries += 1
+        logger.warning("Slow query (%.0f ms): %s", elapsed * 1000, statement[:2000])
+
+
+def _handle_error(context):
+    starts = context.connection.info.get("query_start") if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def instrument(engine: Engine) -> None:
+    """Record statement timings of a (sync) engine, see Metrics."""
+    metrics.enabled = True
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool recording how long a checkout waits."""
+
+    def _do_get(self) -> Any:
+        if not metrics.enabled:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            metrics.pool_wait_seconds.observe("default", time.perf_counter() - start)
+
+
+def _rows(result: Any) -> Optional[int]:
+    if result is None:
+        return 0
+    if isinstance(result, bool):
+        return None
+    if isinstance(result, int):
+        # Deleted / updated row counts
+        return result
+    if hasattr(result, "next_cursor"):
+        return len(result.items)
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return 1
+
+
+def timed(method: Callable) -> Callable:
+    """Record latency and row count of an async repository method."""
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        if not metrics.enabled:
+            return await method(self, *args, **kwargs)
+        start = time.perf_counter()
+        result = await method(self, *args, **kwargs)
+        label = f"{type(self).__name__}.{method.__name__}"
+        metrics.repository_seconds.observe(label, time.perf_counter() - start)
+        rows = _rows(result)
+        if rows is not None:
+            metrics.repository_rows.observe(label, rows)
+        return result
+
+    return wrapper
@@ -0,0 +1,143 @@
+"""Versioned schema of the catalog database.
+
+On startup the app only reads the recorded version (check_schema), a single
+query. Everything that changes the database runs through the bootstrap
+command (uses DB_CONFIG, run from the backend folder):
+    python -m backend.migrations
+
+It creates the database when missing, then applies the MIGRATIONS newer than
+the recorded version in one transaction, recording each in schema_version.
+Every migration is idempotent, so a catalog created before the version table
+is brought up to date by applying all of them.
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Callable, List, NamedTuple
+
+from sqlalchemy import Column, DateTime, Integer, String, Table, func, insert, inspect, select, text
+from sqlalchemy.engine import Connection
+
+from ..config import Base, db
+from ..repository import column_profile, column_relation, model, model_column, project, view  # noqa: F401
+from ..service import purge  # noqa: F401, the archive tables
+from ..service.locks import advisory_key
+from . import uuid_keys
+
+logger = logging.getLogger(__name__)
+
+schema_version = Table(
+    "schema_version",
+    Base.metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[Connection], Any]
+
+
+def create_tables(conn: Connection) -> None:
+    Base.metadata.create_all(conn)
+
+
+def add_missing(conn: Connection) -> List[str]:
+    """Add the columns and indexes of the metadata missing from existing
+    tables, the statements executed. Columns added after a table was first
+    created are all nullable."""
+    inspector = inspect(conn)
+    quote = conn.dialect.identifier_preparer.quote
+    statements: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                statements.append(
+                    f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} "
+                    f"{column.type.compile(conn.dialect)}"
+                )
+                logger.info(statements[-1])
+                conn.execute(text(statements[-1]))
+        for index in table.indexes:
+            # Skips existing indexes and the ones of other dialects (ddl_if)
+            index.create(conn, checkfirst=True)
+    return statements
+
+
+MIGRATIONS: List[Migration] = [
+    # Keys first: tables created next reference the existing ones with uuid
+    # foreign keys, postgres rejects those on text keys
+    Migration(1, "uuid primary and foreign keys", uuid_keys.migrate),
+    Migration(2, "create the catalog tables", create_tables),
+    Migration(3, "refreshed_at / fingerprint columns, live and search indexes", add_missing),
+    Migration(4, "column_profile sketches and archive tables", create_tables),
+]
+
+# Version of the schema this code runs on
+SCHEMA_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: Connection) -> int:
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def apply_pending(conn: Connection) -> List[int]:
+    """Apply the migrations newer than the recorded version, the versions applied."""
+    schema_version.create(conn, checkfirst=True)
+    current = current_version(conn)
+    applied = []
+    for migration in MIGRATIONS:
+        if migration.version <= current:
+            continue
+        logger.info("Applying schema version %s: %s", migration.version, migration.description)
+        migration.apply(conn)
+        conn.execute(
+            insert(schema_version).values(
+                version=migration.version,
+                description=migration.description,
+                applied_at=datetime.now(),
+            )
+        )
+        applied.append(migration.version)
+    return applied
+
+
+async def bootstrap() -> List[int]:
+    """Provision the database and bring its schema to SCHEMA_VERSION."""
+    await db.create_db_if_not_exists()
+    async with db.engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Concurrent bootstraps (eg: several deploy jobs) run one after the other
+            await conn.execute(
+                text("SELECT pg_advisory_xact_lock(:key)"), {"key": advisory_key("schema")}
+            )
+        return await conn.run_sync(apply_pending)
+
+
+async def check_schema() -> int:
+    """The recorded schema version; fails when the database was not
+    bootstrapped or is behind this code."""
+    try:
+        async with db.engine.connect() as conn:
+            version = await conn.run_sync(current_version)
+    except Exception as e:
+        # Missing table, or database (not always wrapped by SQLAlchemy)
+        raise RuntimeError(
+            f"Cannot read the schema version ({getattr(e, 'orig', e)!r}), "
+            "run: python -m backend.migrations"
+        ) from e
+    if version < SCHEMA_VERSION:
+        raise RuntimeError(
+            f"Database schema version {version}, this code needs {SCHEMA_VERSION}, "
+            "run: python -m backend.migrations"
+        )
+    if version > SCHEMA_VERSION:
+        # Rolling deploy: the schema was migrated for newer workers
+        logger.warning("Database schema version %s is newer than %s", version, SCHEMA_VERSION)
+    return version
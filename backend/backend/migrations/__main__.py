@@ -0,0 +1,18 @@
+import asyncio
+
+from ..config import db
+from . import SCHEMA_VERSION, bootstrap
+
+
+async def main() -> None:
+    try:
+        applied = await bootstrap()
+    finally:
+        await db.close()
+    if applied:
+        print(f"Applied schema versions {', '.join(map(str, applied))}")
+    print(f"Schema version {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
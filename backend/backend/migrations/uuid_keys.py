@@ -0,0 +1,94 @@
+"""Convert the text primary / foreign keys of an existing catalog to UUID_KEY.
+
+Schema version 2, applied by the bootstrap command (python -m backend.migrations),
+or on its own (uses DB_CONFIG, run from the backend folder):
+    python -m backend.migrations.uuid_keys
+
+Existing ids keep their value (uuid4 strings), only new rows get time ordered
+uuid7 keys. Postgres columns become native uuid: the foreign keys are dropped,
+the columns converted with USING col::uuid and the foreign keys re-created, in
+one transaction. Other databases store UUID_KEY as 32 hex digits, the dashes
+are stripped from the stored values. Running it again changes nothing.
+"""
+
+import asyncio
+import logging
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection
+
+from ..config import db
+
+logger = logging.getLogger(__name__)
+
+# Columns holding catalog ids, per table
+KEY_COLUMNS = {
+    "project": ("id",),
+    "model": ("id", "project_id"),
+    "model_column": ("id", "model_id"),
+    "view": ("id", "project_id"),
+    "relation": ("id", "project_id", "from_column_id", "to_column_id"),
+}
+
+
+def migrate(conn: Connection) -> List[str]:
+    """Run the conversion on a connection, returns the statements executed."""
+    inspector = inspect(conn)
+    tables = [table for table in KEY_COLUMNS if inspector.has_table(table)]
+    quote = conn.dialect.identifier_preparer.quote
+    statements: List[str] = []
+
+    if conn.dialect.name == "postgresql":
+        pending = {
+            table: [
+                column["name"]
+                for column in inspector.get_columns(table)
+                if column["name"] in KEY_COLUMNS[table]
+                and column["type"].__visit_name__.lower() != "uuid"
+            ]
+            for table in tables
+        }
+        if not any(pending.values()):
+            return statements
+
+        foreign_keys = [
+            (table, fk) for table in tables for fk in inspector.get_foreign_keys(table)
+        ]
+        for table, fk in foreign_keys:
+            statements.append(f"ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(fk['name'])}")
+        for table, columns in pending.items():
+            if columns:
+                changes = ", ".join(
+                    f"ALTER COLUMN {quote(c)} TYPE uuid USING {quote(c)}::uuid" for c in columns
+                )
+                statements.append(f"ALTER TABLE {quote(table)} {changes}")
+        for table, fk in foreign_keys:
+            statements.append(
+                f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(fk['name'])} "
+                f"FOREIGN KEY ({', '.join(map(quote, fk['constrained_columns']))}) "
+                f"REFERENCES {quote(fk['referred_table'])} "
+                f"({', '.join(map(quote, fk['referred_columns']))})"
+            )
+    else:
+        for table in tables:
+            assignments = ", ".join(
+                f"{quote(c)} = replace({quote(c)}, '-', '')" for c in KEY_COLUMNS[table]
+            )
+            statements.append(f"UPDATE {quote(table)} SET {assignments}")
+
+    for statement in statements:
+        logger.info(statement)
+        conn.execute(text(statement))
+    return statements
+
+
+async def main() -> None:
+    async with db.engine.begin() as conn:
+        statements = await conn.run_sync(migrate)
+    await db.close()
+    print(f"{len(statements)} statements executed")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
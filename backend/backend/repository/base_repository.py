@@ -1,20 +1,215 @@
+import base64
+import copy
+import json
+import os
+import time
+import weakref
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Any, List, Optional
-from uuid import uuid4
+from functools import cached_property
+from itertools import islice
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+from uuid import UUID
 
 from sqlalchemy import delete as sql_delete
-from sqlalchemy import select
+from sqlalchemy import insert as sql_insert
+from sqlalchemy import (
+    DDL,
+    Index,
+    Select,
+    Text,
+    Uuid,
+    bindparam,
+    cast,
+    column,
+    event,
+    func,
+    literal_column,
+    or_,
+    select,
+    text,
+    tuple_,
+    values,
+)
 from sqlalchemy import update as sql_update
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import (
+    Mapped,
+    declared_attr,
+    make_transient_to_detached,
+    mapped_column,
+)
+from sqlalchemy.types import JSON
 
 from ..config import Base, db
+from ..metrics import timed
+from .cache import MISSING, EntityCache
+
+# Rows per INSERT ... VALUES / COPY batch used by create_many in bulk mode
+BULK_BATCH_SIZE = 1000
+
+# Rows fetched per round trip from the server side cursor of stream_all_by
+STREAM_BATCH_SIZE = 500
+
+# Default page size of find_page_by
+PAGE_SIZE = 100
+
+# Statements of find_one_by / find_all_by kept by query shape, see statement_by
+STATEMENT_CACHE_SIZE = 512
+_statements: OrderedDict[tuple, Select] = OrderedDict()
+
+
+class WriteEvent(NamedTuple):
+    # Table name of the written entity
+    table: str
+    # create, update, upsert, delete or soft_delete; resync (no ids) when any
+    # row of the table may have changed, eg: writes of another worker were missed
+    action: str
+    ids: tuple
+
+
+# Called synchronously after every committed repository write, used by the
+# in-process indexes / caches built on top of the catalog tables
+_write_listeners: List[Callable[[WriteEvent], Any]] = []
+
+
+def add_write_listener(listener: Callable[[WriteEvent], Any]) -> None:
+    _write_listeners.append(listener)
+
+
+def remove_write_listener(listener: Callable[[WriteEvent], Any]) -> None:
+    if listener in _write_listeners:
+        _write_listeners.remove(listener)
+
+
+# Entity caches of the repositories by table
+_entity_caches: dict[str, weakref.WeakSet] = {}
+
+
+def dispatch_write(event: WriteEvent) -> None:
+    """Apply a write, of this process or another worker, to the entity caches
+    and the write listeners."""
+    for cache in list(_entity_caches.get(event.table, ())):
+        if event.action == "resync":
+            cache.clear()
+        else:
+            cache.invalidate(*event.ids)
+    for listener in list(_write_listeners):
+        listener(event)
+
+
+class Page(NamedTuple):
+    items: List[Any]
+    # Token for the next page, None on the last page
+    next_cursor: Optional[str]
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, str]:
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), id
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor {cursor}") from e
+
+
+def _order_key(order_by: Iterable[Any]) -> Optional[tuple]:
+    """Statement cache key of an order_by: column names and the SQL structure
+    of the expressions, which are new objects on every call. None when an
+    expression holds values of its own (eg: a literal) or has no key."""
+    keys = []
+    for item in order_by:
+        if isinstance(item, str):
+            keys.append(item)
+            continue
+        key = item._generate_cache_key()
+        if key is None or key.bindparams:
+            return None
+        keys.append(key.key)
+    return tuple(keys)
+
+
+# Type of the primary keys and of the columns referencing them: native uuid on
+# postgres, CHAR(32) elsewhere, a str in python
+UUID_KEY = Uuid(as_uuid=False)
+
+
+def uuid7(timestamp_ms: Optional[int] = None, random_bits: Optional[int] = None) -> str:
+    """Time ordered uuid (RFC 9562 version 7): 48 bits of unix time in
+    milliseconds followed by random bits, so new keys land at the right end of
+    the primary key btree instead of anywhere in it."""
+    if timestamp_ms is None:
+        timestamp_ms = time.time_ns() // 1_000_000
+    if random_bits is None:
+        random_bits = int.from_bytes(os.urandom(10), "big")
+    value = ((timestamp_ms & 0xFFFF_FFFF_FFFF) << 80) | (random_bits & ((1 << 80) - 1))
+    # Version 7 and the RFC variant replace 4 + 2 of the random bits
+    value = (value & ~(0xF << 76)) | (0x7 << 76)
+    value = (value & ~(0x3 << 62)) | (0x2 << 62)
+    return str(UUID(int=value))
+
+
+def live_indexes(table: str, indexes: Iterable[tuple], unique: Iterable[tuple]) -> tuple:
+    """Partial indexes over the live rows (deleted_at IS NULL) of a table, the
+    only rows the repository queries read, so soft deleted rows cost no index
+    space and the planner can use them for every filtered lookup."""
+    live = text("deleted_at IS NULL")
+    return tuple(
+        Index(
+            f"{prefix}_{table}_{'_'.join(columns)}",
+            *columns,
+            unique=prefix == "ux",
+            postgresql_where=live,
+            sqlite_where=live,
+        )
+        for prefix, group in (("ux", unique), ("ix", indexes))
+        for columns in group
+    )
+
+
+def tombstone_index(table: str) -> Index:
+    """The soft deleted rows of a table, found by the tombstone purge."""
+    deleted = text("deleted_at IS NOT NULL")
+    return Index(
+        f"ix_{table}_deleted_at",
+        "deleted_at",
+        postgresql_where=deleted,
+        sqlite_where=deleted,
+    )
 
 
 class BaseModel(Base):
     __abstract__ = True
 
-    id: Mapped[str] = mapped_column(primary_key=True, default=None)
+    # Column name tuples indexed over the live rows, see live_indexes. The
+    # foreign key / lookup columns go first; (..., created_at, id) serves the
+    # keyset order of find_page_by
+    __live_indexes__: tuple = ()
+    # Same, unique among the live rows (natural keys)
+    __unique_live_indexes__: tuple = ()
+
+    @declared_attr.directive
+    def __table_args__(cls) -> tuple:
+        return live_indexes(
+            cls.__tablename__, cls.__live_indexes__, cls.__unique_live_indexes__
+        ) + (tombstone_index(cls.__tablename__),)
+
+    id: Mapped[str] = mapped_column(UUID_KEY, primary_key=True, default=None)
     created_at: Mapped[datetime]
     updated_at: Mapped[datetime]
     deleted_at: Mapped[datetime] = mapped_column(default=None, nullable=True)
@@ -23,30 +218,82 @@ class BaseModel(Base):
     deleted_by: Mapped[str] = mapped_column(default=None, nullable=True)
 
 
+# Trigram operator classes of the search indexes
+event.listen(
+    Base.metadata,
+    "before_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+
+
+def search_indexes(column: Any) -> List[Index]:
+    """Postgres trigram (similarity, ILIKE) and full text GIN indexes on a name column."""
+    table = column.table.name
+    return [
+        Index(
+            f"ix_{table}_{column.key}_trgm",
+            column,
+            postgresql_using="gin",
+            postgresql_ops={column.key: "gin_trgm_ops"},
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            f"ix_{table}_{column.key}_tsv",
+            search_vector(column),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+    ]
+
+
+def search_vector(column: Any) -> Any:
+    # Must stay identical to the indexed expression for the planner to use it
+    return func.to_tsvector(literal_column("'simple'"), column)
+
+
 class BaseRepository(ABC):
 
-    def __init__(self, entity: object):        
+    def __init__(self, entity: object, cache: Optional[EntityCache] = None):
         self.entity: Any = entity
+        # Optional read-through cache of get_one_by_id, can be shared between
+        # repository instances of the same entity
+        self.cache = cache
+        if cache is not None:
+            _entity_caches.setdefault(self.entity.__tablename__, weakref.WeakSet()).add(cache)
+
+    @staticmethod
+    def default_values_for_create() -> dict:
+        now = datetime.now()
+        return {
+            "id": uuid7(),
+            "created_at": now,
+            "updated_at": now,
+            "created_by": "admin",
+            "updated_by": "admin",
+        }
 
     @staticmethod
     def set_default_for_create(entity: BaseModel) -> BaseModel:
-        entity.id = str(uuid4())
-        entity.created_at = datetime.now()
-        entity.updated_at = datetime.now()
-        entity.created_by = "admin"
-        entity.updated_by = "admin"
+        for key, value in BaseRepository.default_values_for_create().items():
+            setattr(entity, key, value)
         return entity
 
+    @staticmethod
+    def default_values_for_update() -> dict:
+        return {"updated_at": datetime.now(), "updated_by": "admin"}
+
+    @staticmethod
+    def default_values_for_delete() -> dict:
+        return {"deleted_at": datetime.now(), "deleted_by": "admin"}
+
     @staticmethod
     def set_default_for_update(entity: Any) -> Any:
-        entity.updated_at = datetime.now()
-        entity.updated_by = "admin"
+        for key, value in BaseRepository.default_values_for_update().items():
+            setattr(entity, key, value)
         return entity
 
     @staticmethod
     def set_default_for_delete(entity: Any) -> Any:
-        entity.deleted_at = datetime.now()
-        entity.deleted_by = "admin"
+        for key, value in BaseRepository.default_values_for_delete().items():
+            setattr(entity, key, value)
         return entity
 
     @abstractmethod
@@ -69,6 +316,18 @@ class BaseRepository(ABC):
     async def find_all(self, query_options: Optional[dict] = None) -> List[Any]:
         pass
 
+    @abstractmethod
+    def stream_all_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> AsyncIterator[Any]:
+        pass
+
+    @abstractmethod
+    async def find_page_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> Page:
+        pass
+
     @abstractmethod
     async def create_one(self, data: Any, query_options: Optional[dict] = None) -> Any:
         pass
@@ -85,6 +344,18 @@ class BaseRepository(ABC):
     ) -> Any:
         pass
 
+    @abstractmethod
+    async def update_many(
+        self, data: List[dict], query_options: Optional[dict] = None
+    ) -> int:
+        pass
+
+    @abstractmethod
+    async def upsert_many(
+        self, data: Iterable[Any], query_options: Optional[dict] = None
+    ) -> List[Any]:
+        pass
+
     @abstractmethod
     async def delete_one(self, id: str, query_options: Optional[dict] = None) -> int:
         pass
@@ -110,145 +381,607 @@ class BaseRepository(ABC):
 
 class BasicRepository(BaseRepository):
 
+    # Natural key columns used as the ON CONFLICT target of upsert_many,
+    # backed by a unique index on the entity table
+    natural_key: tuple[str, ...] = ()
+
+    # Columns never overwritten by an upsert of an existing row
+    upsert_exclude: tuple[str, ...] = (
+        "id",
+        "created_at",
+        "created_by",
+        "deleted_at",
+        "deleted_by",
+    )
+
+    @timed
     async def get_one_by_id(self, id: str) -> Optional[object]:
-        async with db as session:
+        if self.cache is not None:
+            cached = self.cache.get(id)
+            if cached is MISSING:
+                return None
+            if cached is not None:
+                return self.from_cache(cached)
+            # Taken before the read: an invalidation during it wins
+            version = self.cache.version()
+
+        # Cache misses are read from the primary: a lagging replica could
+        # otherwise put back a row version a write just invalidated
+        async with (db.read_session() if self.cache is None else db.session()) as session:
             stmt = select(self.entity).where(
                 self.entity.id == id, self.entity.deleted_at.is_(None)
             )
 
             result = await session.execute(stmt)
-            return result.scalars().one_or_none()
+            entity = result.scalars().one_or_none()
 
-    async def find_one_by(
-        self, filter: dict, query_options: Optional[dict] = None
-    ) -> Optional[object]:
-        async with db.session as session:
-            stmt = (
-                select(self.entity)
-                .filter_by(**filter)
-                .where(self.entity.deleted_at.is_(None))
-            )  # type: ignore
+        if self.cache is not None:
+            self.cache.set(
+                id, MISSING if entity is None else self.to_cache(entity), version
+            )
+        return entity
 
-            if query_options and "order_by" in query_options:
-                stmt = stmt.order_by(query_options["order_by"])
+    def to_cache(self, entity: Any) -> dict:
+        values = vars(entity)
+        return {key: values.get(key) for key in self.column_keys}
 
+    def from_cache(self, values: dict) -> Any:
+        # A fresh detached instance per hit, callers never share (or mutate) the
+        # cached values and can still merge it into their session
+        entity = self.entity(**copy.deepcopy(values))
+        make_transient_to_detached(entity)
+        return entity
+
+    def after_write(self, action: str, ids: Iterable[Any]) -> None:
+        """Called after every committed write with the ids it touched."""
+        db.mark_written()
+        ids = tuple(ids)
+        if ids:
+            dispatch_write(WriteEvent(self.entity.__tablename__, action, ids))
+
+    @timed
+    async def find_ids_by_natural_key(
+        self, keys: List[tuple], query_options: Optional[dict] = None
+    ) -> dict[tuple, Any]:
+        """Map natural key values (in natural_key order) to the ids of live rows."""
+        if not keys:
+            return {}
+        key_columns = [getattr(self.entity, key) for key in self.natural_key]
+        stmt = select(self.entity.id, *key_columns).where(
+            tuple_(*key_columns).in_(keys), self.entity.deleted_at.is_(None)
+        )
+        async with db.session() as session:
             result = await session.execute(stmt)
-            return result.scalars().first()
+            return {tuple(row[1:]): row[0] for row in result.all()}
 
+    def statement_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> tuple[Select, dict]:
+        """Statement of find_all_by and its parameters.
+
+        Values are bound parameters, so the statement only depends on the
+        shape of the query: the entity, the filter keys and the options used.
+        It is built once per shape and reused, along with its compiled form
+        and, on postgres, the prepared statement of the connection.
+
+        filter: column name -> value, equality (IS NULL for None)
+        query_options:
+            in: column name -> values, the column is one of the values
+            range: column name -> (low, high), low <= column < high, a None
+                   bound is left open
+            limit: maximum number of rows
+            columns: column names, rows with only these columns instead of entities
+            order_by: column name, column or expression, or a tuple of them
+        """
+        query_options = query_options or {}
+        params: dict[str, Any] = {}
+        equal = []
+        for key, value in sorted(filter.items()):
+            equal.append((key, value is None))
+            if value is not None:
+                params[f"eq_{key}"] = value
+        within = tuple(sorted(query_options.get("in", {}).items()))
+        for key, values in within:
+            params[f"in_{key}"] = list(values)
+        ranges = []
+        for key, (low, high) in sorted(query_options.get("range", {}).items()):
+            ranges.append((key, low is not None, high is not None))
+            if low is not None:
+                params[f"low_{key}"] = low
+            if high is not None:
+                params[f"high_{key}"] = high
+        limit = query_options.get("limit")
+        if limit is not None:
+            params["limit"] = limit
+        order_by = query_options.get("order_by")
+        if order_by is not None and not isinstance(order_by, (tuple, list)):
+            order_by = (order_by,)
+        columns = tuple(query_options.get("columns", ()))
+
+        order_key = _order_key(order_by) if order_by else None
+        shape = (
+            self.entity,
+            tuple(equal),
+            tuple(key for key, _ in within),
+            tuple(ranges),
+            limit is not None,
+            columns,
+            order_key,
+        )
+        if order_by and order_key is None:
+            # The order carries values of its own, not part of the shape
+            return self._build_statement(shape, order_by), params
+        stmt = _statements.get(shape)
+        if stmt is None:
+            stmt = self._build_statement(shape, order_by)
+            _statements[shape] = stmt
+            if len(_statements) > STATEMENT_CACHE_SIZE:
+                _statements.popitem(last=False)
+        else:
+            _statements.move_to_end(shape)
+        return stmt, params
+
+    def _build_statement(self, shape: tuple, order_by: Optional[tuple]) -> Select:
+        _, equal, within, ranges, limit, columns, _ = shape
+        entity = self.entity
+
+        def attribute(key: str) -> Any:
+            if key not in self.column_keys:
+                raise ValueError(f"{entity.__name__} has no column {key}")
+            return getattr(entity, key)
+
+        stmt = select(*map(attribute, columns)) if columns else select(entity)
+        for key, is_null in equal:
+            stmt = stmt.where(
+                attribute(key).is_(None) if is_null else attribute(key) == bindparam(f"eq_{key}")
+            )
+        stmt = stmt.where(entity.deleted_at.is_(None))
+        for key in within:
+            stmt = stmt.where(attribute(key).in_(bindparam(f"in_{key}", expanding=True)))
+        for key, low, high in ranges:
+            if low:
+                stmt = stmt.where(attribute(key) >= bindparam(f"low_{key}"))
+            if high:
+                stmt = stmt.where(attribute(key) < bindparam(f"high_{key}"))
+        if order_by:
+            stmt = stmt.order_by(
+                *(attribute(item) if isinstance(item, str) else item for item in order_by)
+            )
+        if limit:
+            stmt = stmt.limit(bindparam("limit"))
+        return stmt
+
+    def select_by(self, filter: dict, query_options: Optional[dict] = None) -> Select:
+        """Statement of find_all_by with its values, to build other queries on."""
+        stmt, params = self.statement_by(filter, query_options)
+        return stmt.params(params) if params else stmt
+
+    def select_page_by(self, filter: dict, query_options: Optional[dict] = None) -> Select:
+        """One page of find_page_by, with one extra row telling whether a next page exists."""
+        query_options = query_options or {}
+        stmt = (
+            self.select_by(filter)
+            .order_by(self.entity.created_at, self.entity.id)
+            .limit(query_options.get("limit", PAGE_SIZE) + 1)
+        )
+        if query_options.get("cursor"):
+            created_at, id = decode_cursor(query_options["cursor"])
+            stmt = stmt.where(
+                tuple_(self.entity.created_at, self.entity.id) > (created_at, id)
+            )
+        return stmt
+
+    @timed
+    async def find_one_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> Optional[object]:
+        # query_options: as in find_all_by, limit defaults to 1
+        query_options = {"limit": 1, **(query_options or {})}
+        stmt, params = self.statement_by(filter, query_options)
+        async with db.read_session() as session:
+            result = await session.execute(stmt, params)
+            return (result if "columns" in query_options else result.scalars()).first()
+
+    @timed
     async def find_all_by(
         self, filter: dict, query_options: Optional[dict] = None
     ) -> List[object]:
-        async with db.session as session:
-            stmt = (
-                select(self.entity)
-                .filter_by(**filter)
-                .where(self.entity.deleted_at.is_(None))
-            )  # type: ignore
-
-            if query_options and "order_by" in query_options:
-                stmt = stmt.order_by(query_options["order_by"])
-
-            result = await session.execute(stmt)
+        # query_options: see statement_by
+        stmt, params = self.statement_by(filter, query_options)
+        async with db.read_session() as session:
+            result = await session.execute(stmt, params)
+            if query_options and "columns" in query_options:
+                return list(result.all())
             return list(result.scalars().all())
 
     async def find_all(self, query_options: Optional[dict] = None) -> List[object]:
-        async with db.session as session:
-            stmt = select(self.entity).where(self.entity.deleted_at.is_(None))  # type: ignore
+        return await self.find_all_by({}, query_options)
 
-            if query_options and "order_by" in query_options:
-                stmt = stmt.order_by(query_options["order_by"])
+    async def stream_all_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> AsyncIterator[Any]:
+        # query_options:
+        #   order_by: as in find_all_by
+        #   batch_size: rows per cursor fetch, default STREAM_BATCH_SIZE
+        batch_size = (query_options or {}).get("batch_size", STREAM_BATCH_SIZE)
+        stmt = self.select_by(filter, query_options).execution_options(
+            yield_per=batch_size
+        )
+
+        # A dedicated session, the server side cursor keeps its connection busy
+        # until the stream is exhausted or closed
+        async with db.SessionLocal() as session:
+            result = await session.stream_scalars(stmt)
+            async for entity in result:
+                yield entity
+
+    @timed
+    async def find_page_by(
+        self, filter: dict, query_options: Optional[dict] = None
+    ) -> Page:
+        # Keyset pagination on (created_at, id)
+        # query_options:
+        #   limit: page size, default PAGE_SIZE
+        #   cursor: next_cursor of the previous page
+        query_options = query_options or {}
+        limit = query_options.get("limit", PAGE_SIZE)
+        stmt = self.select_page_by(filter, query_options)
+
+        async with db.read_session() as session:
             result = await session.execute(stmt)
-            return list(result.scalars().all())
+            items = list(result.scalars().all())
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+        return Page(items, next_cursor)
 
+    @timed
     async def create_one(
         self, entity: Any, query_options: Optional[dict] = None
     ) -> Any:
-        async with db as session:
-            async with session.begin():
-                entity = self.set_default_for_create(entity)
-                session.add(entity)
+        # One INSERT ... RETURNING hydrates the stored entity, no refresh needed
+        entity = self.set_default_for_create(entity)
+        stmt = sql_insert(self.entity).values(self.to_row(entity)).returning(self.entity)
+
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            created = result.scalar_one()
             await session.commit()
-            await session.refresh(entity)
-            return entity
+        self.after_write("create", [created.id])
+        return created
 
+    @timed
     async def create_many(
         self, entities: List[Any], query_options: Optional[dict] = None
     ) -> List[Any]:
-        async with db.session as session:
-            async with session.begin():
-                for entity in entities:
-                    entity = self.set_default_for_create(entity)
+        # query_options:
+        #   bulk: insert through core statements, no ORM objects / identity map.
+        #         entities may be ORM instances or dicts and any iterable (eg: a generator)
+        #   batch_size: rows per statement in bulk mode, default BULK_BATCH_SIZE
+        #   copy: use asyncpg COPY instead of multi-row INSERT (postgres only)
+        #   return_ids: return the inserted ids in bulk mode, default True
+        if query_options and query_options.get("bulk"):
+            return await self.bulk_insert(entities, query_options)
+
+        async with db.session() as session:
+            for entity in entities:
+                entity = self.set_default_for_create(entity)
 
-                session.add_all(entities)
+            session.add_all(entities)
             await session.commit()
-            return entities
+        self.after_write("create", [entity.id for entity in entities])
+        return entities
+
+    @cached_property
+    def column_keys(self) -> List[str]:
+        return list(self.entity.__table__.columns.keys())
+
+    def to_row(self, entity: Any) -> dict:
+        """Column values of an entity (ORM instance or dict) ready for a core insert."""
+        # ORM instances keep loaded / assigned values in __dict__, reading it
+        # directly skips the attribute instrumentation of every column
+        values = entity if isinstance(entity, dict) else vars(entity)
+        row = {key: values.get(key) for key in self.column_keys}
+
+        # Keep given values (eg: ids of an import), fill only the missing ones
+        for key, value in self.default_values_for_create().items():
+            if row.get(key) is None:
+                row[key] = value
+        return row
+
+    @staticmethod
+    def _batches(rows: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+        iterator = iter(rows)
+        while batch := list(islice(iterator, batch_size)):
+            yield batch
+
+    async def bulk_insert(
+        self, entities: Iterable[Any], query_options: Optional[dict] = None
+    ) -> List[Any]:
+        query_options = query_options or {}
+        batch_size = query_options.get("batch_size", BULK_BATCH_SIZE)
+        return_ids = query_options.get("return_ids", True)
+        table = self.entity.__table__
+        ids: List[Any] = []
+
+        async with db.session() as session:
+            conn = await session.connection()
+            use_copy = query_options.get("copy") and conn.dialect.driver == "asyncpg"
+            driver: Any = None
+            transaction: Any = nullcontext()
+            if use_copy:
+                driver = (await conn.get_raw_connection()).driver_connection
+                # Becomes a savepoint when the session has already started a transaction
+                transaction = driver.transaction()
+
+            rows = (self.to_row(entity) for entity in entities)
+            async with transaction:
+                for batch in self._batches(rows, batch_size):
+                    if use_copy:
+                        await self._copy_batch(driver, batch)
+                    else:
+                        # executemany with a list of dicts is sent as multi-row INSERT ... VALUES
+                        await session.execute(sql_insert(table), batch)
+                    ids.extend(row["id"] for row in batch)
 
+            await session.commit()
+        self.after_write("create", ids)
+        return ids if return_ids else []
+
+    async def _copy_batch(self, driver: Any, batch: List[dict]) -> None:
+        table = self.entity.__table__
+        columns = self.column_keys
+        json_columns = {c.key for c in table.columns if isinstance(c.type, JSON)}
+        records = [
+            tuple(
+                json.dumps(row[key])
+                if key in json_columns and row[key] is not None
+                else row[key]
+                for key in columns
+            )
+            for row in batch
+        ]
+        await driver.copy_records_to_table(
+            table.name, records=records, columns=columns, schema_name=table.schema
+        )
+
+    @timed
     async def update_one(
         self, id: str, data: dict, query_options: Optional[dict] = None
     ) -> object:
-        async with db.session as session:
-            stmt = select(self.entity).where(
-                self.entity.id == id, self.entity.deleted_at.is_(None)
-            )  # type: ignore
+        stmt = (
+            sql_update(self.entity)
+            .where(self.entity.id == id, self.entity.deleted_at.is_(None))  # type: ignore
+            .values({**data, **self.default_values_for_update()})
+            .returning(self.entity)
+        )
+
+        async with db.session() as session:
             result = await session.execute(stmt)
-
-            entity = result.scalars().one_or_none()
+            entity = result.scalar_one_or_none()
             if not entity:
                 raise ValueError(f"Entity with id {id} not found")
-            for key, value in data.items():
-                setattr(entity, key, value)
-            entity = self.set_default_for_update(entity)
+            await session.commit()
+        self.after_write("update", [id])
+        return entity
 
+    @timed
+    async def update_many(
+        self, data: List[dict], query_options: Optional[dict] = None
+    ) -> int:
+        # data: one dict per row with its "id" and the changed columns.
+        # Rows with the same changed columns share one UPDATE ... FROM (VALUES ...)
+        # statement per batch (postgres), other dialects use an executemany.
+        batch_size = (query_options or {}).get("batch_size", BULK_BATCH_SIZE)
+        shapes: dict[tuple[str, ...], List[dict]] = {}
+        for row in data:
+            keys = tuple(sorted(key for key in row if key != "id"))
+            shapes.setdefault(keys, []).append(row)
+
+        updated_ids: List[Any] = []
+        async with db.session() as session:
+            conn = await session.connection()
+            for keys, rows in shapes.items():
+                for batch in self._batches(rows, batch_size):
+                    if conn.dialect.name == "postgresql":
+                        stmt = self._update_from_values(keys, batch)
+                        result = await session.execute(stmt)
+                        updated_ids.extend(result.scalars().all())
+                    else:
+                        updated_ids.extend(await self._update_executemany(session, keys, batch))
+            await session.commit()
+        self.after_write("update", updated_ids)
+        return len(updated_ids)
+
+    def _update_from_values(self, keys: tuple[str, ...], batch: List[dict]) -> Any:
+        table = self.entity.__table__
+        rows = values(
+            column("id", table.c.id.type),
+            *(column(key, table.c[key].type) for key in keys),
+            name="changes",
+        ).data([(row["id"], *(row[key] for key in keys)) for row in batch])
+
+        return (
+            sql_update(table)
+            .where(table.c.id == rows.c.id, table.c.deleted_at.is_(None))
+            .values(
+                {
+                    **{key: rows.c[key] for key in keys},
+                    **self.default_values_for_update(),
+                }
+            )
+            .returning(table.c.id)
+        )
+
+    async def _update_executemany(
+        self, session: Any, keys: tuple[str, ...], batch: List[dict]
+    ) -> List[Any]:
+        table = self.entity.__table__
+        ids = [row["id"] for row in batch]
+        live = await session.execute(
+            select(table.c.id).where(table.c.id.in_(ids), table.c.deleted_at.is_(None))
+        )
+        live_ids = set(live.scalars().all())
+        rows = [
+            {"_id": row["id"], **{key: row[key] for key in keys}}
+            for row in batch
+            if row["id"] in live_ids
+        ]
+        if rows:
+            stmt = (
+                sql_update(table)
+                .where(table.c.id == bindparam("_id"))
+                .values(**self.default_values_for_update())
+            )
+            await session.execute(stmt, rows)
+        return [row["_id"] for row in rows]
+
+    @timed
+    async def upsert_many(
+        self, data: Iterable[Any], query_options: Optional[dict] = None
+    ) -> List[Any]:
+        # INSERT ... ON CONFLICT (natural key) DO UPDATE in batches.
+        # Rows identical to the stored ones are left untouched, the returned ids
+        # are the ones inserted or actually changed.
+        # query_options:
+        #   conflict_keys: overrides natural_key
+        #   update_columns: columns overwritten on conflict, default all but
+        #                   the natural key and upsert_exclude
+        #   batch_size: rows per statement, default BULK_BATCH_SIZE
+        query_options = query_options or {}
+        keys = tuple(query_options.get("conflict_keys", self.natural_key))
+        if not keys:
+            raise ValueError(f"{type(self).__name__} has no natural key to upsert on")
+        batch_size = query_options.get("batch_size", BULK_BATCH_SIZE)
+        table = self.entity.__table__
+
+        compared = list(
+            query_options.get("update_columns")
+            or (
+                key
+                for key in self.column_keys
+                if key not in keys
+                and key not in self.upsert_exclude
+                and key not in ("updated_at", "updated_by")
+            )
+        )
+        updated = compared + ["updated_at", "updated_by"]
+
+        changed_ids: List[Any] = []
+        async with db.session() as session:
+            conn = await session.connection()
+            insert = self._dialect_insert(conn.dialect.name)(table)
+            # Built once and executed per batch as an executemany, which
+            # SQLAlchemy sends as multi-row INSERT ... VALUES (insertmanyvalues)
+            # and keeps in its compiled statement cache
+            stmt = insert.on_conflict_do_update(
+                index_elements=list(keys),
+                index_where=table.c.deleted_at.is_(None),
+                set_={key: insert.excluded[key] for key in updated},
+                where=or_(
+                    *(
+                        self._comparable(table.c[key]).is_distinct_from(
+                            self._comparable(insert.excluded[key])
+                        )
+                        for key in compared
+                    )
+                ),
+            ).returning(table.c.id)
+
+            rows = (self.to_row(entity) for entity in data)
+            for batch in self._batches(rows, batch_size):
+                result = await session.execute(stmt, batch)
+                changed_ids.extend(result.scalars().all())
             await session.commit()
-            await session.refresh(entity)
-            return entity
+        self.after_write("upsert", changed_ids)
+        return changed_ids
+
+    @staticmethod
+    def _dialect_insert(dialect_name: str) -> Any:
+        if dialect_name == "postgresql":
+            return postgresql.insert
+        if dialect_name == "sqlite":
+            return sqlite.insert
+        raise NotImplementedError(f"upsert is not supported on {dialect_name}")
 
+    @staticmethod
+    def _comparable(col: Any) -> Any:
+        # json has no equality operator in postgres, compare its text. A None
+        # is bound as json null: the same as an sql NULL
+        if isinstance(col.type, JSON):
+            return func.coalesce(cast(col, Text), "null")
+        return col
+
+    @timed
     async def delete_one(self, id: str, query_options: Optional[dict] = None) -> int:
-        async with db.session as session:
-            query = sql_delete(self.entity).where(  # type: ignore
-                self.entity.id == id, self.entity.deleted_at.is_(None)
+        async with db.session() as session:
+            query = (
+                sql_delete(self.entity)
+                .where(  # type: ignore
+                    self.entity.id == id, self.entity.deleted_at.is_(None)
+                )
+                .returning(self.entity.id)
             )  # type: ignore
             result = await session.execute(query)
+            deleted_ids = list(result.scalars().all())
             await session.commit()
-            return result.rowcount
+        self.after_write("delete", deleted_ids)
+        return len(deleted_ids)
 
+    @timed
     async def delete_many(
         self, ids: List[str], query_options: Optional[dict] = None
     ) -> int:
-        async with db.session as session:
-            query = sql_delete(self.entity).where(  # type: ignore
-                self.entity.id.in_(ids), self.entity.deleted_at.is_(None)
+        async with db.session() as session:
+            query = (
+                sql_delete(self.entity)
+                .where(  # type: ignore
+                    self.entity.id.in_(ids), self.entity.deleted_at.is_(None)
+                )
+                .returning(self.entity.id)
             )  # type: ignore
             result = await session.execute(query)
+            deleted_ids = list(result.scalars().all())
             await session.commit()
-            return result.rowcount
+        self.after_write("delete", deleted_ids)
+        return len(deleted_ids)
 
+    @timed
     async def soft_delete_one(
         self, id: str, query_options: Optional[dict] = None
     ) -> int:
-        async with db.session as session:
+        async with db.session() as session:
             query = (
                 sql_update(self.entity)
                 .where(  # type: ignore
                     self.entity.id == id, self.entity.deleted_at.is_(None)
                 )
-                .values(deleted_at=datetime.now(), deleted_by="admin")
+                .values(self.default_values_for_delete())
+                .returning(self.entity.id)
             )  # type: ignore
             result = await session.execute(query)
+            deleted_ids = list(result.scalars().all())
             await session.commit()
-            return result.rowcount
+        self.after_write("soft_delete", deleted_ids)
+        return len(deleted_ids)
 
+    @timed
     async def soft_delete_many(
         self, ids: List[str], query_options: Optional[dict] = None
     ) -> int:
-        async with db.session as session:
+        async with db.session() as session:
             query = (
                 sql_update(self.entity)
                 .where(  # type: ignore
                     self.entity.id.in_(ids), self.entity.deleted_at.is_(None)
                 )
-                .values(deleted_at=datetime.now(), deleted_by="admin")
+                .values(self.default_values_for_delete())
+                .returning(self.entity.id)
             )  # type: ignore
             result = await session.execute(query)
+            deleted_ids = list(result.scalars().all())
             await session.commit()
-            return result.rowcount
+        self.after_write("soft_delete", deleted_ids)
+        return len(deleted_ids)
@@ -0,0 +1,105 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Marker stored for ids that do not exist (negative caching)
+MISSING = object()
+
+
+class EntityCache:
+    """LRU cache with a TTL used by BasicRepository.get_one_by_id.
+
+    Values are plain column dicts, never ORM instances, so nothing cached is
+    attached to (or shared through) a session. A reader takes version()
+    before it reads a row and passes it to set(): the row is not cached if
+    its key was invalidated in between.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 60.0,
+        negative_ttl: float = 5.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Version of the last invalidation of the most recently invalidated
+        # keys, older ones are forgotten and only their highest version kept
+        self._version = 0
+        self._invalidated: OrderedDict[Hashable, int] = OrderedDict()
+        self._forgotten = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Cached value, MISSING for a known missing key or None on a cache miss."""
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = item
+        if expires_at <= self.clock():
+            del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        if value is MISSING:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    def version(self) -> int:
+        return self._version
+
+    def set(self, key: Hashable, value: Any, version: Optional[int] = None) -> None:
+        """Cache value, unless key was invalidated after version was taken."""
+        if version is not None and version < max(
+            self._forgotten, self._invalidated.get(key, 0)
+        ):
+            return
+        ttl = self.negative_ttl if value is MISSING else self.ttl
+        self._items[key] = (self.clock() + ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, *keys: Hashable) -> None:
+        for key in keys:
+            self._items.pop(key, None)
+            self._version += 1
+            self._invalidated[key] = self._version
+            self._invalidated.move_to_end(key)
+        while len(self._invalidated) > self.maxsize:
+            self._forgotten = self._invalidated.popitem(last=False)[1]
+
+    def clear(self) -> None:
+        self._items.clear()
+        self._version += 1
+        self._invalidated.clear()
+        self._forgotten = self._version
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
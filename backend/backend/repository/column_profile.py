@@ -0,0 +1,50 @@
+from datetime import datetime
+from typing import Any, List, Optional
+
+from sqlalchemy import JSON, ForeignKey, LargeBinary, select
+from sqlalchemy.orm import Mapped, mapped_column
+
+from ..config import db
+from .base_repository import UUID_KEY, BaseModel, BasicRepository
+
+
+class ColumnProfile(BaseModel):  # type: ignore
+    """Sketches of the sampled values of a column, merged by every re-profile.
+    The summary derived from them is stored in ModelColumn.properties["profile"]."""
+
+    __tablename__ = "column_profile"  # type: ignore
+    __unique_live_indexes__ = (("column_id",),)
+
+    column_id: Mapped[str] = mapped_column(UUID_KEY, ForeignKey(f"model_column.id"))
+
+    # Column type the sketches were built for, a type change starts them over
+    type: Mapped[str] = mapped_column(nullable=False)
+
+    # Sampled values sketched so far, and the null ones among them
+    rows: Mapped[int] = mapped_column(nullable=False)
+    nulls: Mapped[int] = mapped_column(nullable=False)
+
+    # Smallest / largest sampled value, normalized to json
+    min_value: Mapped[Optional[Any]] = mapped_column(JSON, nullable=True, default=None)
+    max_value: Mapped[Optional[Any]] = mapped_column(JSON, nullable=True, default=None)
+
+    # Serialized HyperLogLog (distinct count) and CountMinSketch (frequencies)
+    hll: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    cms: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+
+    # Heavy hitter candidates, [value, estimated count] pairs
+    top_values: Mapped[Optional[Any]] = mapped_column(JSON, nullable=True, default=None)
+
+    profiled_at: Mapped[datetime] = mapped_column(nullable=False)
+
+
+class ColumnProfileRepository(BasicRepository):
+    natural_key = ("column_id",)
+
+    async def find_by_columns(self, column_ids: List[str]) -> List[ColumnProfile]:
+        stmt = select(ColumnProfile).where(
+            ColumnProfile.column_id.in_(column_ids), ColumnProfile.deleted_at.is_(None)
+        )
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return list(result.scalars().all())
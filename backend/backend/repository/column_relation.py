@@ -3,14 +3,16 @@ from typing import Optional
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column
 
-from .base_repository import BaseModel, BasicRepository
+from .base_repository import UUID_KEY, BaseModel, BasicRepository
 
 
 class ColumnRelation(BaseModel):  # type: ignore
 
     __tablename__ = "relation"
+    __unique_live_indexes__ = (("project_id", "name"),)
+    __live_indexes__ = (("from_column_id",), ("to_column_id",))
 
-    project_id: Mapped[str] = mapped_column(ForeignKey("project.id"))
+    project_id: Mapped[str] = mapped_column(UUID_KEY, ForeignKey("project.id"))
 
     # Relation name
     name: Mapped[str] = mapped_column(nullable=False)
@@ -22,29 +24,33 @@ class ColumnRelation(BaseModel):  # type: ignore
     condition: Mapped[str] = mapped_column(nullable=False)
 
     # from column id, "{fromColumn} {joinType} {toColumn}"
-    from_column_id: Mapped[int] = mapped_column(nullable=False)
+    from_column_id: Mapped[str] = mapped_column(UUID_KEY, nullable=False)
 
     # to column id, "{fromColumn} {joinType} {toColumn}"
-    to_column_id: Mapped[int] = mapped_column(nullable=False)
+    to_column_id: Mapped[str] = mapped_column(UUID_KEY, nullable=False)
 
     # Model properties, a json string, the description should be stored here
     properties: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
 
 
 class ExtraRelationInfo(BaseModel):
-    from_model_id: Mapped[int] = mapped_column(nullable=False)
+    __abstract__ = True
+
+    from_model_id: Mapped[str] = mapped_column(UUID_KEY, nullable=False)
     from_model_name: Mapped[str] = mapped_column(nullable=False)
     from_model_display_name: Mapped[str] = mapped_column(nullable=False)
     from_column_name: Mapped[str] = mapped_column(nullable=False)
     from_column_display_name: Mapped[str] = mapped_column(nullable=False)
-    to_model_id: Mapped[int] = mapped_column(nullable=False)
+    to_model_id: Mapped[str] = mapped_column(UUID_KEY, nullable=False)
     to_model_name: Mapped[str] = mapped_column(nullable=False)
     to_model_display_name: Mapped[str] = mapped_column(nullable=False)
     to_column_name: Mapped[str] = mapped_column(nullable=False)
     to_column_display_name: Mapped[str] = mapped_column(nullable=False)
 
 
-class ColumnRelationInfo(ColumnRelation, ExtraRelationInfo): ...
+class ColumnRelationInfo(ColumnRelation, ExtraRelationInfo):
+    __abstract__ = True
 
 
-class ColumnRelationRepository(BasicRepository): ...
+class ColumnRelationRepository(BasicRepository):
+    natural_key = ("project_id", "name")
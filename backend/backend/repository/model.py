@@ -1,17 +1,27 @@
-from typing import Any, Optional
+from datetime import datetime
+from typing import Any, List, Optional
 
-from sqlalchemy import ForeignKey, Text
+from sqlalchemy import ForeignKey, Text, select
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Mapped, mapped_column
 
-from backend.repository.base_repository import BasicRepository
+from backend.config import db
+from backend.repository.base_repository import (
+    UUID_KEY,
+    BaseModel,
+    BasicRepository,
+    search_indexes,
+)
 
 
 class Model(BaseModel):  # type: ignore
 
     __tablename__ = "model"  # type: ignore
+    __unique_live_indexes__ = (("project_id", "reference_name"),)
+    __live_indexes__ = (("project_id", "created_at", "id"),)
 
     # Reference to project.id
-    project_id: Mapped[str] = mapped_column(ForeignKey("project.id"))
+    project_id: Mapped[str] = mapped_column(UUID_KEY, ForeignKey("project.id"))
 
     # Model name displayed in UI
     display_name: Mapped[str] = mapped_column(nullable=False)
@@ -34,5 +44,27 @@ class Model(BaseModel):  # type: ignore
     # Model properties, a json string, the description and displayName should be stored here
     properties: Mapped[Optional[dict[str, Any]]]
 
+    # Hash of source_table_name and the source column definitions of the last
+    # harvest, a re-sync skips the model when it is unchanged
+    fingerprint: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
 
-class ModelRepository(BasicRepository): ...
+    # Last successful refresh of a cached model, the next one is due
+    # refresh_time later
+    refreshed_at: Mapped[Optional[datetime]] = mapped_column(nullable=True, default=None)
+
+
+search_indexes(Model.display_name)
+search_indexes(Model.reference_name)
+
+
+class ModelRepository(BasicRepository):
+    natural_key = ("project_id", "reference_name")
+
+    async def find_fingerprints(self, project_id: str) -> List[Row]:
+        """(id, source_table_name, fingerprint) of the live models of a project."""
+        stmt = select(Model.id, Model.source_table_name, Model.fingerprint).where(
+            Model.project_id == project_id, Model.deleted_at.is_(None)
+        )
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return list(result.all())
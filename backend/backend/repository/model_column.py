@@ -1,16 +1,20 @@
-from typing import Optional
+from typing import List, Optional
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, select
+from sqlalchemy.engine import Row
 from sqlalchemy.orm import Mapped, mapped_column
 
-from .base_repository import BaseModel
+from ..config import db
+from .base_repository import UUID_KEY, BaseModel, BasicRepository, search_indexes
 
 
 class ModelColumn(BaseModel):
 
     __tablename__ = "model_column"  # type: ignore
+    __unique_live_indexes__ = (("model_id", "reference_name"),)
+    __live_indexes__ = (("model_id", "created_at", "id"),)
 
-    model_id: Mapped[str] = mapped_column(ForeignKey(f"model.id"))
+    model_id: Mapped[str] = mapped_column(UUID_KEY, ForeignKey(f"model.id"))
 
     is_calculated: Mapped[bool] = mapped_column(nullable=False)  # Is calculated field
 
@@ -44,3 +48,57 @@ class ModelColumn(BaseModel):
 
     # Column properties, a json string, the description and displayName should be stored here
     properties: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
+
+
+search_indexes(ModelColumn.display_name)
+search_indexes(ModelColumn.reference_name)
+
+
+class ModelColumnRepository(BasicRepository):
+    natural_key = ("model_id", "reference_name")
+
+    async def find_source_columns(self, model_ids: List[str]) -> List[Row]:
+        """Source definition of the live columns of the given models."""
+        stmt = select(
+            ModelColumn.id,
+            ModelColumn.model_id,
+            ModelColumn.source_column_name,
+            ModelColumn.type,
+            ModelColumn.not_null,
+            ModelColumn.is_pk,
+        ).where(ModelColumn.model_id.in_(model_ids), ModelColumn.deleted_at.is_(None))
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return list(result.all())
+
+    async def find_ids_by_model(self, model_ids: List[str]) -> List[str]:
+        stmt = select(ModelColumn.id).where(
+            ModelColumn.model_id.in_(model_ids), ModelColumn.deleted_at.is_(None)
+        )
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return list(result.scalars().all())
+
+    async def find_profiled_columns(self, model_ids: List[str]) -> List[Row]:
+        """Live source columns (not calculated) of the given models, with their type."""
+        stmt = select(
+            ModelColumn.id,
+            ModelColumn.model_id,
+            ModelColumn.source_column_name,
+            ModelColumn.type,
+        ).where(
+            ModelColumn.model_id.in_(model_ids),
+            ModelColumn.is_calculated.is_(False),
+            ModelColumn.deleted_at.is_(None),
+        )
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return list(result.all())
+
+    async def find_properties(self, ids: List[str]) -> dict[str, Optional[str]]:
+        stmt = select(ModelColumn.id, ModelColumn.properties).where(
+            ModelColumn.id.in_(ids), ModelColumn.deleted_at.is_(None)
+        )
+        async with db.session() as session:
+            result = await session.execute(stmt)
+            return dict(result.all())
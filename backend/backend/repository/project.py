@@ -8,6 +8,7 @@ from .base_repository import BaseModel, BasicRepository
 class Project(BaseModel):  # type: ignore
 
     __tablename__ = "project"  # type: ignore
+    __live_indexes__ = (("created_at", "id"),)
 
     # Project datasource type. ex: bigquery, mysql, postgresql, mongodb, etc
     type: Mapped[str] = mapped_column(nullable=False)
@@ -1,17 +1,20 @@
+from datetime import datetime
 from typing import Optional
 
 from sqlalchemy import ForeignKey
 from sqlalchemy.orm import Mapped, mapped_column
 
 
-from .base_repository import BaseModel, BasicRepository
+from .base_repository import UUID_KEY, BaseModel, BasicRepository, search_indexes
 
 
 class View(BaseModel):  # type: ignore
 
     __tablename__ = "view"  # type: ignore
+    __unique_live_indexes__ = (("project_id", "name"),)
+    __live_indexes__ = (("project_id", "created_at", "id"),)
 
-    project_id: Mapped[str] = mapped_column(ForeignKey(f"project.id"))
+    project_id: Mapped[str] = mapped_column(UUID_KEY, ForeignKey(f"project.id"))
 
     # The view name
     name: Mapped[str] = mapped_column(nullable=False)
@@ -24,8 +27,16 @@ class View(BaseModel):  # type: ignore
     # Contain a number followed by a time unit (ns, us, ms, s, m, h, d). For example, "2h"
     refresh_time: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
 
+    # Last successful refresh of a cached view, unused for now: the refresh
+    # scheduler only refreshes models
+    refreshed_at: Mapped[Optional[datetime]] = mapped_column(nullable=True, default=None)
+
     # View properties, a json string, the description and displayName should be stored here
     properties: Mapped[Optional[str]] = mapped_column(nullable=True, default=None)
 
 
-class ViewRepository(BasicRepository): ...
+search_indexes(View.name)
+
+
+class ViewRepository(BasicRepository):
+    natural_key = ("project_id", "name")
@@ -0,0 +1,220 @@
+"""Repository writes shared between the workers of the app.
+
+Every worker publishes its writes on a postgres NOTIFY channel and listens
+to the others', applying them to its entity caches and write listeners as
+if they were local (dispatch_write). A message is
+
+    {"o": origin worker, "v": version, "t": table, "a": action, "i": ids}
+
+versions are consecutive per worker, so a missing one tells a message was
+lost: the listener then resyncs, every cache of the process starts over.
+So does a listener that (re)connects, as it missed whatever was written
+in between.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import uuid
+from typing import Any, List, Optional
+
+from sqlalchemy import text
+
+from ..config import Base, db
+from ..repository.base_repository import (
+    WriteEvent,
+    add_write_listener,
+    dispatch_write,
+    remove_write_listener,
+)
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: the workers of a deployment share the catalog writes over
+# postgres LISTEN / NOTIFY only when set
+CHANGE_FEED_ENABLED: bool = os.environ.get("CHANGE_FEED_ENABLED", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+CHANGE_FEED_CHANNEL: str = os.environ.get("CHANGE_FEED_CHANNEL", "catalog_changes")
+
+# Ids per message, a NOTIFY payload must stay under 8000 bytes
+MESSAGE_IDS = 150
+# Writes of more ids are sent as a resync of their table
+MAX_MESSAGE_IDS = 3000
+# Seconds between two checks of the listening connection
+CHECK_INTERVAL = 30.0
+# Reconnect delays of the listener, doubled on every failure
+RECONNECT_DELAY = 1.0
+MAX_RECONNECT_DELAY = 30.0
+
+
+def resync_tables() -> List[str]:
+    """Tables of the repository entities."""
+    return sorted(mapper.local_table.name for mapper in Base.registry.mappers)
+
+
+class ChangeFeed:
+    """Publishes the writes of this worker and applies the others'."""
+
+    def __init__(self, channel: str = CHANGE_FEED_CHANNEL):
+        self.channel = channel
+        self.origin = uuid.uuid4().hex[:12]
+        self.version = 0
+        # Last version received per origin
+        self.versions: dict[str, int] = {}
+        self.resyncs = 0
+        self._outbox: List[WriteEvent] = []
+        self._wakeup = asyncio.Event()
+        # Set while a received write is dispatched, it is not published again
+        self._receiving = False
+        self._tasks: List[asyncio.Task] = []
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if not self._receiving:
+            self._outbox.append(event)
+            self._wakeup.set()
+
+    def encode(self, event: WriteEvent) -> List[str]:
+        """Messages of a write, one version each."""
+        ids: List[Any] = [str(id) for id in event.ids]
+        if event.action == "resync" or len(ids) > MAX_MESSAGE_IDS:
+            chunks: List[Optional[List[Any]]] = [None]
+        else:
+            chunks = [ids[i : i + MESSAGE_IDS] for i in range(0, len(ids), MESSAGE_IDS)]
+        messages = []
+        for chunk in chunks:
+            self.version += 1
+            message = {
+                "o": self.origin,
+                "v": self.version,
+                "t": event.table,
+                "a": event.action,
+                "i": chunk,
+            }
+            messages.append(json.dumps(message, separators=(",", ":")))
+        return messages
+
+    def receive(self, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            origin, version = message["o"], message["v"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignored change message %r", payload[:200])
+            return
+        if origin == self.origin:
+            return
+        last = self.versions.get(origin)
+        self.versions[origin] = version
+        if last is not None and version != last + 1:
+            logger.warning(
+                "Missed changes of worker %s (%s after %s), resync",
+                origin,
+                version,
+                last,
+            )
+            self.resync()
+            return
+        if message["i"] is None:
+            self.dispatch(WriteEvent(message["t"], "resync", ()))
+        else:
+            self.dispatch(WriteEvent(message["t"], message["a"], tuple(message["i"])))
+
+    def dispatch(self, event: WriteEvent) -> None:
+        self._receiving = True
+        try:
+            dispatch_write(event)
+        finally:
+            self._receiving = False
+
+    def resync(self) -> None:
+        """Drop whatever the caches of this process hold."""
+        self.resyncs += 1
+        for table in resync_tables():
+            self.dispatch(WriteEvent(table, "resync", ()))
+
+    async def start(self) -> None:
+        if db.engine.dialect.name != "postgresql":
+            # A single process, writes are applied locally
+            return
+        add_write_listener(self._on_write)
+        self._tasks = [
+            asyncio.create_task(self.publish()),
+            asyncio.create_task(self.listen()),
+        ]
+
+    async def stop(self) -> None:
+        remove_write_listener(self._on_write)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def publish(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            events, self._outbox = self._outbox, []
+            messages = [message for event in events for message in self.encode(event)]
+            try:
+                # One transaction, the listeners get the messages together
+                async with db.engine.begin() as conn:
+                    for message in messages:
+                        await conn.execute(
+                            text("SELECT pg_notify(:channel, :message)"),
+                            {"channel": self.channel, "message": message},
+                        )
+            except Exception:
+                # The other workers see the version gap and resync
+                logger.exception("Publishing %s change messages failed", len(messages))
+
+    async def listen(self) -> None:
+        delay = RECONNECT_DELAY
+        while True:
+            attached = asyncio.Event()
+            try:
+                await self.listen_once(attached)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Change feed listener disconnected: %s", e)
+            if attached.is_set():
+                # Lost after listening, not one more failed attempt
+                delay = RECONNECT_DELAY
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY)
+
+    async def listen_once(self, attached: Optional[asyncio.Event] = None) -> None:
+        """Listen on a connection of its own until it is lost, attached is
+        set once the LISTEN is in place."""
+        conn = await db.engine.connect()
+        try:
+            driver = (await conn.get_raw_connection()).driver_connection
+            lost = asyncio.Event()
+            driver.add_termination_listener(lambda _: lost.set())
+            await driver.add_listener(
+                self.channel,
+                lambda _conn, _pid, _channel, payload: self.receive(payload),
+            )
+            # Writes made while not listening are unknown
+            self.versions.clear()
+            self.resync()
+            if attached is not None:
+                attached.set()
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), CHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    # On the driver: a statement of the SQLAlchemy connection
+                    # opens a transaction, postgres holds the notifications
+                    # of a session back until its transaction ends
+                    await driver.execute("SELECT 1")
+        finally:
+            # Never back to the pool with the LISTEN on it
+            await conn.invalidate()
+            await conn.close()
+
+
+change_feed: ChangeFeed = ChangeFeed()
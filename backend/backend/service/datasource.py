@@ -0,0 +1,224 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Callable, Optional
+
+from sqlalchemy import text
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+
+from ..repository.base_repository import WriteEvent, add_write_listener
+from ..repository.project import Project
+
+logger = logging.getLogger(__name__)
+
+# Connections per project pool, the bound of the concurrent operations on a source
+SOURCE_POOL_SIZE: int = int(os.environ.get("SOURCE_POOL_SIZE", "5"))
+# Project pools kept at once, the least recently used ones are disposed beyond
+# it, so SOURCE_MAX_POOLS * SOURCE_POOL_SIZE bounds the source connections
+SOURCE_MAX_POOLS: int = int(os.environ.get("SOURCE_MAX_POOLS", "100"))
+# Seconds a pool may stay unused before it is disposed
+SOURCE_IDLE_TIMEOUT: float = float(os.environ.get("SOURCE_IDLE_TIMEOUT", "600"))
+# Seconds between two health checks / idle sweeps
+SOURCE_CHECK_INTERVAL: float = float(os.environ.get("SOURCE_CHECK_INTERVAL", "60"))
+
+# Project.type -> async SQLAlchemy driver
+DRIVERS = {
+    "postgres": "postgresql+asyncpg",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def source_url(project: Project) -> URL:
+    """Build the datasource URL from Project.type and Project.connection_info."""
+    driver = DRIVERS.get(project.type.lower())
+    if driver is None:
+        raise ValueError(f"Unsupported datasource type {project.type}")
+
+    info: dict[str, Any] = project.connection_info or {}
+    return URL.create(
+        driver,
+        username=info.get("user"),
+        password=info.get("password"),
+        host=info.get("host"),
+        port=info.get("port"),
+        database=info.get("database"),
+    )
+
+
+def source_schema(project: Project) -> str | None:
+    # sqlite has a single (main) schema
+    if project.type.lower() == "sqlite" or not project.schema:
+        return None
+    return project.schema
+
+
+def create_source_engine(project: Project, pool_size: int = 5) -> AsyncEngine:
+    url = source_url(project)
+    if url.get_backend_name() == "sqlite":
+        return create_async_engine(url)
+    return create_async_engine(
+        url, pool_size=pool_size, max_overflow=0, pool_pre_ping=True
+    )
+
+
+@dataclass
+class SourcePool:
+    # Hash of the project id, type and connection info the engine was built from
+    key: str
+    engine: AsyncEngine
+    last_used: float
+    # Open leases, the engine is disposed only once they are all returned
+    leases: int = 0
+    retired: bool = False
+
+
+def pool_key(project: Project) -> str:
+    raw = json.dumps(
+        [project.id, project.type, project.connection_info], sort_keys=True, default=str
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class SourcePools:
+    """Pooled datasource engines, one per project.
+
+    Every project gets an engine with at most pool_size connections, kept
+    while it is used, so operations on a source reuse open (TLS) connections.
+    At most max_pools engines exist at once, the least recently used one is
+    disposed beyond that, and pools idle for idle_timeout seconds are disposed
+    by the background loop, which also checks the health of the others.
+    An engine is keyed by a hash of its connection info: a project whose
+    connection info changed (seen on its write event or on its next use)
+    gets a new engine, the old one is disposed once its leases are returned.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = SOURCE_POOL_SIZE,
+        max_pools: int = SOURCE_MAX_POOLS,
+        idle_timeout: float = SOURCE_IDLE_TIMEOUT,
+        check_interval: float = SOURCE_CHECK_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.pool_size = pool_size
+        self.max_pools = max_pools
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.clock = clock
+        # project id -> pool, least recently used first
+        self.pools: OrderedDict[str, SourcePool] = OrderedDict()
+        self._disposals: set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.Task] = None
+        add_write_listener(self._on_write)
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table == "project" and event.action != "create":
+            for id in event.ids:
+                self.discard(id)
+
+    def get(self, project: Project) -> SourcePool:
+        key = pool_key(project)
+        pool = self.pools.get(project.id)
+        if pool is not None and pool.key != key:
+            self.discard(project.id)
+            pool = None
+        if pool is None:
+            pool = SourcePool(key, create_source_engine(project, self.pool_size), self.clock())
+            self.pools[project.id] = pool
+            self.evict(keep=project.id)
+        self.pools.move_to_end(project.id)
+        return pool
+
+    @asynccontextmanager
+    async def lease(self, project: Project) -> AsyncIterator[AsyncEngine]:
+        """The pooled engine of a project, not disposed before the lease ends."""
+        pool = self.get(project)
+        pool.leases += 1
+        try:
+            yield pool.engine
+        finally:
+            pool.leases -= 1
+            pool.last_used = self.clock()
+            if pool.retired and not pool.leases:
+                self._dispose(pool)
+
+    @asynccontextmanager
+    async def connect(self, project: Project) -> AsyncIterator[AsyncConnection]:
+        async with self.lease(project) as engine, engine.connect() as conn:
+            yield conn
+
+    def discard(self, project_id: str) -> None:
+        pool = self.pools.pop(project_id, None)
+        if pool is None:
+            return
+        pool.retired = True
+        if not pool.leases:
+            self._dispose(pool)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """Dispose the least recently used pools beyond max_pools, and the idle ones."""
+        now = self.clock()
+        for project_id, pool in list(self.pools.items()):
+            if project_id == keep:
+                continue
+            over = len(self.pools) > self.max_pools
+            idle = now - pool.last_used >= self.idle_timeout
+            if not over and not idle:
+                # Later pools were used more recently
+                break
+            if not pool.leases:
+                self.discard(project_id)
+
+    def _dispose(self, pool: SourcePool) -> None:
+        try:
+            task = asyncio.get_running_loop().create_task(pool.engine.dispose())
+        except RuntimeError:
+            # No loop left (shutdown), the connections close with the process
+            return
+        self._disposals.add(task)
+        task.add_done_callback(self._disposals.discard)
+
+    async def check(self) -> None:
+        """Ping the idle pools, a failing one is disposed and rebuilt on next use."""
+        for project_id, pool in list(self.pools.items()):
+            if pool.leases:
+                continue
+            try:
+                async with pool.engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+            except Exception as e:
+                logger.warning("Datasource of project %s failed its health check: %s", project_id, e)
+                self.discard(project_id)
+
+    async def start(self) -> None:
+        self._loop = asyncio.create_task(self.loop())
+
+    async def loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                self.evict()
+                await self.check()
+            except Exception:
+                logger.exception("Datasource pool sweep failed")
+
+    async def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.cancel()
+            await asyncio.gather(self._loop, return_exceptions=True)
+            self._loop = None
+        for project_id in list(self.pools):
+            self.discard(project_id)
+        await asyncio.gather(*self._disposals, return_exceptions=True)
+
+
+source_pools: SourcePools = SourcePools()
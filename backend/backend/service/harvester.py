@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+
+from sqlalchemy import inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from ..repository.model import Model, ModelRepository
+from ..repository.model_column import ModelColumn, ModelColumnRepository
+from ..repository.project import Project
+from .datasource import source_pools, source_schema
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SourceColumn:
+    name: str
+    type: str
+    not_null: bool
+    is_pk: bool
+
+
+@dataclass
+class SourceTable:
+    name: str
+    columns: List[SourceColumn] = field(default_factory=list)
+
+
+def schema_fingerprint(table: SourceTable) -> str:
+    """Content hash of a source table, independent of the column order."""
+    columns = sorted(
+        [column.name, column.type, column.not_null, column.is_pk]
+        for column in table.columns
+    )
+    raw = json.dumps([table.name, columns], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+@dataclass
+class HarvestProgress:
+    project_id: str
+    tables_total: int = 0
+    tables_done: int = 0
+    tables_unchanged: int = 0
+    models_created: int = 0
+    models_updated: int = 0
+    models_deleted: int = 0
+    columns_created: int = 0
+    columns_updated: int = 0
+    columns_deleted: int = 0
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+
+class SchemaHarvester:
+    """Introspect a project's datasource and sync its tables to Model / ModelColumn.
+
+    Tables are introspected in chunks by at most `concurrency` tasks (bounded by
+    the pool size of source_pools), each on a pooled source connection.
+    Introspected chunks are handed over through a bounded queue to a single
+    writer, so the catalog session is never used concurrently.
+
+    The writer compares each table with the fingerprint stored on its model and
+    only writes the difference: new tables are bulk inserted, changed ones get
+    their column inserts / updates / soft deletes, unchanged ones cost nothing.
+    Models whose table disappeared are soft deleted with their columns.
+    """
+
+    def __init__(
+        self,
+        project: Project,
+        concurrency: int = 8,
+        chunk_size: int = 50,
+        on_progress: Optional[Callable[[HarvestProgress], Any]] = None,
+    ):
+        self.project = project
+        self.schema = source_schema(project)
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.on_progress = on_progress
+        self.model_repository = ModelRepository(entity=Model)
+        # source_table_name -> (model id, fingerprint) of the models not yet
+        # matched with a source table during a run
+        self.known: dict[str, tuple[str, Optional[str]]] = {}
+        self.column_repository = ModelColumnRepository(entity=ModelColumn)
+
+    async def run(self, tables: Optional[List[str]] = None) -> HarvestProgress:
+        """Sync every table of the source, or only the given source tables."""
+        progress = HarvestProgress(project_id=self.project.id)
+        self.known = {
+            row.source_table_name: (row.id, row.fingerprint)
+            for row in await self.model_repository.find_fingerprints(self.project.id)
+            if tables is None or row.source_table_name in tables
+        }
+
+        # The pooled engine of the project, its connections outlive the harvest
+        async with source_pools.lease(self.project) as engine:
+            async with engine.connect() as conn:
+                names = await conn.run_sync(
+                    lambda sync_conn: inspect(sync_conn).get_table_names(self.schema)
+                )
+            if tables is not None:
+                names = [name for name in names if name in tables]
+            progress.tables_total = len(names)
+            chunks = [
+                names[i : i + self.chunk_size]
+                for i in range(0, len(names), self.chunk_size)
+            ]
+
+            queue: asyncio.Queue[List[SourceTable]] = asyncio.Queue(
+                maxsize=self.concurrency * 2
+            )
+            # A task never waits on the pool of the source for a connection
+            semaphore = asyncio.Semaphore(min(self.concurrency, source_pools.pool_size))
+
+            async def produce(chunk: List[str]):
+                async with semaphore:
+                    tables = await self.introspect(engine, chunk)
+                await queue.put(tables)
+
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self.write(queue, len(chunks), progress))
+                for chunk in chunks:
+                    group.create_task(produce(chunk))
+
+        await self.delete_missing(progress)
+
+        logger.info(
+            "Harvested %s tables of project %s in %.2fs, %s unchanged",
+            progress.tables_done,
+            self.project.id,
+            progress.elapsed,
+            progress.tables_unchanged,
+        )
+        return progress
+
+    async def introspect(self, engine: AsyncEngine, names: List[str]) -> List[SourceTable]:
+        async with engine.connect() as conn:
+            return await conn.run_sync(self._introspect, names)
+
+    def _introspect(self, conn: Connection, names: List[str]) -> List[SourceTable]:
+        inspector = inspect(conn)
+        # get_multi_* reads a whole chunk of tables per catalog query where the
+        # dialect supports it (postgres), others fall back to one query per table
+        columns = inspector.get_multi_columns(schema=self.schema, filter_names=names)
+        pks = inspector.get_multi_pk_constraint(schema=self.schema, filter_names=names)
+
+        tables = []
+        for name in names:
+            pk = pks.get((self.schema, name), {})
+            pk_columns = set(pk.get("constrained_columns") or [])
+            tables.append(
+                SourceTable(
+                    name=name,
+                    columns=[
+                        SourceColumn(
+                            name=column["name"],
+                            type=str(column["type"]),
+                            not_null=not column.get("nullable", True),
+                            is_pk=column["name"] in pk_columns,
+                        )
+                        for column in columns.get((self.schema, name), [])
+                    ],
+                )
+            )
+        return tables
+
+    async def write(
+        self,
+        queue: "asyncio.Queue[List[SourceTable]]",
+        chunks: int,
+        progress: HarvestProgress,
+    ) -> None:
+        for _ in range(chunks):
+            tables = await queue.get()
+            await self.write_tables(tables, progress)
+
+            progress.tables_done += len(tables)
+            if self.on_progress is not None:
+                self.on_progress(progress)
+
+    async def write_tables(
+        self, tables: List[SourceTable], progress: HarvestProgress
+    ) -> None:
+        new: List[tuple[SourceTable, str]] = []
+        changed: dict[str, tuple[SourceTable, str]] = {}
+        for table in tables:
+            fingerprint = schema_fingerprint(table)
+            model_id, known_fingerprint = self.known.pop(table.name, (None, None))
+            if model_id is None:
+                new.append((table, fingerprint))
+            elif known_fingerprint != fingerprint:
+                changed[model_id] = (table, fingerprint)
+            else:
+                progress.tables_unchanged += 1
+
+        if new:
+            await self.create_models(new, progress)
+        if changed:
+            await self.update_models(changed, progress)
+
+    async def create_models(
+        self, tables: List[tuple[SourceTable, str]], progress: HarvestProgress
+    ) -> None:
+        model_ids = await self.model_repository.create_many(
+            [
+                {
+                    "project_id": self.project.id,
+                    "display_name": table.name,
+                    "source_table_name": table.name,
+                    "reference_name": table.name,
+                    "fingerprint": fingerprint,
+                }
+                for table, fingerprint in tables
+            ],
+            {"bulk": True},
+        )
+        columns = [
+            self.column_row(model_id, column)
+            for model_id, (table, _) in zip(model_ids, tables)
+            for column in table.columns
+        ]
+        await self.column_repository.create_many(columns, {"bulk": True, "return_ids": False})
+
+        progress.models_created += len(tables)
+        progress.columns_created += len(columns)
+
+    async def update_models(
+        self, tables: dict[str, tuple[SourceTable, str]], progress: HarvestProgress
+    ) -> None:
+        stored: dict[tuple[str, str], Any] = {
+            (row.model_id, row.source_column_name): row
+            for row in await self.column_repository.find_source_columns(list(tables))
+        }
+
+        created: List[dict] = []
+        updated: List[dict] = []
+        for model_id, (table, _) in tables.items():
+            for column in table.columns:
+                row = stored.pop((model_id, column.name), None)
+                if row is None:
+                    created.append(self.column_row(model_id, column))
+                elif (row.type, row.not_null, row.is_pk) != (
+                    column.type,
+                    column.not_null,
+                    column.is_pk,
+                ):
+                    updated.append(
+                        {
+                            "id": row.id,
+                            "type": column.type,
+                            "not_null": column.not_null,
+                            "is_pk": column.is_pk,
+                        }
+                    )
+        deleted = [row.id for row in stored.values()]
+
+        if created:
+            await self.column_repository.create_many(
+                created, {"bulk": True, "return_ids": False}
+            )
+        if updated:
+            await self.column_repository.update_many(updated)
+        if deleted:
+            await self.column_repository.soft_delete_many(deleted)
+        await self.model_repository.update_many(
+            [
+                {"id": model_id, "source_table_name": table.name, "fingerprint": fingerprint}
+                for model_id, (table, fingerprint) in tables.items()
+            ]
+        )
+
+        progress.models_updated += len(tables)
+        progress.columns_created += len(created)
+        progress.columns_updated += len(updated)
+        progress.columns_deleted += len(deleted)
+
+    async def delete_missing(self, progress: HarvestProgress) -> None:
+        # Whatever was not matched no longer exists in the source
+        model_ids = [model_id for model_id, _ in self.known.values()]
+        for start in range(0, len(model_ids), self.chunk_size):
+            chunk = model_ids[start : start + self.chunk_size]
+            column_ids = await self.column_repository.find_ids_by_model(chunk)
+            progress.columns_deleted += await self.column_repository.soft_delete_many(
+                column_ids
+            )
+            progress.models_deleted += await self.model_repository.soft_delete_many(chunk)
+        self.known = {}
+
+    def column_row(self, model_id: str, column: SourceColumn) -> dict:
+        return {
+            "model_id": model_id,
+            "is_calculated": False,
+            "display_name": column.name,
+            "reference_name": column.name,
+            "source_column_name": column.name,
+            "type": column.type,
+            "not_null": column.not_null,
+            "is_pk": column.is_pk,
+        }
@@ -0,0 +1,351 @@
+import json
+from array import array
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional
+
+from sqlalchemy import select
+
+from ..config import db
+from ..repository.base_repository import WriteEvent, add_write_listener
+from ..repository.column_relation import ColumnRelation
+from ..repository.model import Model
+from ..repository.model_column import ModelColumn
+
+# Edge kinds
+RELATION = 0  # from column -> to column of a ColumnRelation
+LINEAGE = 1  # selected column -> calculated column
+MEMBER = 2  # column -> its model
+
+# Tables whose writes change a graph
+_GRAPH_TABLES = ("model", "model_column", "relation")
+
+
+@dataclass
+class LineageNode:
+    # model or column
+    kind: str
+    id: str
+    # Hops from the node the traversal started on
+    depth: int
+
+
+def lineage_ids(lineage: Optional[str]) -> List[str]:
+    """Ids of the selected fields of a calculated column, a json array."""
+    if not lineage:
+        return []
+    try:
+        ids = json.loads(lineage)
+    except ValueError:
+        return []
+    if not isinstance(ids, list):
+        return []
+    return [str(id) for id in ids]
+
+
+class LineageGraph:
+    """Column / model dependency graph of one project.
+
+    Nodes are interned to ints; edges live in parallel int arrays and every
+    node keeps the array of its outgoing and incoming edge numbers, so a hop
+    is an array scan rather than a query. Edges are grouped by the catalog
+    row that produced them (a relation, or a column for its lineage and
+    membership edges) so a single row can be replaced on write.
+    """
+
+    def __init__(self):
+        self.node_index: dict[tuple[str, str], int] = {}
+        self.nodes: List[tuple[str, str]] = []
+        self.outgoing: List[array] = []
+        self.incoming: List[array] = []
+
+        # Edge number -> source node, target node, kind. Removed edges get a
+        # source of -1 and their number is reused
+        self.sources = array("i")
+        self.targets = array("i")
+        self.kinds = array("b")
+        self.owners: List[Optional[tuple[str, str]]] = []
+        self.free: List[int] = []
+        # Producing row (table, id) -> its edge numbers
+        self.owned: dict[tuple[str, str], List[int]] = {}
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.sources) - len(self.free)
+
+    def node(self, kind: str, id: str) -> int:
+        key = (kind, id)
+        index = self.node_index.get(key)
+        if index is None:
+            index = len(self.nodes)
+            self.node_index[key] = index
+            self.nodes.append(key)
+            self.outgoing.append(array("i"))
+            self.incoming.append(array("i"))
+        return index
+
+    def add_edge(self, owner: tuple[str, str], source: int, target: int, kind: int) -> None:
+        if self.free:
+            edge = self.free.pop()
+            self.sources[edge] = source
+            self.targets[edge] = target
+            self.kinds[edge] = kind
+            self.owners[edge] = owner
+        else:
+            edge = len(self.sources)
+            self.sources.append(source)
+            self.targets.append(target)
+            self.kinds.append(kind)
+            self.owners.append(owner)
+        self.outgoing[source].append(edge)
+        self.incoming[target].append(edge)
+        self.owned.setdefault(owner, []).append(edge)
+
+    def remove_edge(self, edge: int) -> None:
+        source = self.sources[edge]
+        if source < 0:
+            return
+        self.outgoing[source].remove(edge)
+        self.incoming[self.targets[edge]].remove(edge)
+        self.sources[edge] = -1
+        self.targets[edge] = -1
+        owner = self.owners[edge]
+        self.owners[edge] = None
+        self.free.append(edge)
+
+        edges = self.owned[owner]
+        edges.remove(edge)
+        if not edges:
+            del self.owned[owner]
+
+    def remove_owner(self, owner: tuple[str, str]) -> None:
+        for edge in list(self.owned.get(owner, ())):
+            self.remove_edge(edge)
+
+    def set_relation(self, id: str, from_column_id: str, to_column_id: str) -> None:
+        owner = ("relation", id)
+        self.remove_owner(owner)
+        self.add_edge(
+            owner,
+            self.node("column", from_column_id),
+            self.node("column", to_column_id),
+            RELATION,
+        )
+
+    def set_column(self, id: str, model_id: str, lineage: Iterable[str] = ()) -> None:
+        owner = ("column", id)
+        self.remove_owner(owner)
+        column = self.node("column", id)
+        self.add_edge(owner, column, self.node("model", model_id), MEMBER)
+        for source_id in lineage:
+            self.add_edge(owner, self.node("column", source_id), column, LINEAGE)
+
+    def remove_node(self, kind: str, id: str) -> None:
+        """Drop every edge touching a deleted model or column."""
+        index = self.node_index.get((kind, id))
+        if index is None:
+            return
+        for edge in list(self.outgoing[index]) + list(self.incoming[index]):
+            self.remove_edge(edge)
+
+    def impact(
+        self, kind: str, id: str, max_depth: Optional[int] = None, order: str = "bfs"
+    ) -> List[LineageNode]:
+        """Nodes depending on a node: relation targets, calculated columns
+        selecting it and the models of those columns."""
+        return self.traverse(kind, id, self.outgoing, self.targets, max_depth, order)
+
+    def upstream(
+        self, kind: str, id: str, max_depth: Optional[int] = None, order: str = "bfs"
+    ) -> List[LineageNode]:
+        """Nodes a node depends on, the reverse of impact."""
+        return self.traverse(kind, id, self.incoming, self.sources, max_depth, order)
+
+    def traverse(
+        self,
+        kind: str,
+        id: str,
+        adjacency: List[array],
+        ends: array,
+        max_depth: Optional[int],
+        order: str,
+    ) -> List[LineageNode]:
+        if order not in ("bfs", "dfs"):
+            raise ValueError(f"Unknown traversal order {order}")
+        start = self.node_index.get((kind, id))
+        if start is None:
+            return []
+
+        # Node -> fewest hops seen. Depth first search can reach a node over a
+        # longer path first, the node is then expanded again from the shorter
+        # one so the depth limit cuts on the real distance
+        depths = {start: 0}
+        frontier = deque([(start, 0)])
+        take = frontier.popleft if order == "bfs" else frontier.pop
+        while frontier:
+            index, depth = take()
+            if depth > depths[index] or (max_depth is not None and depth >= max_depth):
+                continue
+            for edge in adjacency[index]:
+                end = ends[edge]
+                if depth + 1 < depths.get(end, depth + 2):
+                    depths[end] = depth + 1
+                    frontier.append((end, depth + 1))
+
+        del depths[start]
+        return [
+            LineageNode(*self.nodes[index], depth) for index, depth in depths.items()
+        ]
+
+
+class LineageService:
+    """Lineage graphs of the projects, loaded on first use and kept in sync
+    with the writes of models, columns and relations.
+
+    Write listeners only record the written ids; the rows are read back and
+    applied to the loaded graphs before the next traversal. A graph loaded
+    while a write came in may have missed it, it serves its traversal and is
+    not kept.
+    """
+
+    def __init__(self):
+        self._graphs: dict[str, LineageGraph] = {}
+        self._pending: dict[str, set] = {table: set() for table in _GRAPH_TABLES}
+        # Writes received so far, compared before and after a load
+        self._generation = 0
+        add_write_listener(self._on_write)
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table in self._pending:
+            self._generation += 1
+            if event.action == "resync":
+                self._graphs.clear()
+            self._pending[event.table].update(event.ids)
+
+    async def graph(self, project_id: str) -> LineageGraph:
+        async with db.session() as session:
+            await self.apply_pending(session)
+            graph = self._graphs.get(project_id)
+            if graph is None:
+                generation = self._generation
+                graph = await self.load(session, project_id)
+                if generation == self._generation:
+                    self._graphs[project_id] = graph
+        return graph
+
+    async def traverse(
+        self, project_id: str, kind: str, id: str, query_options: Optional[dict] = None
+    ) -> List[LineageNode]:
+        # query_options:
+        #   direction: impact (default) or upstream
+        #   depth: max hops, unlimited by default
+        #   order: bfs (default) or dfs
+        query_options = query_options or {}
+        direction = query_options.get("direction", "impact")
+        if direction not in ("impact", "upstream"):
+            raise ValueError(f"Unknown lineage direction {direction}")
+        graph = await self.graph(project_id)
+        return getattr(graph, direction)(
+            kind, id, query_options.get("depth"), query_options.get("order", "bfs")
+        )
+
+    async def load(self, session: Any, project_id: str) -> LineageGraph:
+        graph = LineageGraph()
+        columns = await session.execute(
+            select(ModelColumn.id, ModelColumn.model_id, ModelColumn.lineage)
+            .join(Model, Model.id == ModelColumn.model_id)
+            .where(
+                Model.project_id == project_id,
+                Model.deleted_at.is_(None),
+                ModelColumn.deleted_at.is_(None),
+            )
+        )
+        for id, model_id, lineage in columns.all():
+            graph.set_column(id, model_id, lineage_ids(lineage))
+
+        relations = await session.execute(
+            select(
+                ColumnRelation.id,
+                ColumnRelation.from_column_id,
+                ColumnRelation.to_column_id,
+            ).where(
+                ColumnRelation.project_id == project_id,
+                ColumnRelation.deleted_at.is_(None),
+            )
+        )
+        for id, from_column_id, to_column_id in relations.all():
+            graph.set_relation(id, from_column_id, to_column_id)
+        return graph
+
+    async def apply_pending(self, session: Any) -> None:
+        if not any(self._pending.values()):
+            return
+        pending = self._pending
+        self._pending = {table: set() for table in _GRAPH_TABLES}
+        try:
+            await self.apply(session, pending)
+        except BaseException:
+            # Applied again before the next read, with the writes received meanwhile
+            for table, ids in pending.items():
+                self._pending[table].update(ids)
+            raise
+
+    async def apply(self, session: Any, pending: dict[str, set]) -> None:
+        """Patch the loaded graphs with the written rows."""
+        if not self._graphs:
+            # Loads running meanwhile check the generation themselves
+            return
+        if pending["model"]:
+            models = await session.execute(
+                select(Model.id, Model.project_id).where(
+                    Model.id.in_(pending["model"]), Model.deleted_at.is_(None)
+                )
+            )
+            live = {id for id, _ in models.all()}
+            for id in pending["model"] - live:
+                for graph in self._graphs.values():
+                    graph.remove_node("model", id)
+
+        if pending["model_column"]:
+            columns = await session.execute(
+                select(
+                    ModelColumn.id, ModelColumn.model_id, ModelColumn.lineage, Model.project_id
+                )
+                .join(Model, Model.id == ModelColumn.model_id)
+                .where(
+                    ModelColumn.id.in_(pending["model_column"]),
+                    ModelColumn.deleted_at.is_(None),
+                    Model.deleted_at.is_(None),
+                )
+            )
+            live = set()
+            for id, model_id, lineage, project_id in columns.all():
+                live.add(id)
+                graph = self._graphs.get(project_id)
+                if graph is not None:
+                    graph.set_column(id, model_id, lineage_ids(lineage))
+            for id in pending["model_column"] - live:
+                for graph in self._graphs.values():
+                    graph.remove_node("column", id)
+
+        if pending["relation"]:
+            relations = await session.execute(
+                select(
+                    ColumnRelation.id,
+                    ColumnRelation.project_id,
+                    ColumnRelation.from_column_id,
+                    ColumnRelation.to_column_id,
+                ).where(
+                    ColumnRelation.id.in_(pending["relation"]),
+                    ColumnRelation.deleted_at.is_(None),
+                )
+            )
+            live = set()
+            for id, project_id, from_column_id, to_column_id in relations.all():
+                live.add(id)
+                graph = self._graphs.get(project_id)
+                if graph is not None:
+                    graph.set_relation(id, from_column_id, to_column_id)
+            for id in pending["relation"] - live:
+                for graph in self._graphs.values():
+                    graph.remove_owner(("relation", id))
@@ -0,0 +1,46 @@
+import hashlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlalchemy import text
+
+from ..config import db
+
+# Names locked in this process, for databases without advisory locks
+_local_locks: set[str] = set()
+
+
+def advisory_key(name: str) -> int:
+    digest = hashlib.sha256(name.encode()).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
+
+
+@asynccontextmanager
+async def advisory_lock(name: str) -> AsyncIterator[bool]:
+    """Non blocking cross worker lock, yields whether it was acquired.
+
+    A postgres session advisory lock held on its own connection, an
+    in-process lock on databases without advisory locks (sqlite, single
+    process).
+    """
+    if db.engine.dialect.name != "postgresql":
+        if name in _local_locks:
+            yield False
+            return
+        _local_locks.add(name)
+        try:
+            yield True
+        finally:
+            _local_locks.discard(name)
+        return
+    key = advisory_key(name)
+    async with db.engine.connect() as conn:
+        acquired = (
+            await conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": key})
+        ).scalar()
+        try:
+            yield bool(acquired)
+        finally:
+            if acquired:
+                await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": key})
+            await conn.commit()
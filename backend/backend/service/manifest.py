@@ -0,0 +1,322 @@
+import hashlib
+import json
+from dataclasses import dataclass, field
+from typing import Any, Iterable, List, Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import aliased
+
+from ..config import db
+from ..repository.base_repository import WriteEvent, add_write_listener
+from ..repository.column_relation import ColumnRelation
+from ..repository.model import Model
+from ..repository.model_column import ModelColumn
+from ..repository.project import Project
+from ..repository.view import View
+
+# Tables whose writes change a manifest
+_MANIFEST_TABLES = ("project", "model", "model_column", "relation", "view")
+
+
+def dump(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def json_property(value: Optional[str]) -> Any:
+    """Decode the json string properties of columns, relations and views."""
+    if value is None or not isinstance(value, str):
+        return value
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def model_section(project: Any, model: Any, columns: Iterable[Any]) -> bytes:
+    columns = list(columns)
+    primary_key = next((column.reference_name for column in columns if column.is_pk), None)
+    section = {
+        "name": model.reference_name,
+        "refSql": model.ref_sql,
+        "tableReference": None
+        if model.ref_sql
+        else {
+            "catalog": project.catalog,
+            "schema": project.schema,
+            "table": model.source_table_name,
+        },
+        "columns": [
+            {
+                "name": column.reference_name,
+                "type": column.type,
+                "notNull": column.not_null,
+                "isCalculated": column.is_calculated,
+                "expression": column.custom_expression,
+                "properties": json_property(column.properties),
+            }
+            for column in columns
+        ],
+        "primaryKey": primary_key,
+        "cached": bool(model.cached),
+        "refreshTime": model.refresh_time,
+        "properties": model.properties,
+    }
+    return dump(section)
+
+
+def relation_section(relation: Any) -> bytes:
+    return dump(
+        {
+            "name": relation.name,
+            "models": [relation.from_model, relation.to_model],
+            "joinType": relation.join_type,
+            "condition": relation.condition,
+            "properties": json_property(relation.properties),
+        }
+    )
+
+
+def view_section(view: Any) -> bytes:
+    return dump(
+        {
+            "name": view.name,
+            "statement": view.statement,
+            "properties": json_property(view.properties),
+        }
+    )
+
+
+@dataclass
+class Manifest:
+    project_id: str
+    project: Any = None
+    # Serialized project header, model sections by model id, relation and
+    # view sections in name order
+    header: bytes = b"{}"
+    models: dict[str, tuple[str, bytes]] = field(default_factory=dict)
+    relations: List[bytes] = field(default_factory=list)
+    views: List[bytes] = field(default_factory=list)
+
+    content: bytes = b""
+    etag: str = ""
+    # Incremented on every rebuild
+    version: int = 0
+
+    def assemble(self) -> None:
+        models = b",".join(section for _, section in sorted(self.models.values()))
+        content = b"".join(
+            (
+                self.header[:-1],
+                b',"models":[',
+                models,
+                b'],"relationships":[',
+                b",".join(self.relations),
+                b'],"views":[',
+                b",".join(self.views),
+                b"]}",
+            )
+        )
+        if content != self.content:
+            self.content = content
+            self.version += 1
+            self.etag = '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+class ManifestCompiler:
+    """Per project MDL manifest of the models, columns, relations and views,
+    served from cached bytes.
+
+    Every model is serialized as its own section. Write listeners record the
+    written ids; before the next read only the touched model sections are
+    rebuilt, and the relations / views of the touched projects are reloaded.
+    A manifest compiled while a write came in may have missed it, it serves
+    its read and is not kept.
+    """
+
+    def __init__(self):
+        self._manifests: dict[str, Manifest] = {}
+        self._pending: dict[str, set] = {table: set() for table in _MANIFEST_TABLES}
+        # Writes received so far, compared before and after a compile
+        self._generation = 0
+        add_write_listener(self._on_write)
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table in self._pending:
+            self._generation += 1
+            if event.action == "resync":
+                self._manifests.clear()
+            self._pending[event.table].update(event.ids)
+
+    async def get(self, project_id: str) -> Optional[Manifest]:
+        """The compiled manifest of a project, None when it does not exist."""
+        async with db.session() as session:
+            await self.apply_pending(session)
+            manifest = self._manifests.get(project_id)
+            if manifest is None:
+                generation = self._generation
+                manifest = await self.compile(session, project_id)
+                if manifest is not None and generation == self._generation:
+                    self._manifests[project_id] = manifest
+        return manifest
+
+    async def compile(self, session: Any, project_id: str) -> Optional[Manifest]:
+        manifest = Manifest(project_id)
+        if not await self.load_header(session, manifest):
+            return None
+        await self.load_models(session, manifest, Model.project_id == project_id)
+        await self.load_relations(session, manifest)
+        await self.load_views(session, manifest)
+        manifest.assemble()
+        return manifest
+
+    async def load_header(self, session: Any, manifest: Manifest) -> bool:
+        project = await session.get(Project, manifest.project_id)
+        if project is None or project.deleted_at is not None:
+            return False
+        manifest.header = dump({"catalog": project.catalog, "schema": project.schema})
+        manifest.project = project
+        return True
+
+    async def load_models(self, session: Any, manifest: Manifest, condition: Any) -> None:
+        """(Re)build the sections of the models matching condition."""
+        models = await session.execute(
+            select(Model).where(condition, Model.deleted_at.is_(None))
+        )
+        models = {model.id: model for model in models.scalars()}
+        columns: dict[str, List[Any]] = {id: [] for id in models}
+        if models:
+            result = await session.execute(
+                select(ModelColumn)
+                .where(
+                    ModelColumn.model_id.in_(select(Model.id).where(condition)),
+                    ModelColumn.deleted_at.is_(None),
+                )
+                .order_by(ModelColumn.created_at, ModelColumn.id)
+            )
+            for column in result.scalars():
+                if column.model_id in columns:
+                    columns[column.model_id].append(column)
+
+        for id, model in models.items():
+            manifest.models[id] = (
+                model.reference_name,
+                model_section(manifest.project, model, columns[id]),
+            )
+
+    async def load_relations(self, session: Any, manifest: Manifest) -> None:
+        from_column, to_column = aliased(ModelColumn), aliased(ModelColumn)
+        from_model, to_model = aliased(Model), aliased(Model)
+        result = await session.execute(
+            select(
+                ColumnRelation.name,
+                ColumnRelation.join_type,
+                ColumnRelation.condition,
+                ColumnRelation.properties,
+                from_model.reference_name.label("from_model"),
+                to_model.reference_name.label("to_model"),
+            )
+            .join(from_column, from_column.id == ColumnRelation.from_column_id)
+            .join(from_model, from_model.id == from_column.model_id)
+            .join(to_column, to_column.id == ColumnRelation.to_column_id)
+            .join(to_model, to_model.id == to_column.model_id)
+            .where(
+                ColumnRelation.project_id == manifest.project_id,
+                ColumnRelation.deleted_at.is_(None),
+                from_model.deleted_at.is_(None),
+                to_model.deleted_at.is_(None),
+            )
+            .order_by(ColumnRelation.name)
+        )
+        manifest.relations = [relation_section(row) for row in result.all()]
+
+    async def load_views(self, session: Any, manifest: Manifest) -> None:
+        result = await session.execute(
+            select(View)
+            .where(View.project_id == manifest.project_id, View.deleted_at.is_(None))
+            .order_by(View.name)
+        )
+        manifest.views = [view_section(view) for view in result.scalars()]
+
+    async def project_ids(self, session: Any, entity: Any, ids: set) -> Optional[set]:
+        """Projects of written rows, None when a row is gone (hard delete)."""
+        if entity is ModelColumn:
+            stmt = (
+                select(ModelColumn.id, Model.project_id)
+                .join(Model, Model.id == ModelColumn.model_id)
+                .where(ModelColumn.id.in_(ids))
+            )
+        else:
+            stmt = select(entity.id, entity.project_id).where(entity.id.in_(ids))
+        rows = (await session.execute(stmt)).all()
+        if len(rows) < len(ids):
+            return None
+        return {project_id for _, project_id in rows}
+
+    async def apply_pending(self, session: Any) -> None:
+        if not any(self._pending.values()):
+            return
+        pending = self._pending
+        self._pending = {table: set() for table in _MANIFEST_TABLES}
+        try:
+            await self.apply(session, pending)
+        except BaseException:
+            # Applied again before the next read, with the writes received
+            # meanwhile: manifests half rebuilt are never served
+            for table, ids in pending.items():
+                self._pending[table].update(ids)
+            raise
+
+    async def apply(self, session: Any, pending: dict[str, set]) -> None:
+        """Rebuild the parts of the cached manifests touched by the written rows."""
+        if not self._manifests:
+            # Compiles running meanwhile check the generation themselves
+            return
+        # Manifests to rebuild per part
+        headers = pending["project"] & self._manifests.keys()
+        touched: dict[str, set] = {"models": set(), "relations": set(), "views": set()}
+        parts = (
+            (Model, "model", ("models", "relations")),
+            (ModelColumn, "model_column", ("models", "relations")),
+            (ColumnRelation, "relation", ("relations",)),
+            (View, "view", ("views",)),
+        )
+        for entity, table, names in parts:
+            if not pending[table]:
+                continue
+            project_ids = await self.project_ids(session, entity, pending[table])
+            if project_ids is None:
+                # Cannot tell which manifests a hard deleted row was part of
+                self._manifests.clear()
+                return
+            for name in names:
+                touched[name].update(project_ids & self._manifests.keys())
+
+        model_ids = set(pending["model"])
+        if pending["model_column"]:
+            result = await session.execute(
+                select(ModelColumn.model_id).where(ModelColumn.id.in_(pending["model_column"]))
+            )
+            model_ids.update(result.scalars())
+
+        for project_id in headers | touched["models"] | touched["relations"] | touched["views"]:
+            manifest = self._manifests[project_id]
+            if not await self.load_header(session, manifest):
+                del self._manifests[project_id]
+                continue
+            if project_id in headers:
+                # Table references embed the project catalog and schema
+                manifest.models.clear()
+                await self.load_models(session, manifest, Model.project_id == project_id)
+            elif project_id in touched["models"]:
+                for id in model_ids:
+                    manifest.models.pop(id, None)
+                await self.load_models(
+                    session,
+                    manifest,
+                    Model.id.in_(model_ids) & (Model.project_id == project_id),
+                )
+            if project_id in touched["relations"]:
+                await self.load_relations(session, manifest)
+            if project_id in touched["views"]:
+                await self.load_views(session, manifest)
+            manifest.assemble()
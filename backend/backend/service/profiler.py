@@ -0,0 +1,365 @@
+"""Sampled column profiling of source tables.
+
+A profile run samples every table of a project, TABLESAMPLE SYSTEM on
+postgres (pages picked from the row estimate, no full scan), a reservoir
+over the first PROFILE_SCAN_LIMIT streamed rows elsewhere. The sample is
+sketched column by column in arrow batches: null count, min / max and the
+value counts of a batch are computed by arrow, only the distinct values of
+a batch are hashed into the HyperLogLog and count-min sketches.
+
+The sketches are stored in column_profile and merged with the ones of every
+later run, so a re-profile adds its sample to what is known instead of
+starting over. The summary (null fraction, distinct count, min / max, top
+values) is written to ModelColumn.properties["profile"]. It describes the
+sampled rows: the distinct count is an estimate of the distinct values in
+the samples ("distinct_in_sample"), not of the whole table.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from sqlalchemy import column, func, select, table, tablesample, text
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from ..repository.column_profile import ColumnProfile, ColumnProfileRepository
+from ..repository.model import Model, ModelRepository
+from ..repository.model_column import ModelColumn, ModelColumnRepository
+from ..repository.project import Project
+from .datasource import source_pools, source_schema
+from .sketches import CountMinSketch, HyperLogLog, normalize, value_hash
+
+logger = logging.getLogger(__name__)
+
+# Rows sampled per table and profile run
+PROFILE_SAMPLE_ROWS: int = int(os.environ.get("PROFILE_SAMPLE_ROWS", "10000"))
+# Rows read at most by the reservoir of sources without TABLESAMPLE
+PROFILE_SCAN_LIMIT: int = int(os.environ.get("PROFILE_SCAN_LIMIT", "1000000"))
+# Tables sampled at once, bounded by the pool size of source_pools
+PROFILE_CONCURRENCY: int = int(os.environ.get("PROFILE_CONCURRENCY", "4"))
+# Most frequent values kept per column
+PROFILE_TOP_K: int = int(os.environ.get("PROFILE_TOP_K", "10"))
+
+# Values per arrow batch sketched at once
+SKETCH_BATCH_SIZE = 4096
+
+
+def column_array(values: List[Any]) -> pa.Array:
+    try:
+        return pa.array(values)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        # Mixed types (eg: sqlite), compared as their json text
+        return pa.array([None if v is None else json.dumps(normalize(v)) for v in values])
+
+
+def _compare(a: Any, b: Any, pick: Any) -> Any:
+    if a is None or b is None:
+        return b if a is None else a
+    try:
+        return pick(a, b)
+    except TypeError:
+        # Values of another type than the previous samples, keep the stored ones
+        return a
+
+
+@dataclass
+class ColumnSketch:
+    """Mergeable profile of the sampled values of one column."""
+
+    type: str
+    top_k: int = PROFILE_TOP_K
+    rows: int = 0
+    nulls: int = 0
+    min_value: Any = None
+    max_value: Any = None
+    hll: HyperLogLog = field(default_factory=HyperLogLog)
+    cms: CountMinSketch = field(default_factory=CountMinSketch)
+    # json text of the value -> value, the heavy hitter candidates
+    top: dict[str, Any] = field(default_factory=dict)
+
+    def update(self, values: pa.Array) -> None:
+        self.rows += len(values)
+        self.nulls += values.null_count
+        values = values.drop_null()
+        if not len(values):
+            return
+        try:
+            bounds = pc.min_max(values).as_py()
+            self.add_bounds(normalize(bounds["min"]), normalize(bounds["max"]))
+        except pa.ArrowNotImplementedError:
+            pass
+        counts = pc.value_counts(values)
+        distinct = [normalize(value) for value in counts.field("values").to_pylist()]
+        hashes = [value_hash(value) for value in distinct]
+        self.hll.add(hashes)
+        for h, count in zip(hashes, counts.field("counts").to_pylist()):
+            self.cms.add(h, count)
+        # The most frequent values of the batch are the new candidates
+        top = pc.select_k_unstable(
+            counts.field("counts"), min(self.top_k, len(distinct)), [("counts", "descending")]
+        )
+        self.add_candidates(distinct[i] for i in top.to_pylist())
+
+    def add_bounds(self, low: Any, high: Any) -> None:
+        self.min_value = _compare(self.min_value, low, min)
+        self.max_value = _compare(self.max_value, high, max)
+
+    def add_candidates(self, values: Iterable[Any]) -> None:
+        for value in values:
+            self.top[json.dumps(value, sort_keys=True)] = value
+        ranked = sorted(self.top.items(), key=lambda item: -self.cms.estimate(value_hash(item[1])))
+        self.top = dict(ranked[: self.top_k])
+
+    def merge(self, other: "ColumnSketch") -> None:
+        self.rows += other.rows
+        self.nulls += other.nulls
+        self.add_bounds(other.min_value, other.max_value)
+        self.hll.merge(other.hll)
+        self.cms.merge(other.cms)
+        self.add_candidates(other.top.values())
+
+    def top_values(self) -> List[list]:
+        return [[value, self.cms.estimate(value_hash(value))] for value in self.top.values()]
+
+    def frequent_values(self) -> List[list]:
+        # Counts within the error of the sketch tell nothing (eg: unique columns)
+        error = self.cms.error()
+        return [[value, count] for value, count in self.top_values() if count > error]
+
+    def summary(self) -> dict:
+        values = self.rows - self.nulls
+        return {
+            "rows": self.rows,
+            "null_fraction": round(self.nulls / self.rows, 4) if self.rows else None,
+            "distinct_in_sample": min(self.hll.count(), values),
+            "min": self.min_value,
+            "max": self.max_value,
+            "top_k": [{"value": value, "count": count} for value, count in self.frequent_values()],
+        }
+
+    @classmethod
+    def from_profile(cls, profile: ColumnProfile, top_k: int = PROFILE_TOP_K) -> "ColumnSketch":
+        return cls(
+            type=profile.type,
+            top_k=top_k,
+            rows=profile.rows,
+            nulls=profile.nulls,
+            min_value=profile.min_value,
+            max_value=profile.max_value,
+            hll=HyperLogLog.from_bytes(profile.hll),
+            cms=CountMinSketch.from_bytes(profile.cms),
+            top={json.dumps(value, sort_keys=True): value for value, _ in profile.top_values or []},
+        )
+
+    def to_row(self, column_id: str, profiled_at: datetime) -> dict:
+        return {
+            "column_id": column_id,
+            "type": self.type,
+            "rows": self.rows,
+            "nulls": self.nulls,
+            "min_value": self.min_value,
+            "max_value": self.max_value,
+            "hll": self.hll.to_bytes(),
+            "cms": self.cms.to_bytes(),
+            "top_values": self.top_values(),
+            "profiled_at": profiled_at,
+        }
+
+
+# Sketched table handed to the writer: name, columns, sketches, row estimate
+TableSketches = tuple[str, List[Row], Optional[List[ColumnSketch]], Optional[int]]
+
+
+@dataclass
+class ProfileProgress:
+    project_id: str
+    tables: int = 0
+    columns: int = 0
+    failed: List[str] = field(default_factory=list)
+
+
+class ColumnProfiler:
+    """Profiles the source columns of a project's models.
+
+    At most `concurrency` tables are sampled at once, each on a pooled
+    source connection, and sketched off the event loop. Sketched tables are
+    handed over through a bounded queue to a single writer that merges and
+    stores their profiles, so the catalog session is never used concurrently.
+    """
+
+    def __init__(
+        self,
+        project: Project,
+        concurrency: int = PROFILE_CONCURRENCY,
+        sample_rows: int = PROFILE_SAMPLE_ROWS,
+        scan_limit: int = PROFILE_SCAN_LIMIT,
+        top_k: int = PROFILE_TOP_K,
+        rng: Optional[random.Random] = None,
+    ):
+        self.project = project
+        self.schema = source_schema(project)
+        self.concurrency = concurrency
+        self.sample_rows = sample_rows
+        self.scan_limit = scan_limit
+        self.top_k = top_k
+        self.rng = rng or random.Random()
+        self.model_repository = ModelRepository(Model)
+        self.column_repository = ModelColumnRepository(ModelColumn)
+        self.profile_repository = ColumnProfileRepository(ColumnProfile)
+
+    async def run(self, model_ids: Optional[List[str]] = None) -> ProfileProgress:
+        """Profile every model of the project, or only the given ones."""
+        progress = ProfileProgress(project_id=self.project.id)
+        models = {
+            row.id: row.source_table_name
+            for row in await self.model_repository.find_fingerprints(self.project.id)
+            if model_ids is None or row.id in model_ids
+        }
+        columns: dict[str, List[Row]] = {}
+        for row in await self.column_repository.find_profiled_columns(list(models)):
+            columns.setdefault(row.model_id, []).append(row)
+        profiled = [model_id for model_id in models if columns.get(model_id)]
+
+        async with source_pools.lease(self.project) as engine:
+            queue: asyncio.Queue[TableSketches] = asyncio.Queue(
+                maxsize=self.concurrency * 2
+            )
+            semaphore = asyncio.Semaphore(min(self.concurrency, source_pools.pool_size))
+
+            async def profile(model_id: str) -> None:
+                name = models[model_id]
+                try:
+                    sketches, table_rows = await self.profile_table(
+                        engine, semaphore, name, columns[model_id]
+                    )
+                except Exception:
+                    # One unreadable table does not stop the others
+                    logger.exception("Profiling %s failed", name)
+                    progress.failed.append(model_id)
+                    # The writer counts every table
+                    sketches, table_rows = None, None
+                await queue.put((name, columns[model_id], sketches, table_rows))
+
+            async with asyncio.TaskGroup() as group:
+                group.create_task(self.write(queue, len(profiled), progress))
+                for model_id in profiled:
+                    group.create_task(profile(model_id))
+        return progress
+
+    async def profile_table(
+        self, engine: AsyncEngine, semaphore: asyncio.Semaphore, name: str, columns: List[Row]
+    ) -> tuple[List[ColumnSketch], Optional[int]]:
+        async with semaphore:
+            async with engine.connect() as conn:
+                sample, table_rows = await self.sample(
+                    conn, name, [c.source_column_name for c in columns]
+                )
+        return await asyncio.to_thread(self.sketch, columns, sample), table_rows
+
+    async def write(
+        self, queue: "asyncio.Queue[TableSketches]", tables: int, progress: ProfileProgress
+    ) -> None:
+        for _ in range(tables):
+            name, columns, sketches, table_rows = await queue.get()
+            if sketches is None:
+                continue
+            try:
+                await self.save(columns, sketches, table_rows)
+            except Exception:
+                logger.exception("Saving the profiles of %s failed", name)
+                progress.failed.append(columns[0].model_id)
+                continue
+            progress.tables += 1
+            progress.columns += len(columns)
+
+    async def sample(
+        self, conn: AsyncConnection, name: str, names: List[str]
+    ) -> tuple[List[tuple], Optional[int]]:
+        """Up to sample_rows random rows of a table, and its estimated row count."""
+        source = table(name, *(column(n) for n in names), schema=self.schema)
+        stmt = select(*source.c)
+        table_rows: Optional[int] = None
+        if conn.dialect.name == "postgresql":
+            estimate = await conn.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)"),
+                {"name": conn.dialect.identifier_preparer.format_table(source)},
+            )
+            table_rows = max(int(estimate.scalar() or 0), 0) or None
+            if table_rows and table_rows > self.sample_rows:
+                # SYSTEM picks whole pages, twice the pages needed evens out their fill
+                percent = min(100.0, 200.0 * self.sample_rows / table_rows)
+                sampled = tablesample(source, func.system(percent))
+                stmt = select(*sampled.c)
+        else:
+            stmt = stmt.limit(self.scan_limit)
+
+        # Reservoir sampling (algorithm R) over the streamed rows
+        reservoir: List[tuple] = []
+        seen = 0
+        result = await conn.stream(stmt.execution_options(yield_per=SKETCH_BATCH_SIZE))
+        async for rows in result.partitions(SKETCH_BATCH_SIZE):
+            for row in rows:
+                seen += 1
+                if len(reservoir) < self.sample_rows:
+                    reservoir.append(tuple(row))
+                else:
+                    slot = self.rng.randrange(seen)
+                    if slot < self.sample_rows:
+                        reservoir[slot] = tuple(row)
+        if table_rows is None and seen < self.scan_limit:
+            # The whole table was read
+            table_rows = seen
+        return reservoir, table_rows
+
+    def sketch(self, columns: List[Row], sample: List[tuple]) -> List[ColumnSketch]:
+        sketches = [ColumnSketch(c.type, self.top_k) for c in columns]
+        for start in range(0, len(sample), SKETCH_BATCH_SIZE):
+            batch = list(zip(*sample[start : start + SKETCH_BATCH_SIZE]))
+            for sketch, values in zip(sketches, batch):
+                sketch.update(column_array(list(values)))
+        return sketches
+
+    async def save(
+        self, columns: List[Row], sketches: List[ColumnSketch], table_rows: Optional[int]
+    ) -> None:
+        ids = [c.id for c in columns]
+        stored = {
+            profile.column_id: profile
+            for profile in await self.profile_repository.find_by_columns(ids)
+        }
+        profiled_at = datetime.now()
+        rows, updates = [], []
+        properties = await self.column_repository.find_properties(ids)
+        for c, sketch in zip(columns, sketches):
+            profile = stored.get(c.id)
+            # Sketches of another column type are not comparable, start over
+            if profile is not None and profile.type == c.type:
+                merged = ColumnSketch.from_profile(profile, self.top_k)
+                merged.merge(sketch)
+                sketch = merged
+            rows.append(sketch.to_row(c.id, profiled_at))
+            if c.id not in properties:
+                continue
+            try:
+                values = json.loads(properties[c.id] or "{}")
+            except json.JSONDecodeError:
+                values = None
+            if not isinstance(values, dict):
+                # Not a json object, replaced rather than failing the table
+                logger.warning("Replace invalid properties of column %s", c.id)
+                values = {}
+            values["profile"] = sketch.summary() | {
+                "table_rows": table_rows,
+                "profiled_at": profiled_at.isoformat(),
+            }
+            updates.append({"id": c.id, "properties": json.dumps(values, default=str)})
+        await self.profile_repository.upsert_many(rows)
+        await self.column_repository.update_many(updates)
@@ -0,0 +1,224 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Table,
+    and_,
+    delete,
+    exists,
+    insert,
+    literal,
+    or_,
+    select,
+    text,
+)
+from sqlalchemy.exc import DBAPIError
+
+from ..config import Base, db
+from ..repository.base_repository import BasicRepository
+from ..repository.column_profile import ColumnProfile, ColumnProfileRepository
+from ..repository.column_relation import ColumnRelation, ColumnRelationRepository
+from ..repository.model import Model, ModelRepository
+from ..repository.model_column import ModelColumn, ModelColumnRepository
+from ..repository.project import Project, ProjectRepository
+from ..repository.view import View, ViewRepository
+from .locks import advisory_lock
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: purged rows are gone from the catalog tables (archived at best)
+PURGE_ENABLED: bool = os.environ.get("PURGE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Soft deleted rows are kept in the catalog tables for this many days
+PURGE_RETENTION_DAYS: float = float(os.environ.get("PURGE_RETENTION_DAYS", "30"))
+# Move purged rows to the <table>_archive tables, false deletes them for good
+PURGE_ARCHIVE: bool = os.environ.get("PURGE_ARCHIVE", "true").lower() in ("1", "true", "yes")
+# Rows per purge transaction and seconds to sleep between two of them
+PURGE_BATCH_SIZE: int = int(os.environ.get("PURGE_BATCH_SIZE", "500"))
+PURGE_PAUSE: float = float(os.environ.get("PURGE_PAUSE", "0.1"))
+# Seconds between two purge runs
+PURGE_INTERVAL: float = float(os.environ.get("PURGE_INTERVAL", "3600"))
+
+# A batch waiting longer than this for a row lock gives up until the next run
+# instead of queueing the catalog writes behind it (postgres)
+LOCK_TIMEOUT_MS = 2000
+
+# Rows referencing a purged row: (child entity, referencing columns,
+# dependent). Dependent rows only exist through the row they reference (the
+# profiles of a column, the relations joining it) and nothing soft deletes
+# them, they are purged with it. The other children are purged with it once
+# soft deleted, a live one keeps the row until it is deleted too
+CHILDREN: dict[Any, tuple] = {
+    Project: (
+        (ColumnRelation, ("project_id",), False),
+        (View, ("project_id",), False),
+        (Model, ("project_id",), False),
+    ),
+    Model: ((ModelColumn, ("model_id",), False),),
+    ModelColumn: (
+        (ColumnRelation, ("from_column_id", "to_column_id"), True),
+        (ColumnProfile, ("column_id",), True),
+    ),
+}
+
+# Tables whose tombstones are purged, parents first: they take the rows
+# referencing them along, the later tables only have their own tombstones left
+PURGE_ORDER = (Project, Model, View, ModelColumn, ColumnRelation, ColumnProfile)
+
+
+def archive_table(table: Table) -> Table:
+    """<table>_archive: the columns of table, without its indexes and foreign
+    keys, and the time the row was archived."""
+    return Table(
+        f"{table.name}_archive",
+        Base.metadata,
+        *(Column(c.name, c.type, primary_key=c.primary_key) for c in table.columns),
+        Column("archived_at", DateTime, nullable=False, index=True),
+    )
+
+
+ARCHIVES: dict[Any, Table] = {entity: archive_table(entity.__table__) for entity in PURGE_ORDER}
+
+
+def unreferenced(entity: Any, live_only: bool) -> List[Any]:
+    """Conditions on entity: no child row references it. With live_only,
+    no live child other than the dependent ones."""
+    conditions = []
+    for child, keys, dependent in CHILDREN.get(entity, ()):
+        if live_only and dependent:
+            continue
+        refers = or_(*(getattr(child, key) == entity.id for key in keys))
+        if live_only:
+            refers = and_(refers, child.deleted_at.is_(None))
+        conditions.append(~exists().where(refers))
+    return conditions
+
+
+class TombstonePurger:
+    """Removes soft deleted rows older than the retention window, with the
+    rows referencing them (see CHILDREN), from the catalog tables. A row
+    still referenced by a live row is left alone.
+
+    Rows are selected in keyset batches of batch_size ids; each batch is
+    moved to the archive table (or deleted) in its own short transaction,
+    after the children of those ids went the same way, and the job sleeps
+    pause seconds in between so it never holds locks for long or saturates
+    the database. A batch failing on a lock timeout or on a concurrently
+    added child is skipped and retried on the next run.
+    """
+
+    def __init__(
+        self,
+        retention: timedelta = timedelta(days=PURGE_RETENTION_DAYS),
+        archive: bool = PURGE_ARCHIVE,
+        batch_size: int = PURGE_BATCH_SIZE,
+        pause: float = PURGE_PAUSE,
+        interval: float = PURGE_INTERVAL,
+    ):
+        self.retention = retention
+        self.archive = archive
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self.repositories: dict[Any, BasicRepository] = {
+            Project: ProjectRepository(Project),
+            Model: ModelRepository(Model),
+            ModelColumn: ModelColumnRepository(ModelColumn),
+            ColumnRelation: ColumnRelationRepository(ColumnRelation),
+            View: ViewRepository(View),
+            ColumnProfile: ColumnProfileRepository(ColumnProfile),
+        }
+        self._loop: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._loop = asyncio.create_task(self.loop())
+
+    async def stop(self) -> None:
+        if self._loop is not None:
+            self._loop.cancel()
+            await asyncio.gather(self._loop, return_exceptions=True)
+            self._loop = None
+
+    async def loop(self) -> None:
+        while True:
+            try:
+                async with advisory_lock("purge") as acquired:
+                    if acquired:
+                        await self.run()
+            except Exception:
+                logger.exception("Tombstone purge failed")
+            await asyncio.sleep(self.interval)
+
+    async def run(self, now: Optional[datetime] = None) -> dict[str, int]:
+        """Purge the rows soft deleted before now - retention, the purged row
+        count per table."""
+        cutoff = (now or datetime.now()) - self.retention
+        counts = {entity.__tablename__: 0 for entity in PURGE_ORDER}
+        for entity in PURGE_ORDER:
+            await self.purge(entity, entity.deleted_at < cutoff, counts)
+        if any(counts.values()):
+            logger.info("Purged tombstones older than %s: %s", cutoff, counts)
+        return counts
+
+    async def purge(self, entity: Any, condition: Any, counts: dict[str, int]) -> None:
+        """Purge the rows of entity matching condition, their children first."""
+        selected = and_(condition, *unreferenced(entity, live_only=True))
+        # Checked again on removal: a child left behind (eg: referenced by a
+        # live row itself) or added since keeps its parent
+        removable = and_(condition, *unreferenced(entity, live_only=False))
+        last: Optional[str] = None
+        while True:
+            stmt = select(entity.id).where(selected).order_by(entity.id).limit(self.batch_size)
+            if last is not None:
+                stmt = stmt.where(entity.id > last)
+            async with db.session() as session:
+                ids = list((await session.execute(stmt)).scalars())
+            if not ids:
+                return
+            last = ids[-1]
+
+            for child, keys, dependent in CHILDREN.get(entity, ()):
+                refers = or_(*(getattr(child, key).in_(ids) for key in keys))
+                if not dependent:
+                    refers = and_(child.deleted_at.is_not(None), refers)
+                await self.purge(child, refers, counts)
+            removed = await self.remove(entity, ids, removable)
+            counts[entity.__tablename__] += len(removed)
+            self.repositories[entity].after_write("delete", removed)
+            await asyncio.sleep(self.pause)
+
+    async def remove(self, entity: Any, ids: List[str], condition: Any) -> List[str]:
+        """Archive / delete one batch in one transaction, the removed ids."""
+        # The condition again, a row may have changed since it was selected
+        where = (entity.id.in_(ids), condition)
+        async with db.session() as session:
+            try:
+                if db.engine.dialect.name == "postgresql":
+                    await session.execute(text(f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS}"))
+                if self.archive:
+                    columns = list(entity.__table__.columns)
+                    await session.execute(
+                        insert(ARCHIVES[entity]).from_select(
+                            [c.name for c in columns] + ["archived_at"],
+                            select(*columns, literal(datetime.now(), DateTime)).where(*where),
+                        )
+                    )
+                result = await session.execute(
+                    delete(entity).where(*where).returning(entity.id)
+                )
+                removed = list(result.scalars())
+                await session.commit()
+            except DBAPIError as e:
+                await session.rollback()
+                logger.warning(
+                    "Skip purge of %s %s rows until the next run: %s",
+                    len(ids),
+                    entity.__tablename__,
+                    e.orig,
+                )
+                return []
+        return removed
@@ -0,0 +1,311 @@
+import asyncio
+import heapq
+import logging
+import os
+import random
+import re
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update
+
+from ..config import db
+from ..repository.base_repository import WriteEvent, add_write_listener, remove_write_listener
+from ..repository.model import Model
+from ..repository.project import Project
+from .harvester import SchemaHarvester
+from .locks import advisory_lock
+
+logger = logging.getLogger(__name__)
+
+# Opt-in: a worker refreshes the cached models only when set
+REFRESH_ENABLED: bool = os.environ.get("REFRESH_ENABLED", "false").lower() in ("1", "true", "yes")
+# Refreshes running at once in this worker, in total and per project
+REFRESH_CONCURRENCY: int = int(os.environ.get("REFRESH_CONCURRENCY", "4"))
+REFRESH_PROJECT_CONCURRENCY: int = int(os.environ.get("REFRESH_PROJECT_CONCURRENCY", "1"))
+
+# A due time is pushed back by up to this fraction of the interval, so
+# refreshes with the same refresh_time drift apart instead of lining up
+REFRESH_JITTER = 0.1
+# Never refreshed or overdue targets are spread over at most this many seconds
+REFRESH_SPREAD = 300.0
+# Retry delay after a failed refresh, doubled per consecutive failure
+RETRY_DELAY = 30.0
+MAX_RETRY_DELAY = 3600.0
+
+_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1, "m": 60, "h": 3600, "d": 86400}
+_DURATION = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h|d)\s*$")
+
+
+def parse_duration(value: str) -> float:
+    """Seconds of a refresh_time, a number followed by a unit, eg: "2h"."""
+    match = _DURATION.match(value or "")
+    if match is None:
+        raise ValueError(f"Invalid refresh time {value!r}")
+    seconds = float(match.group(1)) * _UNITS[match.group(2)]
+    if seconds <= 0:
+        raise ValueError(f"Invalid refresh time {value!r}")
+    return seconds
+
+
+@dataclass
+class RefreshTarget:
+    # Always model: a view has no datasource state to refresh, cached views
+    # are left out of the schedule
+    kind: str
+    id: str
+    project_id: str
+    # Seconds between two refreshes
+    interval: float
+    refreshed_at: Optional[datetime] = None
+    # Consecutive failed refreshes
+    failures: int = 0
+
+    @property
+    def key(self) -> tuple[str, str]:
+        return (self.kind, self.id)
+
+
+async def refresh_source(target: RefreshTarget) -> None:
+    """Default refresh: re-sync the source table of a cached model."""
+    async with db.session() as session:
+        model = await session.get(Model, target.id)
+        project = await session.get(Project, target.project_id)
+    if model is None or project is None:
+        return
+    await SchemaHarvester(project, concurrency=1).run([model.source_table_name])
+
+
+class RefreshScheduler:
+    """Refreshes cached models every refresh_time.
+
+    Targets wait in a min-heap ordered by due time; one loop sleeps until the
+    earliest is due and starts it within the global and per project limits.
+    Due times come from the refreshed_at stored on the row plus the interval
+    and a random delay, so restarts resume the schedule and workers do not
+    fire together. A postgres advisory lock per target lets only one worker
+    refresh it; the others find the new refreshed_at and move on.
+    """
+
+    def __init__(
+        self,
+        refresh: Callable[[RefreshTarget], Awaitable[Any]] = refresh_source,
+        concurrency: int = REFRESH_CONCURRENCY,
+        project_concurrency: int = REFRESH_PROJECT_CONCURRENCY,
+        jitter: float = REFRESH_JITTER,
+        rng: Optional[random.Random] = None,
+    ):
+        self.refresh = refresh
+        self.project_concurrency = project_concurrency
+        self.jitter = jitter
+        self.rng = rng or random.Random()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.project_semaphores: dict[str, asyncio.Semaphore] = {}
+
+        self.targets: dict[tuple[str, str], RefreshTarget] = {}
+        # (due, sequence, key); entries replaced by a later push are skipped
+        self.heap: List[tuple[float, int, tuple[str, str]]] = []
+        self.entries: dict[tuple[str, str], int] = {}
+        self.sequence = 0
+        self.running: set[tuple[str, str]] = set()
+        self.tasks: set[asyncio.Task] = set()
+
+        self._pending: dict[str, set] = {"model": set()}
+        # Reload every target, set on a resync of the model writes
+        self._resync = False
+        self._wakeup = asyncio.Event()
+        self._loop: Optional[asyncio.Task] = None
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table in self._pending:
+            if event.action == "resync":
+                self._resync = True
+            self._pending[event.table].update(event.ids)
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        add_write_listener(self._on_write)
+        # The loop loads every target first
+        self._resync = True
+        self._loop = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        remove_write_listener(self._on_write)
+        if self._loop is not None:
+            self._loop.cancel()
+        for task in list(self.tasks):
+            task.cancel()
+        await asyncio.gather(
+            *self.tasks, *([self._loop] if self._loop else []), return_exceptions=True
+        )
+        self._loop = None
+
+    def next_due(self, target: RefreshTarget, now: float) -> float:
+        if target.failures:
+            delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (target.failures - 1))
+            return now + self.rng.uniform(delay / 2, delay)
+
+        spread = min(target.interval, REFRESH_SPREAD)
+        if target.refreshed_at is None:
+            return now + self.rng.uniform(0, spread)
+        due = target.refreshed_at.timestamp() + target.interval
+        due += self.rng.uniform(0, target.interval * self.jitter)
+        if due < now:
+            # Overdue after downtime, do not start them all at once
+            return now + self.rng.uniform(0, spread)
+        return due
+
+    def schedule(self, target: RefreshTarget, due: float) -> None:
+        self.sequence += 1
+        self.entries[target.key] = self.sequence
+        heapq.heappush(self.heap, (due, self.sequence, target.key))
+
+    def unschedule(self, key: tuple[str, str]) -> None:
+        self.targets.pop(key, None)
+        self.entries.pop(key, None)
+
+    async def load(self, ids: Optional[dict[str, set]] = None) -> None:
+        """(Re)load all targets, or only the given model ids."""
+        now = time.time()
+        for kind, entity in (("model", Model),):
+            if ids is not None and not ids[kind]:
+                continue
+            stmt = select(
+                entity.id, entity.project_id, entity.refresh_time, entity.refreshed_at
+            ).where(
+                entity.cached.is_(True),
+                entity.refresh_time.is_not(None),
+                entity.deleted_at.is_(None),
+            )
+            if ids is not None:
+                stmt = stmt.where(entity.id.in_(ids[kind]))
+            async with db.session() as session:
+                rows = (await session.execute(stmt)).all()
+
+            found = set()
+            for id, project_id, refresh_time, refreshed_at in rows:
+                try:
+                    interval = parse_duration(refresh_time)
+                except ValueError:
+                    logger.warning("Skip %s %s: invalid refresh_time %r", kind, id, refresh_time)
+                    continue
+                found.add(id)
+                key = (kind, id)
+                target = self.targets.get(key)
+                if target is None:
+                    target = self.targets[key] = RefreshTarget(kind, id, project_id, interval)
+                changed = (target.interval, target.refreshed_at) != (interval, refreshed_at)
+                target.project_id, target.interval = project_id, interval
+                target.refreshed_at = refreshed_at
+                if key not in self.running and (changed or key not in self.entries):
+                    self.schedule(target, self.next_due(target, now))
+
+            # Written rows that are no longer cached / deleted, or on a full
+            # reload every target not found again
+            known = ids[kind] if ids is not None else {id for k, id in self.targets if k == kind}
+            for id in known - found:
+                self.unschedule((kind, id))
+
+    async def reload(self) -> None:
+        """Load the targets written since the last reload (all of them after
+        a resync). On failure they stay pending for the next one."""
+        resync, pending = self._resync, self._pending
+        self._resync, self._pending = False, {"model": set()}
+        try:
+            await self.load(None if resync else pending)
+        except BaseException:
+            # Writes received meanwhile are kept as well
+            self._resync = self._resync or resync
+            for kind, ids in pending.items():
+                self._pending[kind].update(ids)
+            raise
+
+    async def run(self) -> None:
+        # Consecutive failed reloads, and when to try the next one
+        failures = 0
+        retry_at = 0.0
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            reload = self._resync or any(self._pending.values())
+            if reload and now >= retry_at:
+                try:
+                    await self.reload()
+                    failures, reload = 0, False
+                except Exception:
+                    failures += 1
+                    retry_at = now + min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (failures - 1))
+                    logger.exception("Loading refresh targets failed (%s in a row)", failures)
+
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                _, sequence, key = heapq.heappop(self.heap)
+                if self.entries.get(key) != sequence or key in self.running:
+                    continue
+                del self.entries[key]
+                self.running.add(key)
+                task = asyncio.create_task(self.execute(self.targets[key]))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+
+            timeout = self.heap[0][0] - now if self.heap else None
+            if reload:
+                wait = max(0.0, retry_at - now)
+                timeout = wait if timeout is None else min(timeout, wait)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def project_semaphore(self, project_id: str) -> asyncio.Semaphore:
+        semaphore = self.project_semaphores.get(project_id)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.project_concurrency)
+            self.project_semaphores[project_id] = semaphore
+        return semaphore
+
+    async def execute(self, target: RefreshTarget) -> None:
+        try:
+            async with self.project_semaphore(target.project_id), self.semaphore:
+                async with advisory_lock(f"refresh:{target.kind}:{target.id}") as acquired:
+                    if acquired:
+                        await self.refresh_locked(target)
+                    else:
+                        logger.debug("%s %s is refreshed by another worker", *target.key)
+        finally:
+            self.running.discard(target.key)
+            if target.key in self.targets and target.key not in self.entries:
+                self.schedule(target, self.next_due(target, time.time()))
+                self._wakeup.set()
+
+    async def refresh_locked(self, target: RefreshTarget) -> None:
+        async with db.session() as session:
+            refreshed_at = (
+                await session.execute(select(Model.refreshed_at).where(Model.id == target.id))
+            ).scalar()
+        if refreshed_at is not None and refreshed_at.timestamp() + target.interval > time.time():
+            # Another worker refreshed it since it was scheduled
+            target.refreshed_at = refreshed_at
+            return
+
+        started = time.monotonic()
+        try:
+            await self.refresh(target)
+        except Exception:
+            target.failures += 1
+            logger.exception("Refresh of %s %s failed (%s in a row)", *target.key, target.failures)
+            return
+        target.failures = 0
+        target.refreshed_at = datetime.now()
+        # Scheduling state only: not an edit of the row, no updated_at and no
+        # write event (caches, manifests and the other workers are unaffected)
+        async with db.session() as session:
+            await session.execute(
+                update(Model)
+                .where(Model.id == target.id)
+                .values(refreshed_at=target.refreshed_at)
+            )
+            await session.commit()
+        logger.info("Refreshed %s %s in %.2fs", *target.key, time.monotonic() - started)
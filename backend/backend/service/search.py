@@ -0,0 +1,273 @@
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, List, Optional
+
+from sqlalchemy import func, literal, literal_column, or_, select, union_all
+
+from ..config import db
+from ..repository.base_repository import WriteEvent, add_write_listener, search_vector
+from ..repository.model import Model
+from ..repository.model_column import ModelColumn
+from ..repository.view import View
+
+# pg_trgm default similarity threshold of the % operator
+SIMILARITY_THRESHOLD = 0.3
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
+# Tables whose writes change the searchable names
+_SEARCH_TABLES = ("model", "model_column", "view")
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+@dataclass
+class SearchHit:
+    # model, column or view
+    kind: str
+    id: str
+    # Owning model of a column, the model itself for a model, None for a view
+    model_id: Optional[str]
+    name: str
+    score: float
+
+
+def trigrams(text: str) -> set[str]:
+    """Trigrams the way pg_trgm builds them: per lowercase word, padded with
+    two spaces in front and one behind."""
+    grams = set()
+    for word in _WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """In-process trigram index of one project, used when the catalog database
+    has no pg_trgm (sqlite)."""
+
+    def __init__(self, documents: List[tuple[str, str, Optional[str], str]]):
+        # (kind, id, model_id, name) per searchable name
+        self.documents = documents
+        self.ids = {id for _, id, _, _ in documents}
+        self.sizes: List[int] = []
+        self.postings: dict[str, List[int]] = {}
+        for position, (_, _, _, name) in enumerate(documents):
+            grams = trigrams(name)
+            self.sizes.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(position)
+
+    def search(self, query: str) -> List[SearchHit]:
+        grams = trigrams(query)
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self.postings.get(gram, ()))
+
+        # Any name containing the query shares at least one of its trigrams,
+        # so the postings are enough to find the substring matches too
+        needle = query.lower()
+        best: dict[tuple[str, str], SearchHit] = {}
+        for position, count in shared.items():
+            union = len(grams) + self.sizes[position] - count
+            score = count / union if union else 0.0
+            kind, id, model_id, name = self.documents[position]
+            if score < SIMILARITY_THRESHOLD and needle not in name.lower():
+                continue
+            hit = best.get((kind, id))
+            if hit is None or hit.score < score:
+                best[(kind, id)] = SearchHit(kind, id, model_id, name, score)
+        return sorted(best.values(), key=lambda hit: (-hit.score, hit.name))
+
+
+class CatalogSearch:
+    """Ranked name search over models, columns and views of a project.
+
+    On postgres it runs on the trigram and full text GIN indexes created by
+    search_indexes. Other databases use an in-process TrigramIndex per project;
+    write listeners only record the written ids, the indexes of their
+    projects are dropped before the next search. An index built while a
+    write came in may have missed it, it serves its search and is not kept.
+    """
+
+    def __init__(self):
+        self._indexes: dict[str, TrigramIndex] = {}
+        self._pending: dict[str, set] = {table: set() for table in _SEARCH_TABLES}
+        # Writes received so far, compared before and after an index build
+        self._generation = 0
+        add_write_listener(self._on_write)
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table in self._pending:
+            self._generation += 1
+            if event.action == "resync":
+                self._indexes.clear()
+            self._pending[event.table].update(event.ids)
+
+    async def search(
+        self, project_id: str, query: str, query_options: Optional[dict] = None
+    ) -> List[SearchHit]:
+        # query_options:
+        #   limit: page size, default SEARCH_LIMIT, at most MAX_SEARCH_LIMIT
+        #   offset: hits to skip
+        query_options = query_options or {}
+        limit = min(query_options.get("limit", SEARCH_LIMIT), MAX_SEARCH_LIMIT)
+        offset = query_options.get("offset", 0)
+        query = query.strip()
+        if not query:
+            return []
+
+        async with db.session() as session:
+            await self.drop_pending(session)
+            conn = await session.connection()
+            if conn.dialect.name == "postgresql":
+                stmt = self.search_statement(project_id, query, limit, offset)
+                result = await session.execute(stmt)
+                return [SearchHit(**row._asdict()) for row in result.all()]
+
+            index = self._indexes.get(project_id)
+            if index is None:
+                generation = self._generation
+                index = TrigramIndex(await self.load_documents(session, project_id))
+                if generation == self._generation:
+                    self._indexes[project_id] = index
+        return index.search(query)[offset : offset + limit]
+
+    def search_statement(self, project_id: str, query: str, limit: int, offset: int) -> Any:
+        pattern = "%" + re.sub(r"([\\%_])", r"\\\1", query) + "%"
+
+        def field(kind: str, entity: Any, name: Any, model_id: Any, project_filter: Any) -> Any:
+            vector = search_vector(name)
+            tsquery = func.plainto_tsquery(literal_column("'simple'"), query)
+            score = func.greatest(func.similarity(name, query), func.ts_rank(vector, tsquery))
+            return select(
+                literal(kind).label("kind"),
+                entity.id.label("id"),
+                model_id.label("model_id"),
+                name.label("name"),
+                score.label("score"),
+            ).where(
+                or_(
+                    name.op("%")(query),
+                    name.ilike(pattern, escape="\\"),
+                    vector.op("@@")(tsquery),
+                ),
+                entity.deleted_at.is_(None),
+                project_filter,
+            )
+
+        model_filter = Model.project_id == project_id
+        column_filter = ModelColumn.model_id.in_(
+            select(Model.id).where(model_filter, Model.deleted_at.is_(None))
+        )
+        fields = union_all(
+            field("model", Model, Model.display_name, Model.id, model_filter),
+            field("model", Model, Model.reference_name, Model.id, model_filter),
+            field("column", ModelColumn, ModelColumn.display_name, ModelColumn.model_id, column_filter),
+            field("column", ModelColumn, ModelColumn.reference_name, ModelColumn.model_id, column_filter),
+            field("view", View, View.name, literal(None), View.project_id == project_id),
+        ).subquery()
+
+        # Best matching name per entity
+        ranked = select(
+            fields,
+            func.row_number()
+            .over(partition_by=(fields.c.kind, fields.c.id), order_by=fields.c.score.desc())
+            .label("rank"),
+        ).subquery()
+        return (
+            select(ranked.c.kind, ranked.c.id, ranked.c.model_id, ranked.c.name, ranked.c.score)
+            .where(ranked.c.rank == 1)
+            .order_by(ranked.c.score.desc(), ranked.c.name)
+            .limit(limit)
+            .offset(offset)
+        )
+
+    async def drop_pending(self, session: Any) -> None:
+        if not any(self._pending.values()):
+            return
+        pending = self._pending
+        self._pending = {table: set() for table in _SEARCH_TABLES}
+        if not self._indexes:
+            # Index builds running meanwhile check the generation themselves
+            return
+        try:
+            projects = await self.written_projects(session, pending)
+        except BaseException:
+            # Dropped before the next search, with the writes received meanwhile
+            for table, ids in pending.items():
+                self._pending[table].update(ids)
+            raise
+        for project_id in projects:
+            self._indexes.pop(project_id, None)
+
+    async def written_projects(self, session: Any, pending: dict[str, set]) -> set:
+        """Projects of the written rows, soft deleted or not. Rows gone for
+        good are looked up in the loaded indexes."""
+        projects = set()
+        if pending["model"] or pending["model_column"]:
+            models = await session.execute(
+                select(Model.project_id)
+                .where(
+                    or_(
+                        Model.id.in_(pending["model"]),
+                        Model.id.in_(
+                            select(ModelColumn.model_id).where(
+                                ModelColumn.id.in_(pending["model_column"])
+                            )
+                        ),
+                    )
+                )
+                .distinct()
+            )
+            projects.update(models.scalars())
+        if pending["view"]:
+            views = await session.execute(
+                select(View.project_id).where(View.id.in_(pending["view"])).distinct()
+            )
+            projects.update(views.scalars())
+
+        written = set().union(*pending.values())
+        for project_id, index in self._indexes.items():
+            if not index.ids.isdisjoint(written):
+                projects.add(project_id)
+        return projects
+
+    async def load_documents(self, session: Any, project_id: str) -> List[tuple]:
+        documents: List[tuple] = []
+        models = await session.execute(
+            select(Model.id, Model.display_name, Model.reference_name).where(
+                Model.project_id == project_id, Model.deleted_at.is_(None)
+            )
+        )
+        for id, display_name, reference_name in models.all():
+            documents.append(("model", id, id, display_name))
+            documents.append(("model", id, id, reference_name))
+
+        columns = await session.execute(
+            select(
+                ModelColumn.id,
+                ModelColumn.model_id,
+                ModelColumn.display_name,
+                ModelColumn.reference_name,
+            )
+            .join(Model, Model.id == ModelColumn.model_id)
+            .where(
+                Model.project_id == project_id,
+                Model.deleted_at.is_(None),
+                ModelColumn.deleted_at.is_(None),
+            )
+        )
+        for id, model_id, display_name, reference_name in columns.all():
+            documents.append(("column", id, model_id, display_name))
+            documents.append(("column", id, model_id, reference_name))
+
+        views = await session.execute(
+            select(View.id, View.name).where(
+                View.project_id == project_id, View.deleted_at.is_(None)
+            )
+        )
+        documents.extend(("view", id, None, name) for id, name in views.all())
+        return documents
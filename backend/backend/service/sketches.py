@@ -0,0 +1,136 @@
+"""Mergeable sketches of column values.
+
+Both sketches are updated with 64-bit value hashes (value_hash) and merge
+by a register-wise max / sum, so the sketch of a new sample folds into the
+stored one and the result is the sketch of both samples.
+"""
+
+import hashlib
+import json
+import math
+import struct
+import sys
+from array import array
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Iterable, Optional
+
+# Register index bits of the HyperLogLog, 2^12 registers: ~1.6% standard error
+HLL_PRECISION = 12
+# Count-min dimensions: estimates exceed the true count by at most
+# e / width of the total count, with probability 1 - e^-depth
+CMS_WIDTH = 1024
+CMS_DEPTH = 4
+
+
+def normalize(value: Any) -> Any:
+    """Json value of a column value, ordered like the value: numbers stay
+    numbers, dates and times become their iso format."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex()
+    return str(value)
+
+
+def value_hash(value: Any) -> int:
+    """Stable 64-bit hash of a normalized value, the same in every process."""
+    raw = json.dumps(value, separators=(",", ":")).encode()
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """Approximate distinct count."""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytes] = None):
+        self.precision = precision
+        self.registers = bytearray(registers or bytes(1 << precision))
+        if len(self.registers) != 1 << precision:
+            raise ValueError(f"Expected {1 << precision} registers, got {len(self.registers)}")
+
+    def add(self, hashes: Iterable[int]) -> None:
+        p = self.precision
+        registers = self.registers
+        rest = 64 - p
+        for h in hashes:
+            index = h >> rest
+            # Position of the first 1 bit of the remaining bits
+            rank = rest - (h & ((1 << rest) - 1)).bit_length() + 1
+            if rank > registers[index]:
+                registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate on small sets
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes([self.precision]) + bytes(self.registers)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "HyperLogLog":
+        return cls(data[0], data[1:])
+
+
+class CountMinSketch:
+    """Approximate value frequencies, never below the true count."""
+
+    def __init__(
+        self, width: int = CMS_WIDTH, depth: int = CMS_DEPTH, counters: Optional[array] = None
+    ):
+        self.width = width
+        self.depth = depth
+        self.counters = counters if counters is not None else array("Q", bytes(8 * width * depth))
+        if len(self.counters) != width * depth:
+            raise ValueError(f"Expected {width * depth} counters, got {len(self.counters)}")
+
+    def _cells(self, h: int) -> Iterable[int]:
+        # Row hashes derived from two halves of the value hash (Kirsch-Mitzenmacher)
+        h1, h2 = h & 0xFFFF_FFFF, h >> 32
+        return ((row * self.width) + (h1 + row * h2) % self.width for row in range(self.depth))
+
+    def add(self, h: int, count: int = 1) -> None:
+        for cell in self._cells(h):
+            self.counters[cell] += count
+
+    def estimate(self, h: int) -> int:
+        return min(self.counters[cell] for cell in self._cells(h))
+
+    def error(self) -> float:
+        """Overestimate bound of estimate (holds with probability 1 - e^-depth)."""
+        total = sum(self.counters[: self.width])
+        return math.e * total / self.width
+
+    def merge(self, other: "CountMinSketch") -> None:
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge sketches of different dimensions")
+        self.counters = array("Q", map(sum, zip(self.counters, other.counters)))
+
+    def to_bytes(self) -> bytes:
+        counters = array("Q", self.counters)
+        if sys.byteorder != "little":
+            counters.byteswap()
+        return struct.pack("<II", self.width, self.depth) + counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "CountMinSketch":
+        width, depth = struct.unpack_from("<II", data)
+        counters = array("Q")
+        counters.frombytes(data[8:])
+        if sys.byteorder != "little":
+            counters.byteswap()
+        return cls(width, depth, counters)
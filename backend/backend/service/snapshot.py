@@ -0,0 +1,248 @@
+import itertools
+from array import array
+from typing import Any, Iterable, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from ..config import db
+from ..repository.base_repository import WriteEvent, add_write_listener
+from ..repository.model import Model
+from ..repository.model_column import ModelColumn
+from ..repository.project import Project
+
+# Tables whose writes change a snapshot
+_SNAPSHOT_TABLES = ("project", "model", "model_column")
+
+# Snapshot versions, increasing across all projects and rebuilds
+_versions = itertools.count(1)
+
+
+class ModelRecord(NamedTuple):
+    id: str
+    reference_name: str
+    display_name: str
+    source_table_name: str
+    ref_sql: Optional[str]
+    cached: Optional[bool]
+    refresh_time: Optional[str]
+    properties: Optional[dict]
+
+
+class ColumnRecord(NamedTuple):
+    id: str
+    model_id: str
+    reference_name: str
+    display_name: str
+    source_column_name: str
+    type: str
+    not_null: bool
+    is_pk: bool
+    is_calculated: bool
+    aggregation: Optional[str]
+    custom_expression: Optional[str]
+    lineage: Optional[str]
+    # Json string, as stored
+    properties: Optional[str]
+
+
+# Model ids, names, types and properties repeat across the rows of a
+# catalog, short strings are shared by the records of a snapshot instead of
+# held once per row
+_SHARED_LENGTH = 64
+
+
+def _record(record: Any, row: Iterable[Any], shared: dict[str, str]) -> Any:
+    return record._make(
+        shared.setdefault(value, value)
+        if type(value) is str and len(value) <= _SHARED_LENGTH
+        else value
+        for value in row
+    )
+
+
+_MODEL_COLUMNS = tuple(getattr(Model, name) for name in ModelRecord._fields)
+_COLUMN_COLUMNS = tuple(getattr(ModelColumn, name) for name in ColumnRecord._fields)
+
+
+class CatalogSnapshot:
+    """Immutable view of the live models and columns of one project.
+
+    Records are plain tuples built from raw rows, no ORM instance is ever
+    created. Models are in reference_name order; the columns of model i
+    are columns[offsets[i]:offsets[i + 1]], in creation order. Lookups go
+    through dicts from id / reference name to positions. A change builds a
+    new snapshot with a new version, readers holding the previous one keep
+    a consistent view.
+    """
+
+    __slots__ = (
+        "project_id",
+        "version",
+        "models",
+        "columns",
+        "offsets",
+        "model_positions",
+        "model_names",
+        "column_positions",
+    )
+
+    def __init__(
+        self, project_id: str, models: Iterable[ModelRecord], columns: Iterable[ColumnRecord]
+    ):
+        self.project_id = project_id
+        self.version = next(_versions)
+        self.models: tuple[ModelRecord, ...] = tuple(
+            sorted(models, key=lambda model: model.reference_name)
+        )
+        self.model_positions = {model.id: i for i, model in enumerate(self.models)}
+        self.model_names = {model.reference_name: i for i, model in enumerate(self.models)}
+
+        groups: list[list[ColumnRecord]] = [[] for _ in self.models]
+        for column in columns:
+            position = self.model_positions.get(column.model_id)
+            if position is not None:
+                groups[position].append(column)
+        self.columns: tuple[ColumnRecord, ...] = tuple(itertools.chain.from_iterable(groups))
+        self.offsets = array("I", itertools.accumulate((len(g) for g in groups), initial=0))
+        self.column_positions = {column.id: i for i, column in enumerate(self.columns)}
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        if hasattr(self, name):
+            raise AttributeError(f"CatalogSnapshot.{name} is read only")
+        super().__setattr__(name, value)
+
+    def model(self, id: str) -> Optional[ModelRecord]:
+        position = self.model_positions.get(id)
+        return None if position is None else self.models[position]
+
+    def model_by_name(self, reference_name: str) -> Optional[ModelRecord]:
+        position = self.model_names.get(reference_name)
+        return None if position is None else self.models[position]
+
+    def columns_of(self, model_id: str) -> tuple[ColumnRecord, ...]:
+        position = self.model_positions.get(model_id)
+        if position is None:
+            return ()
+        return self.columns[self.offsets[position] : self.offsets[position + 1]]
+
+    def column(self, id: str) -> Optional[ColumnRecord]:
+        position = self.column_positions.get(id)
+        return None if position is None else self.columns[position]
+
+    def column_by_name(self, model_id: str, reference_name: str) -> Optional[ColumnRecord]:
+        return next(
+            (c for c in self.columns_of(model_id) if c.reference_name == reference_name), None
+        )
+
+
+class CatalogSnapshots:
+    """Per project snapshots of the catalog for the read endpoints, built
+    on first use and rebuilt after writes to their models or columns.
+
+    Write listeners only record the written ids; before the next read the
+    touched snapshots are rebuilt and swapped in. A snapshot built while a
+    write came in may have missed it, it serves its read and is not kept.
+    """
+
+    def __init__(self):
+        self._snapshots: dict[str, CatalogSnapshot] = {}
+        self._pending: dict[str, set] = {table: set() for table in _SNAPSHOT_TABLES}
+        # Writes received so far, compared before and after a build
+        self._generation = 0
+        add_write_listener(self._on_write)
+
+    def _on_write(self, event: WriteEvent) -> None:
+        if event.table in self._pending:
+            self._generation += 1
+            if event.action == "resync":
+                self._snapshots.clear()
+            self._pending[event.table].update(event.ids)
+
+    async def get(self, project_id: str) -> Optional[CatalogSnapshot]:
+        """The snapshot of a project, None when it does not exist."""
+        if any(self._pending.values()):
+            await self.apply_pending()
+        snapshot = self._snapshots.get(project_id)
+        if snapshot is None:
+            generation = self._generation
+            async with db.session() as session:
+                snapshot = await self.build(session, project_id)
+            if snapshot is not None and generation == self._generation:
+                self._snapshots[project_id] = snapshot
+        return snapshot
+
+    async def build(self, session: Any, project_id: str) -> Optional[CatalogSnapshot]:
+        project = await session.execute(
+            select(Project.id).where(Project.id == project_id, Project.deleted_at.is_(None))
+        )
+        if project.scalar() is None:
+            return None
+        models = await session.execute(
+            select(*_MODEL_COLUMNS).where(
+                Model.project_id == project_id, Model.deleted_at.is_(None)
+            )
+        )
+        columns = await session.execute(
+            select(*_COLUMN_COLUMNS)
+            .join(Model, Model.id == ModelColumn.model_id)
+            .where(
+                Model.project_id == project_id,
+                Model.deleted_at.is_(None),
+                ModelColumn.deleted_at.is_(None),
+            )
+            .order_by(ModelColumn.created_at, ModelColumn.id)
+        )
+        shared: dict[str, str] = {}
+        return CatalogSnapshot(
+            project_id,
+            [_record(ModelRecord, row, shared) for row in models.all()],
+            [_record(ColumnRecord, row, shared) for row in columns.all()],
+        )
+
+    async def apply_pending(self) -> None:
+        pending = self._pending
+        self._pending = {table: set() for table in _SNAPSHOT_TABLES}
+        try:
+            await self.apply(pending)
+        except BaseException:
+            # Applied again before the next read, with the writes received meanwhile
+            for table, ids in pending.items():
+                self._pending[table].update(ids)
+            raise
+
+    async def apply(self, pending: dict[str, set]) -> None:
+        """Rebuild and swap in the snapshots touched by the written rows."""
+        if not self._snapshots:
+            # Builds running meanwhile check the generation themselves
+            return
+        touched = pending["project"] & self._snapshots.keys()
+        # Snapshots holding a written row (it may since be hard deleted), and
+        # the projects the rows are in now (new rows, rows moved to another model)
+        for table, lookup in (("model", "model_positions"), ("model_column", "column_positions")):
+            for project_id, snapshot in self._snapshots.items():
+                if not pending[table].isdisjoint(getattr(snapshot, lookup)):
+                    touched.add(project_id)
+        async with db.session() as session:
+            if pending["model"]:
+                result = await session.execute(
+                    select(Model.project_id).where(Model.id.in_(pending["model"]))
+                )
+                touched.update(result.scalars())
+            if pending["model_column"]:
+                result = await session.execute(
+                    select(Model.project_id)
+                    .join(ModelColumn, ModelColumn.model_id == Model.id)
+                    .where(ModelColumn.id.in_(pending["model_column"]))
+                )
+                touched.update(result.scalars())
+
+        touched &= self._snapshots.keys()
+        if not touched:
+            return
+        async with db.session() as session:
+            for project_id in touched:
+                snapshot = await self.build(session, project_id)
+                if snapshot is None:
+                    self._snapshots.pop(project_id, None)
+                else:
+                    self._snapshots[project_id] = snapshot
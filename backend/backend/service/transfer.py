@@ -0,0 +1,278 @@
+"""Export / import of a whole project catalog as Arrow IPC streams.
+
+An export is one Arrow IPC stream per table, written back to back in the
+order of TABLES; the schema metadata of a stream names its table and the
+format version. Both sides work a batch at a time, so memory stays flat
+whatever the size of the catalog.
+
+Usage (run from the backend folder, uses DB_CONFIG):
+    python -m backend.service.transfer export <project_id> catalog.arrow
+    python -m backend.service.transfer import catalog.arrow [--name "Copy"]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, AsyncIterator, BinaryIO, Iterator, List, Optional
+
+import pyarrow as pa
+from sqlalchemy import Uuid, and_, select
+from sqlalchemy.types import JSON
+
+from ..config import db
+from ..repository.base_repository import BasicRepository, uuid7
+from ..repository.column_relation import ColumnRelation, ColumnRelationRepository
+from ..repository.model import Model, ModelRepository
+from ..repository.model_column import ModelColumn, ModelColumnRepository
+from ..repository.project import Project, ProjectRepository
+from ..repository.view import View, ViewRepository
+from .lineage import lineage_ids
+
+FORMAT_VERSION = "1"
+MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+# Rows per record batch of an export, and per insert of an import
+TRANSFER_BATCH_SIZE = 5000
+
+# Export / import order, every table after the ones it references
+TABLES = (Project, Model, ModelColumn, ColumnRelation, View)
+
+# Never exported, only live rows are
+_SKIPPED = ("deleted_at", "deleted_by")
+
+
+def arrow_type(column: Any) -> pa.DataType:
+    if isinstance(column.type, (JSON, Uuid)):
+        # Json as its text, keys as their text form
+        return pa.string()
+    python_type = column.type.python_type
+    if python_type is bool:
+        return pa.bool_()
+    if python_type is int:
+        return pa.int64()
+    if python_type is float:
+        return pa.float64()
+    if python_type is datetime:
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def arrow_schema(entity: Any) -> pa.Schema:
+    table = entity.__table__
+    return pa.schema(
+        [pa.field(c.name, arrow_type(c)) for c in table.columns if c.name not in _SKIPPED],
+        metadata={"table": table.name, "version": FORMAT_VERSION},
+    )
+
+
+def project_rows(entity: Any, project_id: str) -> Any:
+    """Condition of the live rows of a project in one table."""
+    if entity is Project:
+        condition = Project.id == project_id
+    elif entity is ModelColumn:
+        condition = ModelColumn.model_id.in_(
+            select(Model.id).where(Model.project_id == project_id, Model.deleted_at.is_(None))
+        )
+    else:
+        condition = entity.project_id == project_id
+    return and_(condition, entity.deleted_at.is_(None))
+
+
+def export_query(entity: Any, project_id: str) -> Any:
+    """Live rows of a project in one table."""
+    schema = arrow_schema(entity)
+    columns = [entity.__table__.c[name] for name in schema.names]
+    return select(*columns).where(project_rows(entity, project_id)).order_by(entity.id)
+
+
+class _Chunks:
+    """Write target of the Arrow stream writers, drained after every batch."""
+
+    closed = False
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+
+    def write(self, data: Any) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class CatalogExporter:
+    """Streams the live rows of a project, read through server side cursors."""
+
+    def __init__(self, batch_size: int = TRANSFER_BATCH_SIZE, connection_info: bool = False):
+        self.batch_size = batch_size
+        # Datasource credentials are left out unless asked for
+        self.connection_info = connection_info
+
+    async def stream(self, project_id: str) -> AsyncIterator[bytes]:
+        sink = _Chunks()
+        async with db.engine.connect() as conn:
+            if conn.dialect.name == "postgresql":
+                # One snapshot for all tables
+                await conn.execution_options(isolation_level="REPEATABLE READ")
+            for entity in TABLES:
+                schema = arrow_schema(entity)
+                json_columns = {
+                    c.name for c in entity.__table__.columns if isinstance(c.type, JSON)
+                }
+                writer = pa.ipc.new_stream(sink, schema)
+                result = await conn.stream(
+                    export_query(entity, project_id).execution_options(yield_per=self.batch_size)
+                )
+                async for rows in result.partitions(self.batch_size):
+                    columns = [
+                        [
+                            json.dumps(value) if name in json_columns and value is not None else value
+                            for value in values
+                        ]
+                        for name, values in zip(schema.names, zip(*rows))
+                    ]
+                    if entity is Project and not self.connection_info:
+                        columns[schema.names.index("connection_info")] = [None] * len(rows)
+                    writer.write_batch(pa.record_batch(columns, schema=schema))
+                    yield sink.drain()
+                writer.close()
+                yield sink.drain()
+
+    async def write(self, project_id: str, file: BinaryIO) -> None:
+        async for chunk in self.stream(project_id):
+            file.write(chunk)
+
+
+def remap_id(salt: bytes, id: str, timestamp_ms: int) -> str:
+    """New key of an imported row: the same for every occurrence of id in
+    one import, so references are rewritten without an id map in memory."""
+    digest = hashlib.sha256(salt + str(id).encode()).digest()
+    return uuid7(timestamp_ms, int.from_bytes(digest[:10], "big"))
+
+
+class CatalogImporter:
+    """Loads an export as a new project through the bulk insert path.
+
+    Every key (id, project_id, model_id, column ids, lineage ids) is
+    remapped to a new uuid derived from the old one, so an export can be
+    imported next to its source, or twice. A failed import soft deletes
+    every row imported so far, the tombstone purge then removes them.
+    """
+
+    def __init__(self, batch_size: int = TRANSFER_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.repositories: dict[str, BasicRepository] = {
+            "project": ProjectRepository(Project),
+            "model": ModelRepository(Model),
+            "model_column": ModelColumnRepository(ModelColumn),
+            "relation": ColumnRelationRepository(ColumnRelation),
+            "view": ViewRepository(View),
+        }
+
+    def readers(self, source: BinaryIO) -> Iterator[pa.RecordBatchStreamReader]:
+        for entity in TABLES:
+            reader = pa.ipc.open_stream(source)
+            metadata = reader.schema.metadata or {}
+            table = metadata.get(b"table", b"").decode()
+            if metadata.get(b"version", b"").decode() != FORMAT_VERSION:
+                raise ValueError(f"Unsupported export version {metadata.get(b'version')!r}")
+            if table != entity.__tablename__:
+                raise ValueError(f"Expected table {entity.__tablename__}, found {table!r}")
+            yield reader
+
+    async def run(self, source: BinaryIO, options: Optional[dict] = None) -> str:
+        """Import an export, the id of the new project.
+
+        options:
+            name: display name of the new project, default the exported one
+            connection_info: connection info of the new project
+        """
+        options = options or {}
+        salt = uuid7().encode()
+        timestamp_ms = time.time_ns() // 1_000_000
+        project_id: Optional[str] = None
+        try:
+            for entity, reader in zip(TABLES, self.readers(source)):
+                table = entity.__tablename__
+                keys = [c.name for c in entity.__table__.columns if isinstance(c.type, Uuid)]
+                json_columns = [c.name for c in entity.__table__.columns if isinstance(c.type, JSON)]
+                for batch in reader:
+                    rows = batch.to_pylist()
+                    for row in rows:
+                        for key in keys:
+                            if row[key] is not None:
+                                row[key] = remap_id(salt, row[key], timestamp_ms)
+                        for name in json_columns:
+                            if row[name] is not None:
+                                row[name] = json.loads(row[name])
+                        if table == "model_column" and row["lineage"]:
+                            row["lineage"] = json.dumps(
+                                [remap_id(salt, id, timestamp_ms) for id in lineage_ids(row["lineage"])]
+                            )
+                    if table == "project":
+                        if len(rows) != 1 or project_id is not None:
+                            raise ValueError("An export holds exactly one project")
+                        project_id = rows[0]["id"]
+                        if "name" in options:
+                            rows[0]["display_name"] = options["name"]
+                        if "connection_info" in options:
+                            rows[0]["connection_info"] = options["connection_info"]
+                    await self.repositories[table].create_many(
+                        rows,
+                        {"bulk": True, "copy": True, "batch_size": self.batch_size, "return_ids": False},
+                    )
+            if project_id is None:
+                raise ValueError("An export holds exactly one project")
+        except Exception:
+            if project_id is not None:
+                await self.discard(project_id)
+            raise
+        return project_id
+
+    async def discard(self, project_id: str) -> None:
+        """Soft delete the rows of a partial import."""
+        # Columns are found through their models, delete them first
+        for entity in reversed(TABLES):
+            async with db.session() as session:
+                result = await session.execute(
+                    select(entity.id).where(project_rows(entity, project_id))
+                )
+                ids = list(result.scalars().all())
+            repository = self.repositories[entity.__tablename__]
+            for start in range(0, len(ids), self.batch_size):
+                await repository.soft_delete_many(ids[start : start + self.batch_size])
+
+
+async def main(args: argparse.Namespace) -> None:
+    try:
+        if args.command == "export":
+            with open(args.file, "wb") as file:
+                await CatalogExporter(connection_info=args.connection_info).write(args.project_id, file)
+        else:
+            with open(args.file, "rb") as file:
+                options = {"name": args.name} if args.name else {}
+                print(await CatalogImporter().run(file, options))
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export")
+    export.add_argument("project_id")
+    export.add_argument("file")
+    export.add_argument("--connection-info", action="store_true", help="include the datasource credentials")
+    load = commands.add_parser("import")
+    load.add_argument("file")
+    load.add_argument("--name", help="display name of the new project")
+    asyncio.run(main(parser.parse_args()))
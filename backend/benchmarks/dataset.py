@@ -0,0 +1,112 @@
+"""Synthetic catalogs for the benchmarks, identical for the same seed and scale."""
+
+import random
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List
+
+from backend.repository.base_repository import uuid7
+
+COLUMN_TYPES = ("integer", "bigint", "varchar", "text", "boolean", "timestamp", "numeric")
+JOIN_TYPES = ("MANY_TO_ONE", "ONE_TO_MANY", "ONE_TO_ONE")
+
+# Fixed base time, created_at drives the keyset pagination order
+EPOCH = datetime(2024, 1, 1)
+
+
+@dataclass
+class Scale:
+    projects: int = 2
+    # Per project
+    models: int = 100
+    # Per model
+    columns: int = 20
+    # Per project
+    relations: int = 50
+
+    @property
+    def rows(self) -> int:
+        return self.projects * (
+            1 + self.models + self.models * self.columns + self.relations
+        )
+
+
+@dataclass
+class Catalog:
+    projects: List[dict] = field(default_factory=list)
+    models: List[dict] = field(default_factory=list)
+    columns: List[dict] = field(default_factory=list)
+    relations: List[dict] = field(default_factory=list)
+
+
+class CatalogGenerator:
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.ticks = 0
+
+    def audit(self) -> dict:
+        self.ticks += 1
+        at = EPOCH + timedelta(milliseconds=self.ticks)
+        return {
+            # Same layout as the generated keys, time ordered
+            "id": uuid7(int(at.timestamp() * 1000), self.rng.getrandbits(80)),
+            "created_at": at,
+            "updated_at": at,
+            "created_by": "benchmark",
+            "updated_by": "benchmark",
+        }
+
+    def generate(self, scale: Scale) -> Catalog:
+        catalog = Catalog()
+        for p in range(scale.projects):
+            project = {
+                **self.audit(),
+                "type": "postgres",
+                "display_name": f"project_{p}",
+                "catalog": f"catalog_{p}",
+                "schema": "public",
+                "connection_info": {"host": "localhost", "database": f"db_{p}"},
+            }
+            catalog.projects.append(project)
+
+            column_ids: List[str] = []
+            for m in range(scale.models):
+                model = {
+                    **self.audit(),
+                    "project_id": project["id"],
+                    "display_name": f"Model {m}",
+                    "source_table_name": f"table_{m}",
+                    "reference_name": f"model_{m}",
+                    "cached": self.rng.random() < 0.1,
+                    "properties": {"description": f"Synthetic table {m}"},
+                }
+                catalog.models.append(model)
+                for c in range(scale.columns):
+                    column = {
+                        **self.audit(),
+                        "model_id": model["id"],
+                        "is_calculated": False,
+                        "display_name": f"Column {c}",
+                        "reference_name": f"column_{c}",
+                        "source_column_name": f"column_{c}",
+                        "type": self.rng.choice(COLUMN_TYPES),
+                        "not_null": c == 0 or self.rng.random() < 0.3,
+                        "is_pk": c == 0,
+                    }
+                    catalog.columns.append(column)
+                    column_ids.append(column["id"])
+
+            for r in range(scale.relations if len(column_ids) > 1 else 0):
+                from_id, to_id = self.rng.sample(column_ids, 2)
+                catalog.relations.append(
+                    {
+                        **self.audit(),
+                        "project_id": project["id"],
+                        "name": f"relation_{r}",
+                        "join_type": self.rng.choice(JOIN_TYPES),
+                        "condition": f"{from_id} = {to_id}",
+                        "from_column_id": from_id,
+                        "to_column_id": to_id,
+                    }
+                )
+        return catalog
@@ -0,0 +1,49 @@
+import pytest
+
+from backend.config import DB_CONFIG, DatabaseSession
+from benchmarks import database
+from benchmarks.database import use_bench_database
+from benchmarks.dataset import CatalogGenerator, Scale
+
+
+class TestCatalogGenerator:
+
+    scale = Scale(projects=2, models=3, columns=4, relations=5)
+
+    def test_same_seed_same_catalog(self):
+        first = CatalogGenerator(7).generate(self.scale)
+        second = CatalogGenerator(7).generate(self.scale)
+        assert first == second
+        assert CatalogGenerator(8).generate(self.scale).columns != first.columns
+
+    def test_scale(self):
+        catalog = CatalogGenerator().generate(self.scale)
+        assert len(catalog.projects) == 2
+        assert len(catalog.models) == 6
+        assert len(catalog.columns) == 24
+        assert len(catalog.relations) == 10
+        assert self.scale.rows == 42
+
+    def test_relations_stay_in_their_project(self):
+        catalog = CatalogGenerator().generate(self.scale)
+        model_project = {model["id"]: model["project_id"] for model in catalog.models}
+        column_project = {c["id"]: model_project[c["model_id"]] for c in catalog.columns}
+        for relation in catalog.relations:
+            assert column_project[relation["from_column_id"]] == relation["project_id"]
+            assert column_project[relation["to_column_id"]] == relation["project_id"]
+
+
+class TestBenchDatabase:
+
+    def test_needs_a_database_of_its_own(self, monkeypatch):
+        session = DatabaseSession(DB_CONFIG, ["postgresql+asyncpg://replica/catalog"])
+        monkeypatch.setattr(database, "db", session)
+        with pytest.raises(SystemExit, match="BENCH_DB_URL"):
+            use_bench_database("")
+        with pytest.raises(SystemExit, match="drop the catalog"):
+            use_bench_database(DB_CONFIG)
+        assert session.db_url == DB_CONFIG
+
+        use_bench_database("sqlite+aiosqlite:///bench.db")
+        assert session.db_url == "sqlite+aiosqlite:///bench.db"
+        assert session.replica_urls == []
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+
+import pytest
+from sqlalchemy import text
+
+from backend.config import DatabaseSession
+from backend.repository.base_repository import WriteEvent, add_write_listener, remove_write_listener
+from backend.repository.cache import EntityCache
+from backend.repository.model import Model, ModelRepository
+from backend.service import changes
+from backend.service.changes import ChangeFeed
+
+# Optional postgres to LISTEN / NOTIFY on
+TEST_POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+
+
+class TestChangeFeed:
+
+    @pytest.fixture
+    def feeds(self):
+        received: list[WriteEvent] = []
+        sender, receiver = ChangeFeed(), ChangeFeed()
+        # Listening as started feeds do, without a postgres channel
+        add_write_listener(sender._on_write)
+        add_write_listener(receiver._on_write)
+        add_write_listener(received.append)
+        yield sender, receiver, received
+        for listener in (sender._on_write, receiver._on_write, received.append):
+            remove_write_listener(listener)
+
+    def test_writes_of_other_workers_are_dispatched(self, feeds):
+        sender, receiver, received = feeds
+        cache = EntityCache()
+        ModelRepository(Model, cache=cache)
+        cache.set("m1", {"id": "m1"})
+        cache.set("m2", {"id": "m2"})
+
+        for message in sender.encode(WriteEvent("model", "update", ("m1",))):
+            receiver.receive(message)
+            # Its own messages come back on the channel
+            sender.receive(message)
+        assert received == [WriteEvent("model", "update", ("m1",))]
+        assert cache.get("m1") is None and cache.get("m2") == {"id": "m2"}
+        # Received writes are not published again
+        assert receiver._outbox == []
+
+    def test_large_writes_are_split_or_sent_as_resync(self, feeds, monkeypatch):
+        sender, receiver, received = feeds
+        monkeypatch.setattr(changes, "MESSAGE_IDS", 2)
+        monkeypatch.setattr(changes, "MAX_MESSAGE_IDS", 4)
+
+        split = sender.encode(WriteEvent("model", "create", ("a", "b", "c")))
+        assert [json.loads(m)["i"] for m in split] == [["a", "b"], ["c"]]
+        assert [json.loads(m)["v"] for m in split] == [1, 2]
+        resync = sender.encode(WriteEvent("model", "create", tuple("abcde")))
+        for message in split + resync:
+            receiver.receive(message)
+        assert received == [
+            WriteEvent("model", "create", ("a", "b")),
+            WriteEvent("model", "create", ("c",)),
+            WriteEvent("model", "resync", ()),
+        ]
+        assert receiver.resyncs == 0
+
+    def test_missed_messages_resync(self, feeds):
+        sender, receiver, received = feeds
+        cache = EntityCache()
+        ModelRepository(Model, cache=cache)
+        cache.set("m1", {"id": "m1"})
+
+        first = sender.encode(WriteEvent("model", "update", ("m2",)))
+        sender.encode(WriteEvent("model", "update", ("m3",)))
+        third = sender.encode(WriteEvent("model", "update", ("m4",)))
+        receiver.receive(first[0])
+        assert receiver.resyncs == 0 and len(cache) == 1
+        receiver.receive(third[0])
+        assert receiver.resyncs == 1 and len(cache) == 0
+        assert {e.table for e in received if e.action == "resync"} >= {"model", "model_column", "project"}
+        receiver.receive("not json")
+        assert receiver.resyncs == 1
+
+    def test_reconnect_delay_resets_once_listening(self, monkeypatch):
+        feed = ChangeFeed()
+        # Per attempt: whether the listener attaches before the connection is lost
+        attempts = iter([False, False, False, True, False, True, True])
+        delays = []
+
+        async def listen_once(attached):
+            if next(attempts):
+                attached.set()
+            raise OSError("connection lost")
+
+        async def sleep(delay):
+            delays.append(delay)
+            if len(delays) == 7:
+                raise asyncio.CancelledError
+
+        monkeypatch.setattr(feed, "listen_once", listen_once)
+        monkeypatch.setattr(changes.asyncio, "sleep", sleep)
+        with pytest.raises(asyncio.CancelledError):
+            asyncio.run(feed.listen())
+        assert delays == [1.0, 2.0, 4.0, 1.0, 2.0, 1.0, 1.0]
+
+
+@pytest.mark.skipif(TEST_POSTGRES_URL is None, reason="TEST_POSTGRES_URL is not set")
+class TestChangeFeedListener:
+
+    def test_notifications_arrive_after_a_health_check(self, monkeypatch):
+        database = DatabaseSession(TEST_POSTGRES_URL)
+        monkeypatch.setattr(changes, "db", database)
+        monkeypatch.setattr(changes, "CHECK_INTERVAL", 0.05)
+        feed, other = ChangeFeed(), ChangeFeed()
+        received = []
+        monkeypatch.setattr(feed, "dispatch", received.append)
+
+        async def main():
+            attached = asyncio.Event()
+            listener = asyncio.create_task(feed.listen_once(attached))
+            try:
+                await asyncio.wait_for(attached.wait(), 5)
+                received.clear()
+                # A few health checks run meanwhile
+                await asyncio.sleep(0.3)
+                (message,) = other.encode(WriteEvent("model", "update", ("m1",)))
+                async with database.engine.begin() as conn:
+                    await conn.execute(
+                        text("SELECT pg_notify(:channel, :message)"),
+                        {"channel": feed.channel, "message": message},
+                    )
+                for _ in range(50):
+                    if received:
+                        break
+                    await asyncio.sleep(0.05)
+                return list(received)
+            finally:
+                listener.cancel()
+                await asyncio.gather(listener, return_exceptions=True)
+                await database.close()
+
+        assert asyncio.run(main()) == [WriteEvent("model", "update", ("m1",))]
@@ -0,0 +1,71 @@
+from backend.repository.cache import MISSING, EntityCache
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestEntityCache:
+
+    def test_hit_and_miss(self):
+        cache = EntityCache(maxsize=2)
+        assert cache.get("a") is None
+        cache.set("a", {"id": "a"})
+        assert cache.get("a") == {"id": "a"}
+        assert cache.stats()["hits"] == 1
+        assert cache.stats()["misses"] == 1
+
+    def test_lru_eviction(self):
+        cache = EntityCache(maxsize=2)
+        cache.set("a", {"id": "a"})
+        cache.set("b", {"id": "b"})
+        cache.get("a")
+        cache.set("c", {"id": "c"})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.evictions == 1
+
+    def test_ttl_and_negative_ttl(self):
+        clock = FakeClock()
+        cache = EntityCache(ttl=10, negative_ttl=1, clock=clock)
+        cache.set("a", {"id": "a"})
+        cache.set("missing", MISSING)
+        assert cache.get("missing") is MISSING
+        clock.now = 2
+        assert cache.get("missing") is None
+        assert cache.get("a") is not None
+        clock.now = 11
+        assert cache.get("a") is None
+
+    def test_invalidate(self):
+        cache = EntityCache()
+        cache.set("a", {"id": "a"})
+        cache.set("b", MISSING)
+        cache.invalidate("a", "b", "c")
+        assert len(cache) == 0
+
+    def test_set_skips_keys_invalidated_since_the_version(self):
+        cache = EntityCache(maxsize=2)
+        version = cache.version()
+        cache.invalidate("a")
+        cache.set("a", {"id": "a"}, version)
+        cache.set("b", {"id": "b"}, version)
+        assert cache.get("a") is None and cache.get("b") is not None
+        cache.set("a", {"id": "a"}, cache.version())
+        assert cache.get("a") is not None
+
+        # Forgotten invalidations and a clear skip every older version
+        version = cache.version()
+        cache.invalidate("c", "d", "e")
+        cache.set("x", {"id": "x"}, version)
+        assert cache.get("x") is None
+        version = cache.version()
+        cache.clear()
+        cache.set("b", {"id": "b"}, version)
+        assert len(cache) == 0
+
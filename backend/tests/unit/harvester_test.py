@@ -0,0 +1,173 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert, select
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository, model, model_column
+from backend.repository.base_repository import (
+    WriteEvent,
+    add_write_listener,
+    remove_write_listener,
+    uuid7,
+)
+from backend.repository.model import Model
+from backend.repository.model_column import ModelColumn
+from backend.repository.project import Project
+from backend.service import harvester
+from backend.service.datasource import SourcePools
+from backend.service.harvester import (
+    SchemaHarvester,
+    SourceColumn,
+    SourceTable,
+    schema_fingerprint,
+)
+
+
+def make_table(*columns: SourceColumn) -> SourceTable:
+    return SourceTable(name="orders", columns=list(columns))
+
+
+class TestSchemaFingerprint:
+
+    def test_column_order_does_not_matter(self):
+        id_column = SourceColumn(name="id", type="INTEGER", not_null=True, is_pk=True)
+        name_column = SourceColumn(name="name", type="TEXT", not_null=False, is_pk=False)
+        assert schema_fingerprint(make_table(id_column, name_column)) == schema_fingerprint(
+            make_table(name_column, id_column)
+        )
+
+    def test_column_definition_changes_fingerprint(self):
+        before = make_table(SourceColumn(name="id", type="INTEGER", not_null=True, is_pk=True))
+        after = make_table(SourceColumn(name="id", type="BIGINT", not_null=True, is_pk=True))
+        assert schema_fingerprint(before) != schema_fingerprint(after)
+
+
+def audit() -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+class TestSchemaHarvester:
+
+    @pytest.fixture
+    def source(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        for module in (base_repository, model, model_column):
+            monkeypatch.setattr(module, "db", database)
+        pools = SourcePools()
+        monkeypatch.setattr(harvester, "source_pools", pools)
+
+        path = tmp_path / "source.db"
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, status TEXT)")
+            conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT)")
+        project = audit() | {
+            "type": "sqlite",
+            "display_name": "shop",
+            "catalog": "main",
+            "schema": "main",
+            "connection_info": {"database": str(path)},
+        }
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), [project])
+
+        asyncio.run(seed())
+        yield database, SimpleNamespace(**project), path
+        remove_write_listener(pools._on_write)
+        asyncio.run(database.close())
+
+    def harvest(self, database, project, tables=None):
+        async def run():
+            progress = await SchemaHarvester(project, concurrency=2, chunk_size=1).run(tables)
+            await harvester.source_pools.stop()
+            async with database.session() as session:
+                result = await session.execute(
+                    select(Model.reference_name, ModelColumn.reference_name, ModelColumn.type)
+                    .join(ModelColumn, ModelColumn.model_id == Model.id)
+                    .where(Model.deleted_at.is_(None), ModelColumn.deleted_at.is_(None))
+                )
+                catalog: dict = {}
+                for table, column, type in result:
+                    catalog.setdefault(table, {})[column] = type
+            return progress, catalog
+
+        return asyncio.run(run())
+
+    def test_tables_added_changed_and_dropped(self, source):
+        database, project, path = source
+        progress, catalog = self.harvest(database, project)
+        assert (progress.models_created, progress.columns_created) == (2, 4)
+        assert catalog == {
+            "orders": {"id": "INTEGER", "status": "TEXT"},
+            "customers": {"id": "INTEGER", "name": "TEXT"},
+        }
+
+        with sqlite3.connect(path) as conn:
+            conn.execute("DROP TABLE customers")
+            conn.execute("DROP TABLE orders")
+            conn.execute(
+                "CREATE TABLE orders (id INTEGER PRIMARY KEY, status VARCHAR(10), amount REAL)"
+            )
+            conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY)")
+        progress, catalog = self.harvest(database, project)
+        assert (progress.models_created, progress.models_updated, progress.models_deleted) == (
+            1,
+            1,
+            1,
+        )
+        assert (progress.columns_created, progress.columns_updated, progress.columns_deleted) == (
+            2,
+            1,
+            2,
+        )
+        assert catalog == {
+            "orders": {"id": "INTEGER", "status": "VARCHAR(10)", "amount": "REAL"},
+            "items": {"id": "INTEGER"},
+        }
+
+
+    def test_resync_only_writes_changed_tables(self, source):
+        database, project, path = source
+        self.harvest(database, project)
+        events: list[WriteEvent] = []
+        add_write_listener(events.append)
+        try:
+            progress, catalog = self.harvest(database, project)
+            unchanged = (progress.tables_unchanged, list(events))
+
+            with sqlite3.connect(path) as conn:
+                conn.execute("ALTER TABLE orders ADD COLUMN amount REAL")
+            events.clear()
+            progress, catalog = self.harvest(database, project)
+            changed = (progress.tables_unchanged, progress.models_updated, list(events))
+
+            # A run over some tables leaves the others alone
+            with sqlite3.connect(path) as conn:
+                conn.execute("DROP TABLE customers")
+            progress, partial = self.harvest(database, project, ["orders"])
+        finally:
+            remove_write_listener(events.append)
+
+        assert unchanged == (2, [])
+        tables_unchanged, models_updated, written = changed
+        assert (tables_unchanged, models_updated) == (1, 1)
+        assert [(e.table, e.action, len(e.ids)) for e in written] == [
+            ("model_column", "create", 1),
+            ("model", "update", 1),
+        ]
+        assert catalog["orders"] == {"id": "INTEGER", "status": "TEXT", "amount": "REAL"}
+        assert progress.tables_total == 1 and progress.models_deleted == 0
+        assert set(partial) == {"orders", "customers"}
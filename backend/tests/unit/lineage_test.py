@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import WriteEvent, remove_write_listener, uuid7
+from backend.repository.column_relation import ColumnRelation, ColumnRelationRepository
+from backend.repository.model import Model
+from backend.repository.model_column import ModelColumn
+from backend.repository.project import Project
+from backend.service import lineage
+from backend.service.lineage import LineageGraph, LineageService, lineage_ids
+
+
+def names(nodes):
+    return {(node.kind, node.id): node.depth for node in nodes}
+
+
+class TestLineageGraph:
+
+    def graph(self):
+        # orders.custkey -> customer.custkey, customer.label selects customer.custkey
+        graph = LineageGraph()
+        graph.set_column("o.custkey", "orders")
+        graph.set_column("c.custkey", "customer")
+        graph.set_column("c.label", "customer", ["c.custkey"])
+        graph.set_relation("r1", "o.custkey", "c.custkey")
+        return graph
+
+    def test_impact(self):
+        assert names(self.graph().impact("column", "o.custkey")) == {
+            ("model", "orders"): 1,
+            ("column", "c.custkey"): 1,
+            ("model", "customer"): 2,
+            ("column", "c.label"): 2,
+        }
+
+    def test_depth_limit(self):
+        graph = self.graph()
+        expected = {("model", "orders"): 1, ("column", "c.custkey"): 1}
+        assert names(graph.impact("column", "o.custkey", 1)) == expected
+        assert names(graph.impact("column", "o.custkey", 1, "dfs")) == expected
+
+    def test_upstream(self):
+        assert names(self.graph().upstream("column", "c.label")) == {
+            ("column", "c.custkey"): 1,
+            ("column", "o.custkey"): 2,
+        }
+
+    def test_incremental_updates(self):
+        graph = self.graph()
+        graph.set_relation("r1", "c.label", "o.custkey")
+        assert ("column", "c.custkey") not in names(graph.impact("column", "o.custkey"))
+
+        graph.remove_node("column", "c.custkey")
+        assert names(graph.upstream("column", "c.label")) == {}
+        # Freed edge numbers are reused by later edges
+        edges = graph.edge_count
+        graph.set_column("c.custkey", "customer")
+        assert graph.edge_count == edges + 1
+        assert len(graph.sources) == 5
+
+    def test_lineage_ids(self):
+        assert lineage_ids('["a", 1]') == ["a", "1"]
+        assert lineage_ids("not json") == []
+        assert lineage_ids(None) == []
+
+
+def audit() -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+class FailingSession:
+
+    async def execute(self, stmt):
+        raise OSError("connection lost")
+
+
+class TestLineageService:
+
+    def test_failed_apply_keeps_the_pending_ids(self):
+        service = LineageService()
+        try:
+            service._graphs["p1"] = LineageGraph()
+            service._on_write(WriteEvent("model_column", "update", ("c1",)))
+            with pytest.raises(OSError):
+                asyncio.run(service.apply_pending(FailingSession()))
+            service._on_write(WriteEvent("relation", "create", ("r1",)))
+        finally:
+            remove_write_listener(service._on_write)
+        assert service._pending == {"model": set(), "model_column": {"c1"}, "relation": {"r1"}}
+
+    def test_write_during_a_load_is_not_lost(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(lineage, "db", database)
+        project = audit() | {
+            "type": "postgres",
+            "display_name": "p",
+            "catalog": "db",
+            "schema": "public",
+        }
+        model = audit() | {
+            "project_id": project["id"],
+            "display_name": "orders",
+            "source_table_name": "orders",
+            "reference_name": "orders",
+        }
+        columns = [
+            audit()
+            | {
+                "model_id": model["id"],
+                "is_calculated": False,
+                "display_name": name,
+                "reference_name": name,
+                "source_column_name": name,
+                "type": "integer",
+                "not_null": False,
+                "is_pk": False,
+            }
+            for name in ("id", "parent_id")
+        ]
+        from_id, to_id = (column["id"] for column in columns)
+
+        service = LineageService()
+        load = service.load
+
+        async def racing_load(session, project_id):
+            graph = await load(session, project_id)
+            # Committed after the load read the rows
+            await ColumnRelationRepository(ColumnRelation).create_one(
+                ColumnRelation(
+                    project_id=project_id,
+                    name="parent",
+                    join_type="MANY_TO_ONE",
+                    condition="parent_id = id",
+                    from_column_id=from_id,
+                    to_column_id=to_id,
+                )
+            )
+            return graph
+
+        async def run():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), [project])
+                await conn.execute(insert(Model), [model])
+                await conn.execute(insert(ModelColumn), columns)
+            monkeypatch.setattr(service, "load", racing_load)
+            first = await service.traverse(project["id"], "column", from_id)
+            monkeypatch.setattr(service, "load", load)
+            second = await service.traverse(project["id"], "column", from_id)
+            await database.close()
+            return first, second
+
+        try:
+            first, second = asyncio.run(run())
+        finally:
+            remove_write_listener(service._on_write)
+        assert ("column", to_id) not in names(first)
+        assert names(second)[("column", to_id)] == 1
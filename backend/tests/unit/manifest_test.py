@@ -0,0 +1,154 @@
+import asyncio
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import WriteEvent, remove_write_listener, uuid7
+from backend.repository.model import Model, ModelRepository
+from backend.repository.project import Project
+from backend.service import manifest
+from backend.service.manifest import Manifest, ManifestCompiler, dump, model_section
+
+
+def column(name, is_pk=False, properties=None):
+    return SimpleNamespace(
+        reference_name=name,
+        type="integer",
+        not_null=is_pk,
+        is_calculated=False,
+        custom_expression=None,
+        properties=properties,
+        is_pk=is_pk,
+    )
+
+
+def model(name, ref_sql=None):
+    return SimpleNamespace(
+        reference_name=name,
+        ref_sql=ref_sql,
+        source_table_name=name.lower(),
+        cached=None,
+        refresh_time=None,
+        properties=None,
+    )
+
+
+class TestManifest:
+
+    project = SimpleNamespace(catalog="db", schema="public")
+
+    def test_model_section(self):
+        section = json.loads(
+            model_section(
+                self.project,
+                model("Orders"),
+                [column("id", True), column("amount", properties='{"description": "x"}')],
+            )
+        )
+        assert section["tableReference"] == {"catalog": "db", "schema": "public", "table": "orders"}
+        assert section["primaryKey"] == "id"
+        assert section["columns"][1]["properties"] == {"description": "x"}
+        assert json.loads(model_section(self.project, model("V", "select 1"), []))["tableReference"] is None
+
+    def test_assemble_orders_models_and_versions(self):
+        manifest = Manifest("p1", header=dump({"catalog": "db", "schema": "public"}))
+        manifest.models = {
+            "2": ("Orders", model_section(self.project, model("Orders"), [])),
+            "1": ("Customer", model_section(self.project, model("Customer"), [])),
+        }
+        manifest.assemble()
+        content = json.loads(manifest.content)
+        assert [m["name"] for m in content["models"]] == ["Customer", "Orders"]
+        assert content["relationships"] == [] and content["views"] == []
+        assert manifest.version == 1
+
+        etag = manifest.etag
+        manifest.assemble()
+        assert (manifest.version, manifest.etag) == (1, etag)
+
+        del manifest.models["2"]
+        manifest.assemble()
+        assert manifest.version == 2 and manifest.etag != etag
+
+
+class FailingSession:
+
+    async def execute(self, stmt):
+        raise OSError("connection lost")
+
+
+class TestManifestCompiler:
+
+    def test_failed_apply_keeps_the_pending_ids(self):
+        compiler = ManifestCompiler()
+        try:
+            compiler._manifests["p1"] = Manifest("p1")
+            compiler._on_write(WriteEvent("model", "update", ("m1",)))
+            with pytest.raises(OSError):
+                asyncio.run(compiler.apply_pending(FailingSession()))
+            compiler._on_write(WriteEvent("view", "create", ("v1",)))
+        finally:
+            remove_write_listener(compiler._on_write)
+        assert compiler._pending["model"] == {"m1"}
+        assert compiler._pending["view"] == {"v1"}
+
+    def test_write_during_a_compile_is_not_lost(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(manifest, "db", database)
+        at = datetime(2024, 1, 1)
+        audit = {"created_at": at, "updated_at": at, "created_by": "t", "updated_by": "t"}
+        project_id, model_id = uuid7(), uuid7()
+        project = audit | {
+            "id": project_id,
+            "type": "postgres",
+            "display_name": "p",
+            "catalog": "db",
+            "schema": "public",
+        }
+        model = audit | {
+            "id": model_id,
+            "project_id": project_id,
+            "display_name": "orders",
+            "source_table_name": "orders",
+            "reference_name": "orders",
+        }
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), [project])
+                await conn.execute(insert(Model), [model])
+
+        compiler = ManifestCompiler()
+        compile = compiler.compile
+
+        async def racing_compile(session, project_id):
+            compiled = await compile(session, project_id)
+            # Committed after the compile read the rows
+            await ModelRepository(Model).update_one(model_id, {"reference_name": "purchases"})
+            return compiled
+
+        async def run():
+            await seed()
+            monkeypatch.setattr(compiler, "compile", racing_compile)
+            first = await compiler.get(project_id)
+            monkeypatch.setattr(compiler, "compile", compile)
+            second = await compiler.get(project_id)
+            await database.close()
+            return first, second
+
+        try:
+            first, second = asyncio.run(run())
+        finally:
+            remove_write_listener(compiler._on_write)
+        names = [
+            [model["name"] for model in json.loads(compiled.content)["models"]]
+            for compiled in (first, second)
+        ]
+        assert names == [["orders"], ["purchases"]]
@@ -0,0 +1,132 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend import main
+from backend import metrics as metrics_module
+from backend.metrics import Histogram, Metrics, TimedQueuePool, instrument, statement_label, timed
+
+
+class TestMetrics:
+
+    def test_statement_label(self):
+        assert statement_label("SELECT model.id FROM model WHERE model.id = $1") == "select model"
+        assert statement_label('INSERT INTO "model_column" (id) VALUES (?)') == "insert model_column"
+        assert statement_label("UPDATE model SET x=1 FROM (VALUES (1)) AS v") == "update model"
+        assert statement_label("DELETE FROM view WHERE id = 1") == "delete view"
+        assert statement_label("SELECT pg_try_advisory_lock(1)") == "select"
+
+    def test_histogram_render(self):
+        histogram = Histogram("latency", "Latency", "statement", (0.1, 1))
+        histogram.observe("select model", 0.05)
+        histogram.observe("select model", 0.1)
+        histogram.observe("select model", 5)
+        assert histogram.count("select model") == 3
+        assert histogram.render()[2:] == [
+            'latency_bucket{statement="select model",le="0.1"} 2',
+            'latency_bucket{statement="select model",le="1.0"} 2',
+            'latency_bucket{statement="select model",le="+Inf"} 3',
+            'latency_sum{statement="select model"} 5.15',
+            'latency_count{statement="select model"} 3',
+        ]
+
+
+class Repository:
+
+    @timed
+    async def find_all(self, rows: int):
+        return [{}] * rows
+
+
+class TestInstrumentation:
+
+    @pytest.fixture
+    def metrics(self, monkeypatch):
+        metrics = Metrics()
+        monkeypatch.setattr(metrics_module, "metrics", metrics)
+        monkeypatch.setattr(main, "metrics", metrics)
+        return metrics
+
+    def run_on_engine(self, tmp_path, coro_fn, **options):
+        async def run():
+            engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/metrics.db", **options)
+            instrument(engine.sync_engine)
+            try:
+                return await coro_fn(engine)
+            finally:
+                await engine.dispose()
+
+        return asyncio.run(run())
+
+    def test_statements_are_timed(self, metrics, tmp_path):
+        metrics.slow_query_seconds = 0
+
+        async def statements(engine):
+            async with engine.begin() as conn:
+                await conn.execute(text("CREATE TABLE model (id INTEGER)"))
+                await conn.execute(text("INSERT INTO model (id) VALUES (1), (2)"))
+                await conn.execute(text("SELECT id FROM model"))
+
+        self.run_on_engine(tmp_path, statements)
+        assert metrics.enabled
+        assert metrics.statement_seconds.count("select model") == 1
+        assert metrics.statement_seconds.count("insert model") == 1
+        assert metrics.statement_rows.series["insert model"][1] == [2.0]
+        # Only DML rows are recorded, and a 0 threshold disables the slow log
+        assert "select model" not in metrics.statement_rows.series
+        assert metrics.slow_queries == 0
+
+    def test_slow_queries_are_counted(self, metrics, tmp_path):
+        metrics.slow_query_seconds = 1e-9
+
+        async def statements(engine):
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+                await conn.execute(text("SELECT 2"))
+
+        self.run_on_engine(tmp_path, statements)
+        assert metrics.slow_queries == 2
+
+    def test_repository_methods_are_timed(self, metrics):
+        repository = Repository()
+        asyncio.run(repository.find_all(3))
+        assert metrics.repository_seconds.count("Repository.find_all") == 0
+
+        metrics.enabled = True
+        asyncio.run(repository.find_all(3))
+        asyncio.run(repository.find_all(0))
+        assert metrics.repository_seconds.count("Repository.find_all") == 2
+        assert metrics.repository_rows.series["Repository.find_all"][1] == [3.0]
+
+    def test_pool_checkout_wait_is_timed(self, metrics, tmp_path):
+        async def checkouts(engine):
+            async def hold():
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+                    await asyncio.sleep(0.05)
+
+            async def wait():
+                await asyncio.sleep(0.01)
+                async with engine.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+
+            await asyncio.gather(hold(), wait())
+
+        self.run_on_engine(
+            tmp_path, checkouts, poolclass=TimedQueuePool, pool_size=1, max_overflow=0
+        )
+        assert metrics.pool_wait_seconds.count("default") == 2
+        # The second checkout waited for the first connection
+        assert metrics.pool_wait_seconds.series["default"][1][0] >= 0.03
+
+    def test_metrics_endpoint(self, metrics):
+        metrics.slow_queries = 4
+        metrics.statement_seconds.observe("select model", 0.01)
+        response = TestClient(main.init_app()).get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert 'db_statement_seconds_count{statement="select model"} 1' in response.text
+        assert "db_slow_queries_total 4" in response.text
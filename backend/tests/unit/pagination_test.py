@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import decode_cursor, encode_cursor, uuid7
+from backend.repository.model import Model, ModelRepository
+from backend.repository.project import Project
+
+
+class TestPaginationCursor:
+
+    def test_round_trip(self):
+        created_at = datetime(2024, 7, 1, 12, 30, 15, 123456)
+        cursor = encode_cursor(created_at, "c6a4b1c2-0000-4000-8000-000000000001")
+        assert decode_cursor(cursor) == (
+            created_at,
+            "c6a4b1c2-0000-4000-8000-000000000001",
+        )
+
+    def test_invalid_cursor(self):
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+
+def row(n: int, **values) -> dict:
+    at = datetime(2024, 1, 1, 0, n)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    } | values
+
+
+class TestFindPageBy:
+
+    @pytest.fixture
+    def models(self, tmp_path, monkeypatch):
+        """Live models of a project, two pairs created at the same time."""
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        projects = [
+            row(0, type="postgres", display_name=name, catalog="db", schema="public")
+            for name in ("p", "other")
+        ]
+
+        def model(n: int, project: dict, **values) -> dict:
+            name = f"m{uuid7()}"
+            return row(
+                n,
+                project_id=project["id"],
+                display_name=name,
+                source_table_name=name,
+                reference_name=name,
+                deleted_at=None,
+            ) | values
+
+        live = [model(n, projects[0]) for n in (3, 1, 2, 1, 3)]
+        others = [
+            model(2, projects[0], deleted_at=datetime(2024, 2, 1)),
+            model(2, projects[1]),
+        ]
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), projects)
+                await conn.execute(insert(Model), live + others)
+
+        asyncio.run(seed())
+        expected = [m["id"] for m in sorted(live, key=lambda m: (m["created_at"], m["id"]))]
+        yield database, projects[0]["id"], expected
+        asyncio.run(database.close())
+
+    def pages(self, database, project_id: str, limit: int) -> list:
+        repository = ModelRepository(Model)
+
+        async def main():
+            pages, cursor = [], None
+            while True:
+                page = await repository.find_page_by(
+                    {"project_id": project_id}, {"limit": limit, "cursor": cursor}
+                )
+                pages.append([model.id for model in page.items])
+                if page.next_cursor is None:
+                    return pages
+                cursor = page.next_cursor
+
+        return asyncio.run(main())
+
+    def test_pages_follow_created_at_then_id(self, models):
+        database, project_id, expected = models
+        pages = self.pages(database, project_id, 2)
+        # Ties on created_at are split between pages without skipping a row
+        assert pages == [expected[0:2], expected[2:4], expected[4:]]
+
+    def test_last_page_has_no_cursor(self, models):
+        database, project_id, expected = models
+        # A full last page does not lead to an empty one
+        assert self.pages(database, project_id, 5) == [expected]
+        assert self.pages(database, project_id, 10) == [expected]
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import random
+import sqlite3
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import insert, select, update
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository, column_profile, model, model_column
+from backend.repository.base_repository import remove_write_listener, uuid7
+from backend.repository.column_profile import ColumnProfile
+from backend.repository.model import Model
+from backend.repository.model_column import ModelColumn
+from backend.repository.project import Project
+from backend.service import profiler
+from backend.service.datasource import SourcePools
+from backend.service.profiler import ColumnProfiler
+from backend.service.sketches import CountMinSketch, HyperLogLog, value_hash
+
+
+def audit() -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+class TestSketches:
+
+    def test_hyperloglog_estimate_and_merge(self):
+        left, right = HyperLogLog(), HyperLogLog()
+        left.add(value_hash(i) for i in range(20000))
+        right.add(value_hash(i) for i in range(10000, 30000))
+        assert abs(left.count() - 20000) < 20000 * 0.05
+        left.merge(right)
+        assert abs(left.count() - 30000) < 30000 * 0.05
+        assert HyperLogLog.from_bytes(left.to_bytes()).count() == left.count()
+
+    def test_count_min_never_underestimates(self):
+        rng = random.Random(1)
+        sketch = CountMinSketch(width=64, depth=4)
+        counts: dict = {}
+        for _ in range(5000):
+            value = int(rng.paretovariate(1.2))
+            counts[value] = counts.get(value, 0) + 1
+            sketch.add(value_hash(value))
+        assert all(sketch.estimate(value_hash(v)) >= c for v, c in counts.items())
+        assert sketch.estimate(value_hash(1)) <= counts[1] + 5000 * 2.72 / 64
+        copy = CountMinSketch.from_bytes(sketch.to_bytes())
+        copy.merge(sketch)
+        assert copy.estimate(value_hash(1)) == 2 * sketch.estimate(value_hash(1))
+
+
+class TestColumnProfiler:
+
+    @pytest.fixture
+    def catalog(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        for module in (base_repository, model, model_column, column_profile):
+            monkeypatch.setattr(module, "db", database)
+        pools = SourcePools()
+        monkeypatch.setattr(profiler, "source_pools", pools)
+
+        source = sqlite3.connect(tmp_path / "source.db")
+        source.execute("CREATE TABLE orders (id INTEGER, status TEXT, amount REAL)")
+        source.executemany(
+            "INSERT INTO orders VALUES (?, ?, ?)",
+            [
+                (i, "paid" if i % 4 else "open", None if i % 10 == 0 else i / 2)
+                for i in range(2000)
+            ],
+        )
+        source.commit()
+        source.close()
+
+        project = audit() | {
+            "type": "sqlite",
+            "display_name": "shop",
+            "catalog": "main",
+            "schema": "main",
+            "connection_info": {"database": f"{tmp_path}/source.db"},
+        }
+        orders = audit() | {
+            "project_id": project["id"],
+            "display_name": "orders",
+            "source_table_name": "orders",
+            "reference_name": "orders",
+        }
+        columns = [
+            audit()
+            | {
+                "model_id": orders["id"],
+                "is_calculated": False,
+                "display_name": name,
+                "reference_name": name,
+                "source_column_name": name,
+                "type": type,
+                "not_null": False,
+                "is_pk": name == "id",
+                "properties": json.dumps({"description": name}),
+            }
+            for name, type in (("id", "INTEGER"), ("status", "TEXT"), ("amount", "REAL"))
+        ]
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), [project])
+                await conn.execute(insert(Model), [orders])
+                await conn.execute(insert(ModelColumn), columns)
+
+        asyncio.run(seed())
+        yield database, SimpleNamespace(**project)
+        remove_write_listener(pools._on_write)
+        asyncio.run(database.close())
+
+    def profile(self, database, project, seed=1, **options):
+        async def run():
+            progress = await ColumnProfiler(project, rng=random.Random(seed), **options).run()
+            await profiler.source_pools.stop()
+            async with database.session() as session:
+                columns = (await session.execute(select(ModelColumn))).scalars().all()
+                profiles = (await session.execute(select(ColumnProfile))).scalars().all()
+            return progress, {c.reference_name: json.loads(c.properties) for c in columns}, profiles
+
+        return asyncio.run(run())
+
+    def test_profile_summary_is_stored_in_the_properties(self, catalog):
+        progress, properties, profiles = self.profile(*catalog)
+        assert (progress.tables, progress.columns, progress.failed) == (1, 3, [])
+        assert len(profiles) == 3
+
+        status = properties["status"]
+        assert status["description"] == "status"
+        profile = status["profile"]
+        assert profile["rows"] == 2000
+        assert profile["distinct_in_sample"] == 2
+        assert "distinct" not in profile
+        assert (profile["min"], profile["max"]) == ("open", "paid")
+        assert profile["top_k"][0]["value"] == "paid"
+        assert profile["top_k"][0]["count"] >= 1500
+        assert profile["table_rows"] == 2000
+
+        amount = properties["amount"]["profile"]
+        assert amount["null_fraction"] == 0.1
+        assert (amount["min"], amount["max"]) == (0.5, 999.5)
+        assert abs(properties["id"]["profile"]["distinct_in_sample"] - 2000) < 100
+
+    def test_sampled_reprofile_merges_into_the_stored_sketches(self, catalog):
+        self.profile(*catalog, seed=1, sample_rows=500)
+        _, properties, profiles = self.profile(*catalog, seed=2, sample_rows=500)
+        assert len(profiles) == 3
+        profile = properties["id"]["profile"]
+        # Both samples are counted, their union has more distinct ids than one
+        assert profile["rows"] == 1000
+        assert 600 < profile["distinct_in_sample"] <= 1000
+
+    def test_invalid_properties_are_replaced(self, catalog):
+        database, project = catalog
+
+        async def corrupt():
+            async with database.engine.begin() as conn:
+                for name, properties in (("id", "{not json"), ("status", "[1, 2]")):
+                    await conn.execute(
+                        update(ModelColumn)
+                        .where(ModelColumn.reference_name == name)
+                        .values(properties=properties)
+                    )
+
+        asyncio.run(corrupt())
+        progress, properties, _ = self.profile(database, project)
+        assert progress.failed == []
+        assert set(properties["id"]) == set(properties["status"]) == {"profile"}
+        assert properties["amount"]["description"] == "amount"
+
+    def test_profiles_are_written_one_table_at_a_time(self, catalog, tmp_path, monkeypatch):
+        database, project = catalog
+        with sqlite3.connect(tmp_path / "source.db") as source:
+            for name in ("items", "refunds"):
+                source.execute(f"CREATE TABLE {name} (id INTEGER)")
+                source.executemany(
+                    f"INSERT INTO {name} VALUES (?)", [(i,) for i in range(50)]
+                )
+        # One model of a table dropped since the last harvest
+        models = {
+            name: audit()
+            | {
+                "project_id": project.id,
+                "display_name": name,
+                "source_table_name": name,
+                "reference_name": name,
+            }
+            for name in ("items", "refunds", "gone")
+        }
+        columns = [
+            audit()
+            | {
+                "model_id": model["id"],
+                "is_calculated": False,
+                "display_name": "id",
+                "reference_name": f"{name}_id",
+                "source_column_name": "id",
+                "type": "INTEGER",
+                "not_null": False,
+                "is_pk": True,
+                "properties": "{}",
+            }
+            for name, model in models.items()
+        ]
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.execute(insert(Model), list(models.values()))
+                await conn.execute(insert(ModelColumn), columns)
+
+        asyncio.run(seed())
+
+        # Saves running at the start of every save
+        saving, overlaps = [], []
+        save = ColumnProfiler.save
+
+        async def tracked_save(self, *args):
+            overlaps.append(len(saving))
+            saving.append(args)
+            try:
+                await asyncio.sleep(0.01)
+                return await save(self, *args)
+            finally:
+                saving.remove(args)
+
+        monkeypatch.setattr(ColumnProfiler, "save", tracked_save)
+        progress, properties, profiles = self.profile(database, project, concurrency=4)
+        assert (progress.tables, progress.columns) == (3, 5)
+        assert progress.failed == [models["gone"]["id"]]
+        assert len(profiles) == 5
+        # Every save started after the previous one ended
+        assert overlaps == [0, 0, 0]
@@ -0,0 +1,197 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, insert, select, update
+
+from backend.config import Base, DatabaseSession
+from backend.repository.base_repository import uuid7
+from backend.repository.column_profile import ColumnProfile
+from backend.repository.column_relation import ColumnRelation
+from backend.repository.model import Model
+from backend.repository.model_column import ModelColumn
+from backend.repository.project import Project
+from backend.repository.view import View
+from backend.service import locks, purge
+from backend.service.purge import ARCHIVES, PURGE_ORDER, TombstonePurger
+
+NOW = datetime(2024, 6, 1)
+OLD = NOW - timedelta(days=60)
+RECENT = NOW - timedelta(days=1)
+
+
+def audit(deleted_at=None) -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+        "deleted_at": deleted_at,
+    }
+
+
+class TestTombstonePurger:
+
+    @pytest.fixture
+    def database(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/purge.db")
+        monkeypatch.setattr(purge, "db", database)
+        monkeypatch.setattr(locks, "db", database)
+        yield database
+        asyncio.run(database.close())
+
+    async def seed(self, database) -> dict:
+        """A deleted project and a live one with an old / recent deleted model.
+        Soft deleted as the app does: a model with its columns (harvester), a
+        project with its models, columns, relations and views (importer).
+        Profiles and relations of a deleted column stay live."""
+        rows: dict = {entity: [] for entity in PURGE_ORDER}
+
+        def add(entity, deleted_at=None, **values):
+            rows[entity].append(audit(deleted_at) | values)
+            return rows[entity][-1]["id"]
+
+        project = {"type": "postgres", "catalog": "db", "schema": "public"}
+        for name, deleted_at in (("gone", OLD), ("live", None)):
+            project_id = add(Project, deleted_at, display_name=name, **project)
+            column_ids = []
+            for m, model_deleted_at in enumerate((None, OLD, RECENT)):
+                model_deleted_at = model_deleted_at or deleted_at
+                model_id = add(
+                    Model,
+                    model_deleted_at,
+                    project_id=project_id,
+                    display_name=f"m{m}",
+                    source_table_name=f"m{m}",
+                    reference_name=f"m{m}",
+                )
+                for c in range(2):
+                    column_ids.append(
+                        add(
+                            ModelColumn,
+                            model_deleted_at,
+                            model_id=model_id,
+                            is_calculated=False,
+                            display_name=f"c{c}",
+                            reference_name=f"c{c}",
+                            source_column_name=f"c{c}",
+                            type="integer",
+                            not_null=False,
+                            is_pk=False,
+                        )
+                    )
+                    add(
+                        ColumnProfile,
+                        column_id=column_ids[-1],
+                        type="integer",
+                        rows=0,
+                        nulls=0,
+                        hll=b"",
+                        cms=b"",
+                        profiled_at=OLD,
+                    )
+            for r, (from_id, to_id) in enumerate(((0, 2), (0, 4), (1, 0))):
+                add(
+                    ColumnRelation,
+                    deleted_at,
+                    project_id=project_id,
+                    name=f"r{r}",
+                    join_type="ONE_TO_ONE",
+                    condition="x = y",
+                    from_column_id=column_ids[from_id],
+                    to_column_id=column_ids[to_id],
+                )
+            add(
+                View,
+                deleted_at,
+                project_id=project_id,
+                name="v",
+                statement="select 1",
+                cached=False,
+            )
+
+        async with database.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            for entity in PURGE_ORDER:
+                await conn.execute(insert(entity), rows[entity])
+        return rows
+
+    async def count(self, database, table) -> int:
+        async with database.engine.connect() as conn:
+            return (await conn.execute(select(func.count()).select_from(table))).scalar()
+
+    def test_purge_cascades_into_archive(self, database):
+        async def run():
+            await self.seed(database)
+            counts = await TombstonePurger(timedelta(days=30), batch_size=2, pause=0).run(NOW)
+            remaining = {e.__tablename__: await self.count(database, e.__table__) for e in PURGE_ORDER}
+            archived = {e.__tablename__: await self.count(database, ARCHIVES[e]) for e in PURGE_ORDER}
+            return counts, remaining, archived
+
+        counts, remaining, archived = asyncio.run(run())
+        # The deleted project with all its rows, the old model of the live
+        # project with its columns and the relations to them
+        assert counts == {
+            "project": 1,
+            "model": 4,
+            "view": 1,
+            "model_column": 8,
+            "relation": 4,
+            "column_profile": 8,
+        }
+        assert remaining == {
+            "project": 1,
+            "model": 2,
+            "view": 1,
+            "model_column": 4,
+            "relation": 2,
+            "column_profile": 4,
+        }
+        assert archived == counts
+
+    def test_hard_delete_keeps_no_archive(self, database):
+        async def run():
+            await self.seed(database)
+            purger = TombstonePurger(timedelta(days=30), archive=False, pause=0)
+            counts = await purger.run(NOW)
+            return counts, await self.count(database, ARCHIVES[Model])
+
+        counts, archived = asyncio.run(run())
+        assert counts["model"] == 4
+        assert archived == 0
+
+    def test_live_rows_keep_what_they_reference(self, database):
+        async def run():
+            rows = await self.seed(database)
+            live = rows[Project][1]["id"]
+            model_id = next(
+                m["id"]
+                for m in rows[Model]
+                if m["project_id"] == live and m["deleted_at"] is None
+            )
+            # Soft deleted without its columns
+            async with database.engine.begin() as conn:
+                await conn.execute(
+                    update(Model).where(Model.id == model_id).values(deleted_at=OLD)
+                )
+            counts = await TombstonePurger(timedelta(days=30), pause=0).run(NOW)
+            async with database.engine.connect() as conn:
+                stored = await conn.execute(
+                    select(Model.id, func.count(ModelColumn.id))
+                    .join(ModelColumn, ModelColumn.model_id == Model.id)
+                    .where(Model.id == model_id)
+                    .group_by(Model.id)
+                )
+                return counts, stored.all()
+
+        counts, stored = asyncio.run(run())
+        assert counts["model"] == 4 and counts["model_column"] == 8
+        assert len(stored) == 1 and stored[0][1] == 2
+
+    def test_cascades_reference_purged_tables(self):
+        for parent, children in purge.CHILDREN.items():
+            for child, keys, _ in children:
+                assert all(hasattr(child, key) for key in keys)
+                assert child in PURGE_ORDER
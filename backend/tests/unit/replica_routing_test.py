@@ -0,0 +1,85 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import uuid7
+from backend.repository.project import Project, ProjectRepository
+
+
+def project(name: str) -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+        "type": "postgres",
+        "display_name": name,
+        "catalog": "db",
+        "schema": "public",
+    }
+
+
+class TestReplicaRouting:
+
+    @pytest.fixture
+    def database(self, tmp_path, monkeypatch):
+        database = DatabaseSession(
+            f"sqlite+aiosqlite:///{tmp_path}/primary.db",
+            [f"sqlite+aiosqlite:///{tmp_path}/replica_{i}.db" for i in range(2)],
+        )
+        monkeypatch.setattr(base_repository, "db", database)
+
+        # A different row in every database tells where a read went
+        async def seed():
+            engines = [database.engine, *database.replicas]
+            for name, engine in zip(("primary", "replica_0", "replica_1"), engines):
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.create_all)
+                    await conn.execute(insert(Project), [project(name)])
+
+        asyncio.run(seed())
+        yield database
+        asyncio.run(database.close())
+
+    def test_reads_round_robin_over_replicas(self, database):
+        repository = ProjectRepository(Project)
+
+        async def run():
+            return [(await repository.find_one_by({})).display_name for _ in range(4)]
+
+        assert asyncio.run(run()) == ["replica_0", "replica_1", "replica_0", "replica_1"]
+
+    def test_reads_after_a_write_stay_on_primary(self, database):
+        repository = ProjectRepository(Project)
+
+        async def run():
+            before = [row.display_name for row in await repository.find_all()]
+            created = await repository.create_one(Project(**project("new")))
+            after = {row.display_name for row in await repository.find_all()}
+            return before, created, after
+
+        before, created, after = asyncio.run(run())
+        assert before == ["replica_0"]
+        assert after == {"primary", "new"}
+        assert (
+            asyncio.run(repository.get_one_by_id(created.id)) is None
+        ), "a new request reads the replicas again"
+
+    def test_least_connections(self):
+        database = DatabaseSession(
+            "sqlite+aiosqlite://",
+            ["sqlite+aiosqlite://"] * 3,
+            replica_policy="least_connections",
+        )
+        database.replica_reads = [2, 0, 1]
+        assert database.pick_replica() == 1
+        database.replica_reads = [0, 0, 0]
+        assert {database.pick_replica() for _ in range(3)} == {0, 1, 2}
+        with pytest.raises(ValueError):
+            DatabaseSession("sqlite+aiosqlite://", replica_policy="random")
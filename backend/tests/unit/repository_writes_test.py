@@ -0,0 +1,368 @@
+import asyncio
+import os
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import (
+    WriteEvent,
+    add_write_listener,
+    dispatch_write,
+    remove_write_listener,
+    uuid7,
+)
+from backend.repository.cache import MISSING, EntityCache
+from backend.repository.model import Model, ModelRepository
+from backend.repository.project import Project
+
+# Optional postgres to run the writes on as well (its own statements: UPDATE
+# ... FROM (VALUES ...), ON CONFLICT on partial indexes), in a database of
+# the test created and dropped next to it
+TEST_POSTGRES_URL = os.environ.get("TEST_POSTGRES_URL")
+TEST_DATABASE = "repository_writes_test"
+
+
+def audit(n: int = 0) -> dict:
+    at = datetime(2024, 1, 1, 0, n)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+def model_row(project_id: str, name: str, n: int = 0, **values) -> dict:
+    return (
+        audit(n)
+        | {
+            "project_id": project_id,
+            "display_name": name,
+            "source_table_name": name,
+            "reference_name": name,
+            # Every row has the same keys: one executemany
+            "deleted_at": None,
+        }
+        | values
+    )
+
+
+async def recreate_database(drop_only: bool = False) -> None:
+    server = create_async_engine(TEST_POSTGRES_URL, isolation_level="AUTOCOMMIT")
+    try:
+        async with server.connect() as conn:
+            await conn.execute(text(f"DROP DATABASE IF EXISTS {TEST_DATABASE} WITH (FORCE)"))
+            if not drop_only:
+                await conn.execute(text(f"CREATE DATABASE {TEST_DATABASE}"))
+    finally:
+        await server.dispose()
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def catalog(request, tmp_path, monkeypatch):
+    """Repository database with a project and its models orders (live),
+    customers (live) and returns (soft deleted)."""
+    if request.param == "postgres":
+        if TEST_POSTGRES_URL is None:
+            pytest.skip("TEST_POSTGRES_URL is not set")
+        asyncio.run(recreate_database())
+        url = make_url(TEST_POSTGRES_URL).set(database=TEST_DATABASE)
+        database = DatabaseSession(url.render_as_string(hide_password=False))
+    else:
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+    monkeypatch.setattr(base_repository, "db", database)
+
+    project = audit() | {"type": "postgres", "display_name": "p", "catalog": "db", "schema": "public"}
+    models = {
+        "orders": model_row(project["id"], "orders", 0),
+        "customers": model_row(project["id"], "customers", 1),
+        "returns": model_row(project["id"], "returns", 2, deleted_at=datetime(2024, 2, 1)),
+    }
+
+    async def seed():
+        async with database.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(Project), [project])
+            await conn.execute(insert(Model), list(models.values()))
+
+    run(database, seed())
+    events: list[WriteEvent] = []
+    add_write_listener(events.append)
+    yield database, project["id"], {name: row["id"] for name, row in models.items()}, events
+    remove_write_listener(events.append)
+    if request.param == "postgres":
+        asyncio.run(recreate_database(drop_only=True))
+
+
+def run(database: DatabaseSession, coro):
+    """Run coro in a loop of its own, the database connections do not outlive it."""
+
+    async def main():
+        try:
+            return await coro
+        finally:
+            await database.close()
+
+    return asyncio.run(main())
+
+
+async def stored(database: DatabaseSession, *columns) -> dict:
+    """Rows of the model table by reference_name, live or not."""
+    async with database.engine.connect() as conn:
+        result = await conn.execute(select(Model.reference_name, *columns))
+        return {row[0]: tuple(row[1:]) for row in result}
+
+
+class TestReturningWrites:
+
+    def test_create_one_returns_the_stored_entity(self, catalog):
+        database, project_id, ids, events = catalog
+        repository = ModelRepository(Model)
+
+        async def main():
+            created = await repository.create_one(
+                Model(
+                    project_id=project_id,
+                    display_name="Items",
+                    source_table_name="items",
+                    reference_name="items",
+                )
+            )
+            return created, await stored(database, Model.id, Model.display_name)
+
+        created, rows = run(database, main())
+        assert created.id is not None and created.created_at is not None
+        assert created.display_name == "Items" and created.deleted_at is None
+        assert rows["items"] == (created.id, "Items")
+        assert events == [WriteEvent("model", "create", (created.id,))]
+
+    def test_update_one_only_matches_live_rows(self, catalog):
+        database, project_id, ids, events = catalog
+        repository = ModelRepository(Model)
+
+        async def main():
+            updated = await repository.update_one(ids["orders"], {"display_name": "Orders"})
+            with pytest.raises(ValueError, match="not found"):
+                await repository.update_one(ids["returns"], {"display_name": "Returns"})
+            return updated, await stored(database, Model.display_name, Model.updated_at)
+
+        updated, rows = run(database, main())
+        assert updated.id == ids["orders"] and updated.display_name == "Orders"
+        assert rows["orders"][0] == "Orders" and rows["orders"][1] > datetime(2024, 1, 1)
+        assert rows["returns"][0] == "returns"
+        assert events == [WriteEvent("model", "update", (ids["orders"],))]
+
+    def test_deletes_report_the_rows_they_removed(self, catalog):
+        database, project_id, ids, events = catalog
+        repository = ModelRepository(Model)
+        missing = uuid7()
+
+        async def main():
+            soft_deleted = await repository.soft_delete_many(
+                [ids["orders"], ids["returns"], missing]
+            )
+            again = await repository.soft_delete_one(ids["orders"])
+            deleted = await repository.delete_many([ids["customers"], ids["returns"], missing])
+            return soft_deleted, again, deleted, await stored(database, Model.deleted_at)
+
+        soft_deleted, again, deleted, rows = run(database, main())
+        assert (soft_deleted, again, deleted) == (1, 0, 1)
+        assert rows["orders"][0] is not None
+        # delete_many leaves tombstones alone
+        assert set(rows) == {"orders", "returns"}
+        assert events == [
+            WriteEvent("model", "soft_delete", (ids["orders"],)),
+            WriteEvent("model", "delete", (ids["customers"],)),
+        ]
+
+
+class TestBatchWrites:
+
+    def test_update_many(self, catalog):
+        database, project_id, ids, events = catalog
+        repository = ModelRepository(Model, cache=EntityCache())
+
+        async def main():
+            cached = await repository.get_one_by_id(ids["orders"])
+            count = await repository.update_many(
+                [
+                    {"id": ids["orders"], "display_name": "Orders"},
+                    # Another shape of changed columns, another statement
+                    {"id": ids["customers"], "display_name": "Customers", "ref_sql": "select 1"},
+                    {"id": ids["returns"], "display_name": "Returns"},
+                    {"id": uuid7(), "display_name": "Missing"},
+                ],
+                {"batch_size": 1},
+            )
+            return (
+                cached,
+                count,
+                await repository.get_one_by_id(ids["orders"]),
+                await stored(database, Model.display_name, Model.ref_sql, Model.updated_at),
+            )
+
+        cached, count, orders, rows = run(database, main())
+        assert cached.display_name == "orders" and orders.display_name == "Orders"
+        assert count == 2
+        assert rows["customers"][:2] == ("Customers", "select 1")
+        assert rows["customers"][2] > datetime(2024, 1, 1)
+        # Soft deleted rows are not matched
+        assert rows["returns"][0] == "returns"
+        assert [(e.action, set(e.ids)) for e in events] == [
+            ("update", {ids["orders"], ids["customers"]})
+        ]
+
+    def test_upsert_many(self, catalog):
+        database, project_id, ids, events = catalog
+        repository = ModelRepository(Model, cache=EntityCache())
+
+        def row(name: str, display_name: str) -> dict:
+            return {
+                "project_id": project_id,
+                "reference_name": name,
+                "source_table_name": name,
+                "display_name": display_name,
+            }
+
+        async def main():
+            cached = await repository.get_one_by_id(ids["customers"])
+            changed = await repository.upsert_many(
+                [
+                    row("orders", "orders"),
+                    row("customers", "Customers"),
+                    row("items", "items"),
+                    row("returns", "returns"),
+                ],
+                {"batch_size": 2},
+            )
+            return (
+                cached,
+                changed,
+                await repository.get_one_by_id(ids["customers"]),
+                await repository.find_all_by({"project_id": project_id}),
+                await stored(database, Model.updated_at),
+            )
+
+        cached, changed, customers, live, rows = run(database, main())
+        by_name = {model.reference_name: model for model in live}
+        assert set(by_name) == {"orders", "customers", "items", "returns"}
+        # Existing rows keep their id, identical ones are left untouched
+        assert by_name["customers"].id == ids["customers"]
+        assert by_name["orders"].id == ids["orders"]
+        assert rows["orders"][0] == datetime(2024, 1, 1, 0, 0)
+        # The natural key only conflicts with live rows: a tombstone is not revived
+        assert by_name["returns"].id != ids["returns"]
+        assert set(changed) == {ids["customers"], by_name["items"].id, by_name["returns"].id}
+        assert cached.display_name == "customers" and customers.display_name == "Customers"
+        assert [(e.action, set(e.ids)) for e in events] == [("upsert", set(changed))]
+
+
+class TestBulkInsert:
+
+    @pytest.mark.parametrize("copy", [False, True])
+    def test_create_many_in_batches(self, catalog, copy):
+        database, project_id, ids, events = catalog
+        cache = EntityCache()
+        repository = ModelRepository(Model, cache=cache)
+        rows = [model_row(project_id, f"t{n}", n) for n in range(5)]
+        # Keys left to the defaults are filled in
+        del rows[0]["id"], rows[0]["created_at"]
+        instance = Model(
+            project_id=project_id,
+            display_name="Items",
+            source_table_name="items",
+            reference_name="items",
+        )
+
+        async def main():
+            # Negatively cached before the insert
+            missing = await repository.get_one_by_id(rows[1]["id"])
+            created = await repository.create_many(
+                [rows[0], instance] + rows[1:3],
+                {"bulk": True, "copy": copy, "batch_size": 2},
+            )
+            unreturned = await repository.create_many(
+                (row for row in rows[3:]),
+                {"bulk": True, "copy": copy, "batch_size": 2, "return_ids": False},
+            )
+            return (
+                missing,
+                created,
+                unreturned,
+                await repository.get_one_by_id(rows[1]["id"]),
+                await stored(database, Model.id, Model.created_at),
+            )
+
+        missing, created, unreturned, cached, stored_rows = run(database, main())
+        assert missing is None and cached.reference_name == "t1"
+        names = ["t0", "items", "t1", "t2"]
+        assert created == [stored_rows[name][0] for name in names]
+        assert created[2:] == [rows[1]["id"], rows[2]["id"]]
+        assert stored_rows["t0"][1] is not None
+        assert unreturned == []
+        assert {"t3", "t4"} <= set(stored_rows)
+        # One event per call, with every row of its batches
+        assert [(e.action, set(e.ids)) for e in events] == [
+            ("create", set(created)),
+            ("create", {rows[3]["id"], rows[4]["id"]}),
+        ]
+
+
+class TestEntityCache:
+
+    def test_writes_invalidate_the_entity_cache(self, catalog):
+        database, project_id, ids, events = catalog
+        cache = EntityCache()
+        repository = ModelRepository(Model, cache=cache)
+        # Writes of any repository of the table reach the cache
+        writer = ModelRepository(Model)
+
+        async def main():
+            before = await repository.get_one_by_id(ids["orders"])
+            again = await repository.get_one_by_id(ids["orders"])
+            hits = cache.hits
+            await writer.update_one(ids["orders"], {"display_name": "Orders"})
+            updated = await repository.get_one_by_id(ids["orders"])
+            await writer.soft_delete_one(ids["orders"])
+            deleted = await repository.get_one_by_id(ids["orders"])
+            customers = await repository.get_one_by_id(ids["customers"])
+            await writer.delete_one(ids["customers"])
+            return (
+                before,
+                again,
+                hits,
+                updated,
+                deleted,
+                customers,
+                await repository.get_one_by_id(ids["customers"]),
+            )
+
+        before, again, hits, updated, deleted, customers, removed = run(database, main())
+        assert before.display_name == again.display_name == "orders"
+        assert hits == 1
+        assert updated.display_name == "Orders"
+        assert deleted is None
+        assert customers is not None and removed is None
+        assert cache.get(ids["orders"]) is cache.get(ids["customers"]) is MISSING
+
+    def test_invalidation_during_a_read_is_not_overwritten(self, catalog, monkeypatch):
+        database, project_id, ids, events = catalog
+        cache = EntityCache()
+        repository = ModelRepository(Model, cache=cache)
+        to_cache = repository.to_cache
+
+        def racing_to_cache(entity):
+            # A write committed after the row was read
+            dispatch_write(WriteEvent("model", "update", (entity.id,)))
+            return to_cache(entity)
+
+        monkeypatch.setattr(repository, "to_cache", racing_to_cache)
+        stale = run(database, repository.get_one_by_id(ids["orders"]))
+        assert stale.display_name == "orders"
+        assert cache.get(ids["orders"]) is None
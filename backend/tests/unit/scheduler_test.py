@@ -0,0 +1,175 @@
+import asyncio
+import random
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import (
+    WriteEvent,
+    add_write_listener,
+    remove_write_listener,
+    uuid7,
+)
+from backend.repository.model import Model
+from backend.repository.view import View
+from backend.service import scheduler
+from backend.service.scheduler import (
+    MAX_RETRY_DELAY,
+    REFRESH_SPREAD,
+    RefreshScheduler,
+    RefreshTarget,
+    parse_duration,
+)
+
+
+class TestRefreshScheduler:
+
+    def test_parse_duration(self):
+        assert parse_duration("2h") == 7200
+        assert parse_duration("30m") == 1800
+        assert parse_duration("1.5s") == 1.5
+        assert parse_duration("500ms") == 0.5
+        assert parse_duration("1d") == 86400
+
+    @pytest.mark.parametrize("value", ["", "2", "h", "2 hours", "-1h", "0s", None])
+    def test_parse_invalid_duration(self, value):
+        with pytest.raises(ValueError):
+            parse_duration(value)
+
+    def test_next_due_is_jittered_after_last_refresh(self):
+        scheduler = RefreshScheduler(rng=random.Random(1))
+        refreshed_at = datetime(2024, 1, 1, 12)
+        target = RefreshTarget("model", "1", "p1", 3600, refreshed_at)
+        now = refreshed_at.timestamp() + 60
+        dues = {scheduler.next_due(target, now) for _ in range(20)}
+        assert len(dues) > 1
+        assert all(
+            refreshed_at.timestamp() + 3600 <= due <= refreshed_at.timestamp() + 3960
+            for due in dues
+        )
+
+    def test_overdue_and_new_targets_are_spread(self):
+        scheduler = RefreshScheduler(rng=random.Random(1))
+        now = datetime(2024, 1, 1, 12).timestamp()
+        overdue = RefreshTarget("model", "1", "p1", 3600, datetime(2023, 1, 1))
+        new = RefreshTarget("model", "2", "p1", 3600)
+        for target in (overdue, new):
+            due = scheduler.next_due(target, now)
+            assert now <= due <= now + REFRESH_SPREAD
+
+    def test_failures_back_off(self):
+        scheduler = RefreshScheduler(rng=random.Random(1))
+        target = RefreshTarget("model", "1", "p1", 60, failures=1)
+        assert 15 <= scheduler.next_due(target, 0) <= 30
+        target.failures = 20
+        assert MAX_RETRY_DELAY / 2 <= scheduler.next_due(target, 0) <= MAX_RETRY_DELAY
+
+
+class TestRefreshSchedulerState:
+
+    @pytest.fixture
+    def catalog(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(scheduler, "db", database)
+        at = datetime(2024, 1, 1)
+        model = {
+            "id": uuid7(),
+            "created_at": at,
+            "updated_at": at,
+            "created_by": "test",
+            "updated_by": "test",
+            "project_id": uuid7(),
+            "display_name": "orders",
+            "source_table_name": "orders",
+            "reference_name": "orders",
+            "cached": True,
+            "refresh_time": "1h",
+        }
+        view = {
+            key: model[key]
+            for key in ("created_at", "updated_at", "created_by", "updated_by", "project_id")
+        } | {
+            "id": uuid7(),
+            "name": "recent_orders",
+            "statement": "select 1",
+            "cached": True,
+            "refresh_time": "1h",
+        }
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Model), [model])
+                await conn.execute(insert(View), [view])
+
+        asyncio.run(seed())
+        events: list[WriteEvent] = []
+        add_write_listener(events.append)
+        yield database, model, events
+        remove_write_listener(events.append)
+        asyncio.run(database.close())
+
+    def test_refreshed_at_is_not_an_edit(self, catalog):
+        database, model, events = catalog
+        refreshed = []
+
+        async def refresh(target):
+            refreshed.append(target.id)
+
+        async def run():
+            target = RefreshTarget("model", model["id"], model["project_id"], 3600)
+            await RefreshScheduler(refresh=refresh).refresh_locked(target)
+            async with database.engine.connect() as conn:
+                row = (
+                    await conn.execute(
+                        select(Model.updated_at, Model.refreshed_at).where(Model.id == model["id"])
+                    )
+                ).one()
+            return target, row
+
+        target, (updated_at, refreshed_at) = asyncio.run(run())
+        assert refreshed == [model["id"]]
+        assert refreshed_at == target.refreshed_at
+        assert updated_at == model["updated_at"]
+        assert events == []
+
+    def test_failed_reload_keeps_the_pending_targets(self, catalog, monkeypatch):
+        database, model, events = catalog
+        refresh_scheduler = RefreshScheduler()
+        load = refresh_scheduler.load
+
+        async def failing_load(ids=None):
+            raise OSError("connection lost")
+
+        async def run():
+            refresh_scheduler._on_write(WriteEvent("model", "update", (model["id"],)))
+            monkeypatch.setattr(refresh_scheduler, "load", failing_load)
+            with pytest.raises(OSError):
+                await refresh_scheduler.reload()
+            pending = {kind: set(ids) for kind, ids in refresh_scheduler._pending.items()}
+            monkeypatch.setattr(refresh_scheduler, "load", load)
+            await refresh_scheduler.reload()
+            return pending
+
+        pending = asyncio.run(run())
+        assert pending == {"model": {model["id"]}}
+        assert refresh_scheduler._pending == {"model": set()}
+        assert ("model", model["id"]) in refresh_scheduler.targets
+
+    def test_only_models_are_scheduled(self, catalog):
+        database, model, events = catalog
+        refresh_scheduler = RefreshScheduler()
+
+        async def run():
+            refresh_scheduler._on_write(WriteEvent("view", "update", (uuid7(),)))
+            pending = any(refresh_scheduler._pending.values())
+            await refresh_scheduler.load()
+            return pending
+
+        assert not asyncio.run(run())
+        assert list(refresh_scheduler.targets) == [("model", model["id"])]
+
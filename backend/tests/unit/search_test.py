@@ -0,0 +1,134 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import remove_write_listener, uuid7
+from backend.repository.model import Model, ModelRepository
+from backend.repository.project import Project
+from backend.service import search
+from backend.service.search import CatalogSearch, TrigramIndex, trigrams
+
+
+def audit() -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+class TestTrigramIndex:
+
+    def test_trigrams_like_pg_trgm(self):
+        assert trigrams("Cat") == {"  c", " ca", "cat", "at "}
+
+    def test_ranked_search(self):
+        index = TrigramIndex(
+            [
+                ("model", "1", "1", "customer"),
+                ("model", "2", "2", "customer_orders"),
+                ("column", "3", "2", "order_date"),
+            ]
+        )
+        hits = index.search("customer")
+        assert [hit.id for hit in hits] == ["1", "2"]
+        assert hits[0].score == 1.0
+
+    def test_best_name_per_entity(self):
+        index = TrigramIndex(
+            [
+                ("model", "1", "1", "Orders"),
+                ("model", "1", "1", "orders_v2"),
+            ]
+        )
+        hits = index.search("orders")
+        assert len(hits) == 1
+        assert hits[0].name == "Orders"
+
+    def test_substring_match(self):
+        index = TrigramIndex([("column", "1", "9", "shipping_address_line")])
+        assert [hit.id for hit in index.search("address")] == ["1"]
+
+
+class TestCatalogSearch:
+
+    @pytest.fixture
+    def catalog(self, tmp_path, monkeypatch):
+        """Two projects with a model orders each."""
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(search, "db", database)
+        projects = [audit() | {"type": "sqlite", "display_name": name} for name in "ab"]
+        projects = [p | {"catalog": "main", "schema": "main"} for p in projects]
+        models = [
+            audit()
+            | {
+                "project_id": project["id"],
+                "display_name": "orders",
+                "source_table_name": "orders",
+                "reference_name": "orders",
+            }
+            for project in projects
+        ]
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), projects)
+                await conn.execute(insert(Model), models)
+
+        asyncio.run(seed())
+        service = CatalogSearch()
+        yield database, service, [p["id"] for p in projects], [m["id"] for m in models]
+        remove_write_listener(service._on_write)
+        asyncio.run(database.close())
+
+    def test_writes_only_drop_the_index_of_their_project(self, catalog):
+        database, service, (a, b), (orders_a, orders_b) = catalog
+        repository = ModelRepository(Model)
+
+        async def names(project_id: str, query: str) -> list:
+            return [hit.name for hit in await service.search(project_id, query)]
+
+        async def main():
+            await names(a, "orders")
+            await names(b, "orders")
+            index_b = service._indexes[b]
+            await repository.update_one(orders_a, {"display_name": "Purchases"})
+            renamed = await names(a, "purchases")
+            kept = service._indexes[b] is index_b
+            # Rows deleted for good are found in the loaded indexes
+            await repository.delete_one(orders_b)
+            return renamed, kept, await names(b, "orders")
+
+        renamed, kept, deleted = asyncio.run(main())
+        assert renamed == ["Purchases"]
+        assert kept
+        assert deleted == []
+
+    def test_write_during_an_index_build_is_not_lost(self, catalog, monkeypatch):
+        database, service, (a, b), (orders_a, orders_b) = catalog
+        load_documents = service.load_documents
+
+        async def racing_load(session, project_id):
+            documents = await load_documents(session, project_id)
+            # Committed after the build read the rows
+            await ModelRepository(Model).update_one(orders_a, {"display_name": "Purchases"})
+            return documents
+
+        async def main():
+            monkeypatch.setattr(service, "load_documents", racing_load)
+            first = await service.search(a, "purchases")
+            monkeypatch.setattr(service, "load_documents", load_documents)
+            return first, await service.search(a, "purchases")
+
+        first, second = asyncio.run(main())
+        assert first == []
+        assert [hit.name for hit in second] == ["Purchases"]
@@ -0,0 +1,171 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import remove_write_listener, uuid7
+from backend.repository.model import Model, ModelRepository
+from backend.repository.model_column import ModelColumn, ModelColumnRepository
+from backend.repository.project import Project
+from backend.service import snapshot
+from backend.service.snapshot import CatalogSnapshot, CatalogSnapshots, ColumnRecord, ModelRecord
+
+
+def audit(n: int = 0) -> dict:
+    at = datetime(2024, 1, 1, 0, n)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+    }
+
+
+def column_row(model_id: str, name: str, n: int = 0) -> dict:
+    return audit(n) | {
+        "model_id": model_id,
+        "is_calculated": False,
+        "display_name": name,
+        "reference_name": name,
+        "source_column_name": name,
+        "type": "integer",
+        "not_null": False,
+        "is_pk": False,
+    }
+
+
+def model_record(id: str, name: str) -> ModelRecord:
+    return ModelRecord(id, name, name, name, None, None, None, None)
+
+
+def column_record(id: str, model_id: str, name: str) -> ColumnRecord:
+    return ColumnRecord(id, model_id, name, name, name, "integer", False, False, False, None, None, None, None)
+
+
+class TestCatalogSnapshot:
+
+    def test_indexes_and_column_ranges(self):
+        models = [model_record("m2", "orders"), model_record("m1", "customers"), model_record("m3", "empty")]
+        columns = [
+            column_record("c1", "m2", "id"),
+            column_record("c2", "m1", "id"),
+            column_record("c3", "m2", "amount"),
+            column_record("c4", "gone", "x"),
+        ]
+        snapshot = CatalogSnapshot("p1", models, columns)
+        assert [m.reference_name for m in snapshot.models] == ["customers", "empty", "orders"]
+        assert list(snapshot.offsets) == [0, 1, 1, 3]
+        assert [c.id for c in snapshot.columns_of("m2")] == ["c1", "c3"]
+        assert snapshot.columns_of("m3") == () and snapshot.columns_of("x") == ()
+        assert snapshot.model_by_name("orders").id == "m2"
+        assert snapshot.column("c3").reference_name == "amount"
+        assert snapshot.column("c4") is None
+        assert snapshot.column_by_name("m2", "amount").id == "c3"
+        assert CatalogSnapshot("p1", models, columns).version > snapshot.version
+
+    def test_is_immutable(self):
+        snapshot = CatalogSnapshot("p1", [model_record("m1", "orders")], [])
+        with pytest.raises(AttributeError):
+            snapshot.models = ()
+        with pytest.raises(AttributeError):
+            snapshot.extra = 1
+        with pytest.raises(AttributeError):
+            snapshot.models[0].reference_name = "x"
+
+
+class TestCatalogSnapshots:
+
+    @pytest.fixture
+    def catalog(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(snapshot, "db", database)
+        project = audit() | {"type": "postgres", "display_name": "p", "catalog": "db", "schema": "public"}
+        orders = audit() | {
+            "project_id": project["id"],
+            "display_name": "orders",
+            "source_table_name": "orders",
+            "reference_name": "orders",
+        }
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Project), [project])
+                await conn.execute(insert(Model), [orders])
+                await conn.execute(
+                    insert(ModelColumn),
+                    [column_row(orders["id"], "id", 0), column_row(orders["id"], "amount", 1)],
+                )
+
+        asyncio.run(seed())
+        snapshots = CatalogSnapshots()
+        yield snapshots, project["id"], orders["id"]
+        remove_write_listener(snapshots._on_write)
+        asyncio.run(database.close())
+
+    def test_snapshot_is_swapped_after_writes(self, catalog):
+        snapshots, project_id, model_id = catalog
+        columns = ModelColumnRepository(ModelColumn)
+
+        async def run():
+            first = await snapshots.get(project_id)
+            assert await snapshots.get(project_id) is first
+            await columns.create_many([column_row(model_id, "status", 2)], {"bulk": True})
+            second = await snapshots.get(project_id)
+            await columns.soft_delete_one(first.column_by_name(model_id, "id").id)
+            third = await snapshots.get(project_id)
+            return first, second, third, await snapshots.get(uuid7())
+
+        first, second, third, missing = asyncio.run(run())
+        assert [c.reference_name for c in first.columns_of(model_id)] == ["id", "amount"]
+        assert [c.reference_name for c in second.columns_of(model_id)] == ["id", "amount", "status"]
+        assert [c.reference_name for c in third.columns_of(model_id)] == ["amount", "status"]
+        assert first.version < second.version < third.version
+        assert missing is None
+
+    def test_failed_rebuild_keeps_the_pending_ids(self, catalog, monkeypatch):
+        snapshots, project_id, model_id = catalog
+        columns = ModelColumnRepository(ModelColumn)
+
+        async def failing_build(session, project_id):
+            raise OSError("connection lost")
+
+        async def run():
+            first = await snapshots.get(project_id)
+            await columns.create_many([column_row(model_id, "status", 2)], {"bulk": True})
+            build = snapshots.build
+            monkeypatch.setattr(snapshots, "build", failing_build)
+            with pytest.raises(OSError):
+                await snapshots.get(project_id)
+            monkeypatch.setattr(snapshots, "build", build)
+            return first, await snapshots.get(project_id)
+
+        first, second = asyncio.run(run())
+        assert [c.reference_name for c in second.columns_of(model_id)] == ["id", "amount", "status"]
+        assert second.version > first.version
+
+    def test_write_during_a_build_is_not_lost(self, catalog, monkeypatch):
+        snapshots, project_id, model_id = catalog
+        models = ModelRepository(Model)
+        build = snapshots.build
+
+        async def racing_build(session, project_id):
+            built = await build(session, project_id)
+            # Committed after the build read the rows
+            await models.update_one(model_id, {"display_name": "Orders"})
+            return built
+
+        async def run():
+            monkeypatch.setattr(snapshots, "build", racing_build)
+            first = await snapshots.get(project_id)
+            monkeypatch.setattr(snapshots, "build", build)
+            return first, await snapshots.get(project_id)
+
+        first, second = asyncio.run(run())
+        assert first.model(model_id).display_name == "orders"
+        assert second.model(model_id).display_name == "Orders"
@@ -0,0 +1,140 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from backend.repository.base_repository import WriteEvent, remove_write_listener
+from backend.service.datasource import SourcePools
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def source(tmp_path, id: str, database: str = "source.db") -> SimpleNamespace:
+    return SimpleNamespace(
+        id=id, type="sqlite", schema=None, connection_info={"database": f"{tmp_path}/{database}"}
+    )
+
+
+class TestSourcePools:
+
+    @pytest.fixture
+    def pools(self):
+        clock = Clock()
+        pools = SourcePools(pool_size=2, max_pools=2, idle_timeout=60, clock=clock)
+        yield pools, clock
+        remove_write_listener(pools._on_write)
+
+    def test_engine_is_reused_across_leases(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            project = source(tmp_path, "p1")
+            async with pools.lease(project) as first:
+                pass
+            async with pools.connect(project) as conn:
+                assert (await conn.execute(text("SELECT 1"))).scalar() == 1
+            async with pools.lease(source(tmp_path, "p1")) as second:
+                pass
+            await pools.stop()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first is second
+
+    def test_changed_connection_info_rebuilds_the_pool(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            async with pools.lease(source(tmp_path, "p1")) as first:
+                # Leased engines stay usable until their lease ends
+                async with pools.lease(source(tmp_path, "p1", "moved.db")) as second:
+                    pass
+                async with first.connect() as conn:
+                    await conn.execute(text("SELECT 1"))
+            await pools.stop()
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first is not second
+        assert str(second.url).endswith("moved.db")
+
+    def test_least_recently_used_pool_is_evicted(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            for id in ("p1", "p2", "p1", "p3"):
+                async with pools.lease(source(tmp_path, id)):
+                    pass
+            ids = list(pools.pools)
+            await pools.stop()
+            return ids
+
+        assert asyncio.run(run()) == ["p1", "p3"]
+
+    def test_leased_pools_are_not_evicted(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            async with pools.lease(source(tmp_path, "p1")):
+                async with pools.lease(source(tmp_path, "p2")):
+                    async with pools.lease(source(tmp_path, "p3")):
+                        ids = list(pools.pools)
+            await pools.stop()
+            return ids
+
+        assert asyncio.run(run()) == ["p1", "p2", "p3"]
+
+    def test_idle_pools_are_evicted(self, tmp_path, pools):
+        pools, clock = pools
+
+        async def run():
+            async with pools.lease(source(tmp_path, "p1")):
+                pass
+            clock.now = 30
+            async with pools.lease(source(tmp_path, "p2")):
+                pass
+            clock.now = 70
+            pools.evict()
+            ids = list(pools.pools)
+            await pools.stop()
+            return ids
+
+        assert asyncio.run(run()) == ["p2"]
+
+    def test_project_writes_drop_the_pool(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            async with pools.lease(source(tmp_path, "p1")):
+                pass
+            async with pools.lease(source(tmp_path, "p2")):
+                pass
+            pools._on_write(WriteEvent("project", "update", ("p1",)))
+            pools._on_write(WriteEvent("model", "update", ("p2",)))
+            ids = list(pools.pools)
+            await pools.stop()
+            return ids
+
+        assert asyncio.run(run()) == ["p2"]
+
+    def test_failing_health_check_drops_the_pool(self, tmp_path, pools):
+        pools, _ = pools
+
+        async def run():
+            async with pools.lease(source(tmp_path, "p1")):
+                pass
+            async with pools.lease(source(tmp_path, "missing", "missing/source.db")):
+                pass
+            await pools.check()
+            ids = list(pools.pools)
+            await pools.stop()
+            return ids
+
+        assert asyncio.run(run()) == ["p1"]
@@ -0,0 +1,114 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import case, insert
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import uuid7
+from backend.repository.model import Model, ModelRepository
+
+
+def model(project_id: str, n: int) -> dict:
+    at = datetime(2024, 1, 1 + n)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+        "project_id": project_id,
+        "display_name": f"m{n}",
+        "source_table_name": f"m{n}",
+        "reference_name": f"m{n}",
+        "refresh_time": "1h" if n % 2 else None,
+    }
+
+
+class TestStatementCache:
+
+    @pytest.fixture
+    def models(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/catalog.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        project_id = uuid7()
+
+        async def seed():
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                await conn.execute(insert(Model), [model(project_id, n) for n in range(6)])
+
+        asyncio.run(seed())
+        yield ModelRepository(Model), project_id
+        asyncio.run(database.close())
+
+    def test_statement_is_built_once_per_shape(self):
+        repository = ModelRepository(Model)
+        first, params = repository.statement_by({"project_id": uuid7()}, {"in": {"id": [1]}})
+        second, _ = repository.statement_by({"project_id": uuid7()}, {"in": {"id": [1, 2]}})
+        assert first is second
+        assert set(params) == {"eq_project_id", "in_id"}
+        other, _ = repository.statement_by({"project_id": uuid7()}, {"limit": 5})
+        assert other is not first
+        null, params = repository.statement_by({"refresh_time": None})
+        assert params == {} and "refresh_time IS NULL" in str(null)
+
+    def test_order_by_expressions(self):
+        repository = ModelRepository(Model)
+        first, _ = repository.statement_by({}, {"order_by": Model.created_at.desc()})
+        second, _ = repository.statement_by({}, {"order_by": Model.created_at.desc()})
+        assert first is second
+        ascending, _ = repository.statement_by({}, {"order_by": Model.created_at})
+        assert ascending is not first
+
+    def test_order_by_literals(self, models):
+        repository, project_id = models
+
+        def first(name: str):
+            return case((Model.reference_name == name, 0), else_=1), "reference_name"
+
+        async def run():
+            # Render alike, only the literal differs
+            by_project = {"project_id": project_id}
+            return [
+                await repository.find_all_by(by_project, {"order_by": first(name)})
+                for name in ("m5", "m3")
+            ]
+
+        five, three = asyncio.run(run())
+        assert [m.reference_name for m in five] == ["m5", "m0", "m1", "m2", "m3", "m4"]
+        assert [m.reference_name for m in three] == ["m3", "m0", "m1", "m2", "m4", "m5"]
+
+    def test_unknown_column(self):
+        with pytest.raises(ValueError, match="no column"):
+            ModelRepository(Model).statement_by({"name": "x"})
+
+    def test_query_options(self, models):
+        repository, project_id = models
+
+        async def run():
+            by_project = {"project_id": project_id}
+            ranged = await repository.find_all_by(
+                by_project,
+                {
+                    "range": {"created_at": (datetime(2024, 1, 2), datetime(2024, 1, 5))},
+                    "order_by": Model.created_at.desc(),
+                },
+            )
+            within = await repository.find_all_by(
+                by_project, {"in": {"reference_name": ["m0", "m5", "x"]}, "order_by": "reference_name"}
+            )
+            limited = await repository.find_all_by(by_project, {"order_by": "created_at", "limit": 2})
+            projected = await repository.find_all_by(
+                {"refresh_time": None}, {"columns": ["reference_name"], "order_by": "reference_name"}
+            )
+            one = await repository.find_one_by(by_project, {"order_by": Model.created_at.desc()})
+            return ranged, within, limited, projected, one
+
+        ranged, within, limited, projected, one = asyncio.run(run())
+        assert [m.reference_name for m in ranged] == ["m3", "m2", "m1"]
+        assert [m.reference_name for m in within] == ["m0", "m5"]
+        assert [m.reference_name for m in limited] == ["m0", "m1"]
+        assert [tuple(row) for row in projected] == [("m0",), ("m2",), ("m4",)]
+        assert one.reference_name == "m5"
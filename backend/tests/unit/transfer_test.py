@@ -0,0 +1,225 @@
+import asyncio
+import io
+import json
+from datetime import datetime
+
+import pyarrow as pa
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.orm import aliased
+
+from backend.config import Base, DatabaseSession
+from backend.repository import base_repository
+from backend.repository.base_repository import uuid7
+from backend.repository.column_relation import ColumnRelation
+from backend.repository.model import Model
+from backend.repository.model_column import ModelColumn
+from backend.repository.project import Project
+from backend.repository.view import View
+from backend.service import transfer
+from backend.service.transfer import CatalogExporter, CatalogImporter
+
+
+def audit(deleted_at=None) -> dict:
+    at = datetime(2024, 1, 1)
+    return {
+        "id": uuid7(),
+        "created_at": at,
+        "updated_at": at,
+        "created_by": "test",
+        "updated_by": "test",
+        "deleted_at": deleted_at,
+    }
+
+
+class TestCatalogTransfer:
+
+    @pytest.fixture
+    def database(self, tmp_path, monkeypatch):
+        database = DatabaseSession(f"sqlite+aiosqlite:///{tmp_path}/transfer.db")
+        monkeypatch.setattr(base_repository, "db", database)
+        monkeypatch.setattr(transfer, "db", database)
+
+        async def seed():
+            project = audit() | {
+                "type": "postgres",
+                "display_name": "shop",
+                "catalog": "db",
+                "schema": "public",
+                "connection_info": {"password": "secret"},
+            }
+            models, columns = [], []
+            for m, deleted_at in enumerate((None, None, datetime(2024, 2, 1))):
+                models.append(
+                    audit(deleted_at)
+                    | {
+                        "project_id": project["id"],
+                        "display_name": f"m{m}",
+                        "source_table_name": f"m{m}",
+                        "reference_name": f"m{m}",
+                        "properties": {"description": f"model {m}"},
+                    }
+                )
+                for c in range(3):
+                    columns.append(
+                        audit()
+                        | {
+                            "model_id": models[-1]["id"],
+                            "is_calculated": c == 2,
+                            "display_name": f"c{c}",
+                            "reference_name": f"c{c}",
+                            "source_column_name": f"c{c}",
+                            "type": "integer",
+                            "not_null": c == 0,
+                            "is_pk": c == 0,
+                            "lineage": json.dumps([columns[-1]["id"]]) if c == 2 else None,
+                        }
+                    )
+            relation = audit() | {
+                "project_id": project["id"],
+                "name": "m0_m1",
+                "join_type": "ONE_TO_MANY",
+                "condition": "m0.c0 = m1.c1",
+                "from_column_id": columns[0]["id"],
+                "to_column_id": columns[4]["id"],
+            }
+            view = audit() | {
+                "project_id": project["id"],
+                "name": "v",
+                "statement": "select 1",
+                "cached": False,
+            }
+            async with database.engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+                for entity, rows in (
+                    (Project, [project]),
+                    (Model, models),
+                    (ModelColumn, columns),
+                    (ColumnRelation, [relation]),
+                    (View, [view]),
+                ):
+                    await conn.execute(insert(entity), rows)
+            return project["id"]
+
+        project_id = asyncio.run(seed())
+        yield database, project_id
+        asyncio.run(database.close())
+
+    def export(self, project_id, batch_size=2) -> bytes:
+        file = io.BytesIO()
+        asyncio.run(CatalogExporter(batch_size).write(project_id, file))
+        return file.getvalue()
+
+    def test_export_is_one_stream_per_table(self, database):
+        _, project_id = database
+        source = io.BytesIO(self.export(project_id))
+        rows = {}
+        for _ in range(5):
+            reader = pa.ipc.open_stream(source)
+            rows[reader.schema.metadata[b"table"].decode()] = reader.read_all().to_pylist()
+        assert {table: len(values) for table, values in rows.items()} == {
+            "project": 1,
+            "model": 2,
+            "model_column": 6,
+            "relation": 1,
+            "view": 1,
+        }
+        assert rows["project"][0]["connection_info"] is None
+        properties = {row["reference_name"]: row["properties"] for row in rows["model"]}
+        assert json.loads(properties["m0"]) == {"description": "model 0"}
+        assert "deleted_at" not in rows["model"][0]
+
+    def test_import_remaps_every_key(self, database):
+        database, project_id = database
+        data = self.export(project_id)
+
+        async def load():
+            new_id = await CatalogImporter(batch_size=2).run(io.BytesIO(data), {"name": "copy"})
+            from_column, to_column = aliased(ModelColumn), aliased(ModelColumn)
+            async with database.session() as session:
+                project = await session.get(Project, new_id)
+                models = (
+                    await session.execute(select(Model).where(Model.project_id == new_id))
+                ).scalars().all()
+                columns = (
+                    await session.execute(
+                        select(ModelColumn).where(ModelColumn.model_id.in_([m.id for m in models]))
+                    )
+                ).scalars().all()
+                relations = (
+                    await session.execute(
+                        select(from_column.reference_name, to_column.reference_name)
+                        .select_from(ColumnRelation)
+                        .join(from_column, from_column.id == ColumnRelation.from_column_id)
+                        .join(to_column, to_column.id == ColumnRelation.to_column_id)
+                        .where(ColumnRelation.project_id == new_id)
+                    )
+                ).all()
+            return new_id, project, models, columns, relations
+
+        new_id, project, models, columns, relations = asyncio.run(load())
+        assert new_id != project_id
+        assert project.display_name == "copy"
+        assert {m.reference_name: m.properties for m in models} == {
+            "m0": {"description": "model 0"},
+            "m1": {"description": "model 1"},
+        }
+        assert len(columns) == 6
+        assert relations == [("c0", "c1")]
+        ids = {column.id for column in columns}
+        for column in columns:
+            if column.lineage:
+                assert set(json.loads(column.lineage)) <= ids
+
+    def test_import_rejects_other_versions(self, database):
+        _, project_id = database
+        data = self.export(project_id).replace(b"version", b"versiox", 1)
+        with pytest.raises(ValueError, match="Unsupported export version"):
+            asyncio.run(CatalogImporter().run(io.BytesIO(data)))
+
+    def test_failed_import_deletes_the_partial_project(self, database):
+        database, project_id = database
+        data = self.export(project_id)
+
+        async def load():
+            with pytest.raises(pa.ArrowInvalid):
+                await CatalogImporter().run(io.BytesIO(data[: len(data) // 2]))
+            async with database.session() as session:
+                projects = (await session.execute(select(Project))).scalars().all()
+            return projects
+
+        projects = asyncio.run(load())
+        assert len(projects) == 2
+        assert [p.id for p in projects if p.deleted_at is None] == [project_id]
+
+    def test_failed_import_leaves_no_live_rows(self, database, monkeypatch):
+        database, project_id = database
+        data = self.export(project_id)
+        importer = CatalogImporter(batch_size=2)
+
+        async def failing_create_many(rows, query_options=None):
+            raise OSError("connection lost")
+
+        # Fails after the models, columns and relations are imported
+        monkeypatch.setattr(importer.repositories["view"], "create_many", failing_create_many)
+
+        async def load():
+            with pytest.raises(OSError):
+                await importer.run(io.BytesIO(data))
+            live = {}
+            async with database.session() as session:
+                for entity in transfer.TABLES:
+                    result = await session.execute(
+                        select(entity.id).where(entity.deleted_at.is_(None))
+                    )
+                    live[entity.__tablename__] = len(result.all())
+            return live
+
+        # Only the rows of the exported project
+        assert asyncio.run(load()) == {
+            "project": 1,
+            "model": 2,
+            "model_column": 9,
+            "relation": 1,
+            "view": 1,
+        }
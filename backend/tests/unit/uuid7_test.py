@@ -0,0 +1,18 @@
+from uuid import UUID
+
+from backend.repository.base_repository import uuid7
+
+
+class TestUuid7:
+
+    def test_version_and_variant(self):
+        value = UUID(uuid7())
+        assert value.version == 7
+        assert value.variant == "specified in RFC 4122"
+
+    def test_time_ordered(self):
+        assert uuid7(1_000, 2**80 - 1) < uuid7(1_001, 0)
+        assert uuid7(1_700_000_000_000, 0).startswith("018bcfe5-6800-7000-8000")
+
+    def test_random_part(self):
+        assert len({uuid7(1_000) for _ in range(100)}) == 100